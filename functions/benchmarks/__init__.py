@@ -0,0 +1 @@
+# Offline benchmarks for agent-tree instantiation. Run with: python -m benchmarks.run_benchmarks
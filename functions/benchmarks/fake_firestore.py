@@ -0,0 +1,101 @@
+# functions/benchmarks/fake_firestore.py
+import asyncio
+import logging
+import sys
+import types
+from collections import Counter
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data: dict | None):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentRef:
+    def __init__(self, store: "FakeFirestore", collection_name: str, doc_id: str):
+        self._store = store
+        self.collection_name = collection_name
+        self.id = doc_id
+
+    async def get(self, field_paths=None, transaction=None):
+        self._store.calls["get"] += 1
+        await self._store.simulate_rpc()
+        return self._store.snapshot(self.collection_name, self.id)
+
+
+class FakeCollectionRef:
+    def __init__(self, store: "FakeFirestore", collection_name: str):
+        self._store = store
+        self.name = collection_name
+
+    def document(self, doc_id: str) -> FakeDocumentRef:
+        return FakeDocumentRef(self._store, self.name, doc_id)
+
+
+class FakeFirestore:
+    """
+    In-memory stand-in for the parts of the Firestore AsyncClient used while building agents:
+    collection().document().get() and get_all(). Every RPC sleeps rpc_latency_sec and is counted,
+    so batching and caching show up in both wall time and call counts.
+    """
+
+    def __init__(self, collections: dict[str, dict[str, dict]] | None = None, rpc_latency_sec: float = 0.005):
+        self.collections = collections or {}
+        self.rpc_latency_sec = rpc_latency_sec
+        self.calls = Counter()
+
+    async def simulate_rpc(self) -> None:
+        if self.rpc_latency_sec > 0:
+            await asyncio.sleep(self.rpc_latency_sec)
+
+    def snapshot(self, collection_name: str, doc_id: str) -> FakeSnapshot:
+        self.calls["documentsRead"] += 1
+        return FakeSnapshot(doc_id, self.collections.get(collection_name, {}).get(doc_id))
+
+    def collection(self, collection_name: str) -> FakeCollectionRef:
+        return FakeCollectionRef(self, collection_name)
+
+    async def get_all(self, refs, field_paths=None, transaction=None):
+        self.calls["getAll"] += 1
+        await self.simulate_rpc()
+        for ref in refs:
+            yield self.snapshot(ref.collection_name, ref.id)
+
+    def reset_counts(self) -> None:
+        self.calls.clear()
+
+    def call_counts(self) -> dict:
+        return {"get": self.calls["get"], "getAll": self.calls["getAll"], "documentsRead": self.calls["documentsRead"]}
+
+
+class _BenchmarkLogger(logging.LoggerAdapter):
+    """firebase_functions.logger-compatible surface (including warn) over a stdlib logger."""
+
+    def warn(self, msg, *args, **kwargs):
+        self.warning(msg, *args, **kwargs)
+
+
+def install_fake_core(fake_db: FakeFirestore, log_level: int = logging.WARNING) -> None:
+    """
+    Registers a 'common.core' module backed by fake_db, so common.* can be imported without
+    Firebase credentials. Must run before anything imports common.core.
+    """
+    if "common.core" in sys.modules and not getattr(sys.modules["common.core"], "IS_BENCHMARK_FAKE", False):
+        raise RuntimeError("common.core was imported before the fake could be installed.")
+    stdlib_logger = logging.getLogger("agentlab.benchmarks")
+    stdlib_logger.setLevel(log_level)
+    fake_core = types.ModuleType("common.core")
+    fake_core.IS_BENCHMARK_FAKE = True
+    fake_core.db = fake_db
+    fake_core.get_async_db = lambda: fake_db
+    fake_core.logger = _BenchmarkLogger(stdlib_logger, {})
+    fake_core.setup_global_options = lambda: None
+    sys.modules["common.core"] = fake_core
+
+
+__all__ = ['FakeFirestore', 'install_fake_core']
@@ -0,0 +1,187 @@
+# functions/benchmarks/run_benchmarks.py
+"""
+Offline benchmarks for building ADK agent trees from Firestore configs.
+
+Synthetic agent trees (see scenarios.py) are built against an in-memory 'models' collection
+with simulated RPC latency and stub Gofannon tool modules with simulated import cost, so no
+credentials or network access are needed. The packages in requirements.txt must be installed.
+
+Each scenario is built in two modes:
+  deploy  share_mcp_sessions=False, plain LiteLlm (what executeAgentDeployTask builds)
+  local   share_mcp_sessions=True, use_llm_router=True (local diagnostic runs)
+and two phases: "cold" (process caches cleared, tool modules unloaded) and "warm" (an immediate
+rebuild on the same event loop).
+
+Usage (from the functions/ directory):
+    python -m benchmarks.run_benchmarks --repeat 5 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from .fake_firestore import FakeFirestore, install_fake_core
+from .scenarios import SCENARIOS, build_model_docs, build_agent_config, count_nodes
+from .stub_tools import install_stub_tools, unload_stub_tools, stub_tool_config
+
+BUILD_MODES = {
+    "deploy": {"share_mcp_sessions": False, "use_llm_router": False},
+    "local": {"share_mcp_sessions": True, "use_llm_router": True},
+}
+
+
+def _reset_process_caches(adk_helpers, tool_registry) -> None:
+    adk_helpers._model_config_cache.clear()
+    tool_registry._tool_classes.clear()
+    tool_registry._module_import_timings.clear()
+    tool_registry._tool_spec_cache.clear()
+    unload_stub_tools()
+
+
+async def _build_session(adk_helpers, mcp_session_pool, fake_db, agent_config: dict, build_kwargs: dict, measure_memory: bool) -> dict:
+    """One cold build followed by one warm build on the same loop. Returns per-phase measurements."""
+    measurements = {}
+    for phase in ("cold", "warm"):
+        fake_db.reset_counts()
+        if measure_memory:
+            tracemalloc.start()
+        phase_start = time.perf_counter()
+        await adk_helpers.instantiate_adk_agent_from_config(agent_config, **build_kwargs)
+        wall_time_sec = time.perf_counter() - phase_start
+        peak_memory_bytes = None
+        if measure_memory:
+            peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        measurements[phase] = {"wallTimeSec": wall_time_sec, "firestore": fake_db.call_counts(), "peakMemoryBytes": peak_memory_bytes}
+    if build_kwargs.get("share_mcp_sessions"):
+        await mcp_session_pool.get_mcp_session_pool().close_all()
+    return measurements
+
+
+def _summarize(samples: list[float]) -> dict:
+    return {
+        "min": round(min(samples), 6),
+        "median": round(statistics.median(samples), 6),
+        "max": round(max(samples), 6)
+    }
+
+
+def run_scenario(modules, fake_db, scenario, mode_name: str, repeat: int) -> list[dict]:
+    adk_helpers, tool_registry, mcp_session_pool = modules
+    agent_config = build_agent_config(scenario)
+    fake_db.collections["models"] = build_model_docs(scenario.model_count)
+    nodes, leaves = count_nodes(agent_config)
+    build_kwargs = BUILD_MODES[mode_name]
+
+    wall_times = {"cold": [], "warm": []}
+    firestore_counts = {}
+    for _ in range(repeat):
+        _reset_process_caches(adk_helpers, tool_registry)
+        session = asyncio.run(_build_session(adk_helpers, mcp_session_pool, fake_db, agent_config, build_kwargs, measure_memory=False))
+        for phase, measurement in session.items():
+            wall_times[phase].append(measurement["wallTimeSec"])
+            firestore_counts[phase] = measurement["firestore"] # Deterministic across repeats
+
+    # tracemalloc slows allocation-heavy code down, so peak memory comes from a separate pass.
+    _reset_process_caches(adk_helpers, tool_registry)
+    memory_session = asyncio.run(_build_session(adk_helpers, mcp_session_pool, fake_db, agent_config, build_kwargs, measure_memory=True))
+
+    return [
+        {
+            "scenario": scenario.name,
+            "mode": mode_name,
+            "phase": phase,
+            "nodes": nodes,
+            "leaves": leaves,
+            "depth": scenario.depth,
+            "width": scenario.width,
+            "leafMix": list(scenario.leaf_mix),
+            "repeat": repeat,
+            "wallTimeSec": _summarize(wall_times[phase]),
+            "firestore": firestore_counts[phase],
+            "peakMemoryBytes": memory_session[phase]["peakMemoryBytes"]
+        }
+        for phase in ("cold", "warm")
+    ]
+
+
+def run_micro_benchmarks(modules, fake_db) -> list[dict]:
+    adk_helpers, _, _ = modules
+    results = []
+
+    names = [f"Benchmark Agent #{index} (v{index % 7})/{'x' * (index % 90)}" for index in range(2000)]
+    iterations = 10
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for name in names:
+            adk_helpers.sanitize_adk_agent_name(name)
+    elapsed = time.perf_counter() - start
+    results.append({"name": "sanitize_adk_agent_name", "calls": iterations * len(names), "usPerCall": round(elapsed / (iterations * len(names)) * 1e6, 3)})
+
+    fake_db.collections["models"] = build_model_docs(1)
+    merged_config = {
+        **fake_db.collections["models"]["bench_model_0"],
+        "name": "prepare_kwargs_leaf",
+        "tools": [stub_tool_config(index) for index in range(5)]
+    }
+
+    async def _prepare_many(call_count: int) -> float:
+        await adk_helpers._prepare_agent_kwargs_from_config(dict(merged_config), "prepare_kwargs_leaf") # Warm the tool caches
+        prepare_start = time.perf_counter()
+        for _ in range(call_count):
+            await adk_helpers._prepare_agent_kwargs_from_config(dict(merged_config), "prepare_kwargs_leaf")
+        return time.perf_counter() - prepare_start
+
+    call_count = 200
+    elapsed = asyncio.run(_prepare_many(call_count))
+    results.append({"name": "_prepare_agent_kwargs_from_config", "calls": call_count, "usPerCall": round(elapsed / call_count * 1e6, 3)})
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark agent-tree instantiation against a fake Firestore.")
+    parser.add_argument("--scenario", action="append", choices=[scenario.name for scenario in SCENARIOS], help="Run only these scenarios (repeatable).")
+    parser.add_argument("--mode", action="append", choices=list(BUILD_MODES), help="Run only these build modes (repeatable).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed sessions per scenario and mode.")
+    parser.add_argument("--rpc-latency-ms", type=float, default=5.0, help="Simulated latency of each Firestore RPC.")
+    parser.add_argument("--import-delay-ms", type=float, default=20.0, help="Simulated import time of each stub tool module.")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    fake_db = FakeFirestore(rpc_latency_sec=args.rpc_latency_ms / 1000.0)
+    install_fake_core(fake_db)
+    install_stub_tools(import_delay_sec=args.import_delay_ms / 1000.0)
+    from common import adk_helpers, tool_registry, mcp_session_pool # After the fakes are installed
+    modules = (adk_helpers, tool_registry, mcp_session_pool)
+
+    selected_scenarios = [scenario for scenario in SCENARIOS if not args.scenario or scenario.name in args.scenario]
+    selected_modes = args.mode or list(BUILD_MODES)
+    scenario_results = []
+    for scenario in selected_scenarios:
+        for mode_name in selected_modes:
+            scenario_results.extend(run_scenario(modules, fake_db, scenario, mode_name, max(1, args.repeat)))
+            print(f"[Benchmarks] {scenario.name}/{mode_name} done.", file=sys.stderr)
+
+    report = {
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "settings": {"rpcLatencyMs": args.rpc_latency_ms, "importDelayMs": args.import_delay_ms, "repeat": args.repeat},
+        "scenarios": scenario_results,
+        "micro": run_micro_benchmarks(modules, fake_db)
+    }
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report_json + "\n")
+        print(f"[Benchmarks] Report written to {args.output}.", file=sys.stderr)
+    else:
+        print(report_json)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# functions/benchmarks/scenarios.py
+import random
+from dataclasses import dataclass
+
+from .stub_tools import stub_tool_config
+
+# Never contacted: MCPToolset connects lazily, and agents are only built, not run.
+STUB_MCP_SERVER_URL = "http://127.0.0.1:9/mcp"
+
+LEAF_KINDS = ("gofannon", "mcp", "loop")
+
+
+@dataclass(frozen=True, slots=True)
+class Scenario:
+    name: str
+    depth: int # 0 is a single leaf agent
+    width: int # Children per composite agent
+    leaf_mix: tuple[str, ...] # Leaf kinds assigned round-robin, from LEAF_KINDS
+    model_count: int
+    tools_per_leaf: int
+    tool_module_count: int # Distinct stub modules the tools are drawn from
+
+
+SCENARIOS = (
+    Scenario("single_leaf", depth=0, width=1, leaf_mix=("gofannon",), model_count=1, tools_per_leaf=3, tool_module_count=3),
+    Scenario("flat_wide", depth=1, width=16, leaf_mix=("gofannon", "mcp", "loop"), model_count=4, tools_per_leaf=3, tool_module_count=12),
+    Scenario("deep_narrow", depth=5, width=2, leaf_mix=("gofannon", "loop"), model_count=3, tools_per_leaf=2, tool_module_count=8),
+    Scenario("balanced", depth=3, width=4, leaf_mix=("gofannon", "mcp", "loop"), model_count=6, tools_per_leaf=3, tool_module_count=20),
+    Scenario("mcp_heavy", depth=2, width=4, leaf_mix=("mcp",), model_count=2, tools_per_leaf=4, tool_module_count=1),
+)
+
+
+def build_model_docs(model_count: int) -> dict[str, dict]:
+    return {
+        f"bench_model_{model_index}": {
+            "name": f"Benchmark model {model_index}",
+            "provider": "openai",
+            "modelString": "gpt-4o-mini",
+            "litellm_api_key": "sk-benchmark-not-used",
+            "systemInstruction": "You are a benchmark agent.",
+            "temperature": 0.2,
+            "maxOutputTokens": 512
+        }
+        for model_index in range(model_count)
+    }
+
+
+def _leaf_config(scenario: Scenario, leaf_index: int, rng: random.Random) -> dict:
+    leaf_kind = scenario.leaf_mix[leaf_index % len(scenario.leaf_mix)]
+    if leaf_kind == "mcp":
+        tools = [
+            {"type": "mcp", "mcpServerUrl": STUB_MCP_SERVER_URL, "mcpToolName": f"mcp_tool_{rng.randrange(8)}"}
+            for _ in range(scenario.tools_per_leaf)
+        ]
+    else:
+        tools = [stub_tool_config(rng.randrange(scenario.tool_module_count)) for _ in range(scenario.tools_per_leaf)]
+    leaf_config = {
+        "name": f"{leaf_kind}_leaf_{leaf_index}",
+        "description": f"Synthetic {leaf_kind} leaf {leaf_index}",
+        "agentType": "LoopAgent" if leaf_kind == "loop" else "Agent",
+        "modelId": f"bench_model_{rng.randrange(scenario.model_count)}",
+        "tools": tools
+    }
+    if leaf_kind == "loop":
+        leaf_config["maxLoops"] = 3
+    return leaf_config
+
+
+def build_agent_config(scenario: Scenario, seed: int = 0) -> dict:
+    """Deterministic synthetic agent tree: composites alternate Sequential/Parallel by level."""
+    rng = random.Random(f"{scenario.name}:{seed}")
+    leaf_counter = iter(range(10 ** 6))
+
+    def _build(level: int) -> dict:
+        if level == scenario.depth:
+            return _leaf_config(scenario, next(leaf_counter), rng)
+        return {
+            "name": f"level_{level}_{'sequential' if level % 2 == 0 else 'parallel'}",
+            "agentType": "SequentialAgent" if level % 2 == 0 else "ParallelAgent",
+            "childAgents": [_build(level + 1) for _ in range(scenario.width)]
+        }
+
+    return _build(0)
+
+
+def count_nodes(agent_config: dict) -> tuple[int, int]:
+    """Returns (nodes, leaves) of an agent config tree."""
+    children = agent_config.get("childAgents") or []
+    if not children:
+        return 1, 1
+    child_counts = [count_nodes(child) for child in children]
+    return 1 + sum(nodes for nodes, _ in child_counts), sum(leaves for _, leaves in child_counts)
+
+
+__all__ = ['Scenario', 'SCENARIOS', 'build_model_docs', 'build_agent_config', 'count_nodes']
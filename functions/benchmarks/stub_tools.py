@@ -0,0 +1,83 @@
+# functions/benchmarks/stub_tools.py
+import importlib.abc
+import importlib.machinery
+import sys
+import time
+
+STUB_TOOL_PACKAGE = "benchmark_stub_tools"
+STUB_TOOL_CLASS_NAME = "StubTool"
+
+
+def _make_tool_function(tool_name: str):
+    def stub_tool(query: str) -> dict:
+        """Stub tool used by the benchmarks. Returns its input."""
+        return {"tool": tool_name, "query": query}
+    stub_tool.__name__ = tool_name
+    return stub_tool
+
+
+class StubTool:
+    """Gofannon-style tool: configured through kwargs and exported to ADK with export_to_adk()."""
+
+    def __init__(self, **configuration):
+        self.configuration = configuration
+
+    def export_to_adk(self):
+        return _make_tool_function(f"stub_{self.__module__.rsplit('.', 1)[-1]}")
+
+
+class _StubToolLoader(importlib.abc.Loader):
+    def __init__(self, import_delay_sec: float):
+        self.import_delay_sec = import_delay_sec
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        if module.__name__ == STUB_TOOL_PACKAGE:
+            module.__path__ = []
+            return
+        time.sleep(self.import_delay_sec) # Stands in for a heavy tool module's import-time work
+        stub_class = type(STUB_TOOL_CLASS_NAME, (StubTool,), {"__module__": module.__name__})
+        setattr(module, STUB_TOOL_CLASS_NAME, stub_class)
+
+
+class _StubToolFinder(importlib.abc.MetaPathFinder):
+    def __init__(self, import_delay_sec: float):
+        self.loader = _StubToolLoader(import_delay_sec)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname == STUB_TOOL_PACKAGE or fullname.startswith(STUB_TOOL_PACKAGE + "."):
+            return importlib.machinery.ModuleSpec(fullname, self.loader, is_package=fullname == STUB_TOOL_PACKAGE)
+        return None
+
+
+_finder = None
+
+
+def install_stub_tools(import_delay_sec: float = 0.02) -> None:
+    """Makes 'benchmark_stub_tools.<anything>' importable, each module exposing StubTool."""
+    global _finder
+    if _finder is None:
+        _finder = _StubToolFinder(import_delay_sec)
+        sys.meta_path.insert(0, _finder)
+    _finder.loader.import_delay_sec = import_delay_sec
+
+
+def unload_stub_tools() -> None:
+    """Forgets imported stub modules so the next build pays the import cost again (cold start)."""
+    for module_name in [name for name in sys.modules if name == STUB_TOOL_PACKAGE or name.startswith(STUB_TOOL_PACKAGE + ".")]:
+        del sys.modules[module_name]
+
+
+def stub_tool_config(tool_index: int, configuration: dict | None = None) -> dict:
+    return {
+        "id": f"{STUB_TOOL_PACKAGE}.tool_{tool_index}.{STUB_TOOL_CLASS_NAME}",
+        "type": "gofannon",
+        "module_path": f"{STUB_TOOL_PACKAGE}.tool_{tool_index}",
+        "class_name": STUB_TOOL_CLASS_NAME,
+        "configuration": configuration or {}
+    }
+
+
+__all__ = ['install_stub_tools', 'unload_stub_tools', 'stub_tool_config']
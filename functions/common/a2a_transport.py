@@ -0,0 +1,61 @@
+# functions/common/a2a_transport.py
+import importlib.util
+from urllib.parse import urlsplit
+import httpx
+from .core import logger
+from .config import (
+    A2A_HTTP2_ENABLED,
+    A2A_POOL_MAX_CONNECTIONS,
+    A2A_POOL_MAX_KEEPALIVE_CONNECTIONS,
+    A2A_KEEPALIVE_EXPIRY_SEC,
+    A2A_CONNECT_TIMEOUT_SEC,
+    A2A_READ_TIMEOUT_SEC
+)
+from .worker_runtime import get_loop_client
+
+# httpx only speaks HTTP/2 when the optional 'h2' package is installed (httpx[http2]).
+_H2_AVAILABLE = importlib.util.find_spec("h2") is not None
+if A2A_HTTP2_ENABLED and not _H2_AVAILABLE:
+    logger.warn("[A2ATransport] A2A_HTTP2_ENABLED is set but the 'h2' package is not installed. Falling back to HTTP/1.1 keep-alive.")
+
+
+def endpoint_origin(url: str) -> str:
+    """Normalizes a URL to scheme://host:port, the unit connections are pooled by."""
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.hostname:
+        raise ValueError(f"Invalid A2A endpoint URL: '{url}'.")
+    scheme = parts.scheme.lower()
+    port = parts.port or (443 if scheme == "https" else 80)
+    return f"{scheme}://{parts.hostname.lower()}:{port}"
+
+
+def a2a_timeout(read_timeout_sec: float | None = A2A_READ_TIMEOUT_SEC) -> httpx.Timeout:
+    """Timeout with the configured connect limit; read_timeout_sec=None waits indefinitely between bytes."""
+    return httpx.Timeout(connect=A2A_CONNECT_TIMEOUT_SEC, read=read_timeout_sec, write=A2A_CONNECT_TIMEOUT_SEC, pool=A2A_CONNECT_TIMEOUT_SEC)
+
+
+def _create_client(origin: str) -> httpx.AsyncClient:
+    use_http2 = A2A_HTTP2_ENABLED and _H2_AVAILABLE
+    logger.info(f"[A2ATransport] Opening connection pool for {origin} (HTTP/2: {use_http2}, max connections: {A2A_POOL_MAX_CONNECTIONS}).")
+    return httpx.AsyncClient(
+        http2=use_http2,
+        limits=httpx.Limits(
+            max_connections=A2A_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=A2A_POOL_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=A2A_KEEPALIVE_EXPIRY_SEC
+        ),
+        timeout=a2a_timeout()
+    )
+
+
+def get_a2a_client(url: str) -> httpx.AsyncClient:
+    """
+    Returns the pooled client for the origin of url. Clients are created lazily, one per origin
+    and event loop, and are never closed by callers: use them directly rather than in 'async with'.
+    Requests to the same agent then reuse warm (and with HTTP/2, multiplexed) connections.
+    """
+    origin = endpoint_origin(url)
+    return get_loop_client(("a2a_transport", origin), lambda: _create_client(origin))
+
+
+__all__ = ['endpoint_origin', 'a2a_timeout', 'get_a2a_client']
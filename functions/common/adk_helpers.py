@@ -1,10 +1,23 @@
 # functions/common/adk_helpers.py
 import re
 import os
-import importlib
 import traceback
 import asyncio # Import asyncio
-from .core import logger, db # Import db from core
+from .core import logger, get_async_db
+from .cache import TTLCache
+from .tool_registry import resolve_tool_class, get_cached_tool_spec, cache_tool_spec
+from .mcp_session_pool import get_mcp_session_pool
+from .agent_plan import AgentPlan, canonical_json, compile_agent_plan
+from .llm_router import build_routed_litellm_model
+from .worker_runtime import get_loop_client
+from .config import (
+    MODEL_CONFIG_CACHE_MAX_ENTRIES,
+    MODEL_CONFIG_CACHE_TTL_SEC,
+    AGENT_BUILD_MAX_CONCURRENCY,
+    AGENT_BUILD_CACHE_MAX_ENTRIES,
+    AGENT_BUILD_CACHE_TTL_SEC,
+    LLM_ROUTER_ENABLED
+)
 from google.adk.agents import Agent, SequentialAgent, LoopAgent, ParallelAgent # LlmAgent is aliased as Agent
 from google.adk.tools.agent_tool import AgentTool
 from google.adk.models.lite_llm import LiteLlm
@@ -72,22 +85,76 @@ def generate_vertex_deployment_display_name(agent_config_name: str, agent_doc_id
 
     return deployment_display_name.strip('-')[:63] # Final strip and length check
 
+_model_config_cache = TTLCache("ModelConfigs", max_entries=MODEL_CONFIG_CACHE_MAX_ENTRIES, ttl_sec=MODEL_CONFIG_CACHE_TTL_SEC)
+
 async def get_model_config_from_firestore(model_id: str) -> dict:
-    """Fetches a model configuration document from Firestore."""
+    """Fetches a model configuration document from Firestore (served from the process cache when fresh)."""
     if not model_id:
         raise ValueError("model_id cannot be empty.")
+    cached_config = _model_config_cache.get(model_id)
+    if cached_config is not None:
+        return dict(cached_config)
     try:
-        model_ref = db.collection("models").document(model_id)
-        model_doc = model_ref.get()
+        model_ref = get_async_db().collection("models").document(model_id)
+        model_doc = await model_ref.get()
         if not model_doc.exists:
             raise ValueError(f"Model with ID '{model_id}' not found in Firestore.")
-        return model_doc.to_dict()
+        model_config = model_doc.to_dict()
+        _model_config_cache.set(model_id, model_config)
+        return dict(model_config)
     except Exception as e:
         logger.error(f"Error fetching model config for ID '{model_id}' from Firestore: {e}")
         # Re-raise as a ValueError to be handled by the calling function
         raise ValueError(f"Could not fetch model configuration for ID '{model_id}'.")
 
 
+def collect_model_ids(agent_config: dict) -> list[str]:
+    """Returns the distinct modelIds referenced anywhere in an agent config tree, in tree order."""
+    model_ids = []
+    pending_configs = [agent_config]
+    while pending_configs:
+        current_config = pending_configs.pop()
+        if not isinstance(current_config, dict):
+            continue
+        model_id = current_config.get("modelId")
+        if model_id and model_id not in model_ids:
+            model_ids.append(model_id)
+        pending_configs.extend(reversed(current_config.get("childAgents") or []))
+    return model_ids
+
+
+async def prefetch_model_configs(model_ids: list[str]) -> dict[str, dict]:
+    """
+    Resolves model configurations for a whole agent tree with a single batched read.
+    Fresh entries come from the process cache; the rest are loaded with one get_all() call.
+    Missing models are left out of the result.
+    """
+    model_configs = {}
+    missing_ids = []
+    for model_id in dict.fromkeys(model_ids):
+        cached_config = _model_config_cache.get(model_id)
+        if cached_config is not None:
+            model_configs[model_id] = dict(cached_config)
+        else:
+            missing_ids.append(model_id)
+
+    if missing_ids:
+        async_db = get_async_db()
+        model_refs = [async_db.collection("models").document(model_id) for model_id in missing_ids]
+        try:
+            async for model_doc in async_db.get_all(model_refs):
+                if model_doc.exists:
+                    model_config = model_doc.to_dict()
+                    _model_config_cache.set(model_doc.id, model_config)
+                    model_configs[model_doc.id] = dict(model_config)
+        except Exception as e:
+            logger.error(f"Error prefetching model configs {missing_ids} from Firestore: {e}")
+            raise ValueError(f"Could not fetch model configurations for IDs {missing_ids}.")
+
+    logger.info(f"Resolved {len(model_configs)}/{len(model_ids)} model config(s) for agent tree ({len(missing_ids)} read from Firestore).")
+    return model_configs
+
+
 def _create_mcp_auth_objects(auth_config: dict | None) -> tuple[AuthScheme | None, AuthCredential | None]:
     """
     Creates ADK AuthScheme and AuthCredential objects from a UI-provided auth dictionary.
@@ -136,81 +203,11 @@ def _create_mcp_auth_objects(auth_config: dict | None) -> tuple[AuthScheme | Non
         logger.error(f"Error creating MCP auth objects for config {auth_config}: {e}")
         return None, None
 
-async def _prepare_agent_kwargs_from_config(merged_agent_and_model_config, adk_agent_name: str, context_for_log: str = ""): # Made async
-    logger.info(f"Preparing kwargs for ADK agent '{adk_agent_name}' {context_for_log}. Original config name: '{merged_agent_and_model_config.get('name', 'N/A')}'")
-
-    instantiated_tools = []
-    mcp_tools_by_server_and_auth = {}
-    user_defined_tools_config = merged_agent_and_model_config.get("tools", [])
-    logger.info(f"user_defined_tools_config for agent '{adk_agent_name}': {user_defined_tools_config}")
-    for tc_idx, tc in enumerate(user_defined_tools_config):
-        tool_type = tc.get('type')
-        if tool_type is None and tc.get('module_path') and tc.get('class_name'):
-            tool_type = 'gofannon'
-            tc['type'] = 'gofannon'
-            logger.info(f"Auto-detected tool type 'gofannon' for tool with module_path: {tc.get('module_path')}")
-
-        if tool_type == 'mcp':
-            server_url = tc.get('mcpServerUrl')
-            tool_name_on_server = tc.get('mcpToolName')
-            auth_config_from_ui = tc.get('auth') # New: get auth config
-
-            # Create a hashable key for the dictionary
-            auth_key = frozenset(auth_config_from_ui.items()) if auth_config_from_ui else None
-            dict_key = (server_url, auth_key)
-
-            if server_url and tool_name_on_server:
-                if dict_key not in mcp_tools_by_server_and_auth:
-                    mcp_tools_by_server_and_auth[dict_key] = []
-                mcp_tools_by_server_and_auth[dict_key].append(tool_name_on_server)
-                logger.info(f"Queued MCP tool '{tool_name_on_server}' from server '{server_url}' (Auth: {bool(auth_config_from_ui)}) for agent '{adk_agent_name}'.")
-            else:
-                logger.warn(f"Skipping MCP tool for agent '{adk_agent_name}' due to missing mcpServerUrl or mcpToolName: {tc}")
-        elif tool_type == 'gofannon' or tool_type == 'custom_repo':
-            try:
-                tool_instance = instantiate_tool(tc)
-                instantiated_tools.append(tool_instance)
-                logger.info(f"Successfully instantiated tool '{tc.get('id', f'index_{tc_idx}')}' (type: {tool_type}) for agent '{adk_agent_name}'.")
-            except ValueError as e:
-                logger.warn(f"Skipping tool for agent '{adk_agent_name}' due to error: {e} (Tool config: {tc.get('id', f'index_{tc_idx}')}, Type: {tool_type})")
-        else:
-            logger.warn(f"Unknown or unhandled tool type '{tool_type}' for agent '{adk_agent_name}'. Tool config: {tc}")
-
-
-            # After iterating all tool_configs, create MCPToolset instances using MCPToolset.from_server
-    for (server_url, auth_key), tool_names_filter in mcp_tools_by_server_and_auth.items():
-        try:
-            auth_config_dict = dict(auth_key) if auth_key else None
-            auth_scheme, auth_credential = _create_mcp_auth_objects(auth_config_dict)
-
-            connection_params = None
-            conn_type_log = ""
-            if server_url.endswith("/sse"):
-                connection_params = SseServerParams(url=server_url)
-                conn_type_log = "SSE"
-            else:
-                connection_params = StreamableHTTPConnectionParams(url=server_url)
-                conn_type_log = "StreamableHTTP"
-
-            unique_tool_filter = list(set(tool_names_filter))
-            logger.info(f"Attempting to create MCPToolset for '{server_url}' ({conn_type_log}) with tool filter: {unique_tool_filter} for agent '{adk_agent_name}'. Auth provided: {bool(auth_scheme)}")
-
-            toolset = MCPToolset(
-                connection_params=connection_params,
-                tool_filter=unique_tool_filter,
-                auth_scheme=auth_scheme,
-                auth_credential=auth_credential,
-                errlog= None
-            )
-            logger.info(f"toolset: {toolset}")
-            mcp_toolset_instance = toolset
-
-            instantiated_tools.append(mcp_toolset_instance)
-            logger.info(f"Successfully created and added MCPToolset for server '{server_url}' to agent '{adk_agent_name}' with {len(unique_tool_filter)} tools filtered.")
-        except Exception as e_mcp_toolset:
-            logger.error(f"Failed to create MCPToolset for server '{server_url}' for agent '{adk_agent_name}': {type(e_mcp_toolset).__name__} - {e_mcp_toolset}")
-
-
+def build_litellm_model_kwargs(merged_agent_and_model_config: dict, adk_agent_name: str, context_for_log: str = "") -> dict:
+    """
+    Resolves the LiteLLM model string, API base and credentials for a model config.
+    Returns the keyword arguments for LiteLlm(...) (also valid for litellm.completion).
+    """
     selected_provider_id = merged_agent_and_model_config.get("provider")
     base_model_name_from_config = merged_agent_and_model_config.get("modelString")
     user_api_base_override = merged_agent_and_model_config.get("litellm_api_base")
@@ -282,8 +279,139 @@ async def _prepare_agent_kwargs_from_config(merged_agent_and_model_config, adk_a
             else:
                 logger.warn(f"WatsonX deployment model used for {adk_agent_name} but space_id not found. Deployment may fail or use default space.")
 
+    return model_constructor_kwargs
+
+# Optional per-deployment load-balancing hints understood by the litellm Router.
+_ROUTER_DEPLOYMENT_LIMIT_KEYS = ("rpm", "tpm", "weight")
+
+def _deployment_model_config(model_config: dict, deployment: dict) -> dict:
+    """
+    Model config for one alternative deployment listed in a model doc's 'deployments'. Unset fields
+    are inherited from the model doc, except the API base/key overrides when the provider differs.
+    """
+    base_config = {k: v for k, v in model_config.items() if k not in ("deployments", *_ROUTER_DEPLOYMENT_LIMIT_KEYS)}
+    if deployment.get("provider") and deployment.get("provider") != model_config.get("provider"):
+        base_config.pop("litellm_api_base", None)
+        base_config.pop("litellm_api_key", None)
+    return {**base_config, **deployment}
+
+def _router_deployment_params(model_config: dict, adk_agent_name: str, context_for_log: str) -> dict:
+    params = build_litellm_model_kwargs(model_config, adk_agent_name, context_for_log)
+    for limit_key in _ROUTER_DEPLOYMENT_LIMIT_KEYS:
+        if isinstance(model_config.get(limit_key), (int, float)):
+            params[limit_key] = model_config[limit_key]
+    return params
+
+def build_agent_model(merged_agent_and_model_config: dict, adk_agent_name: str, context_for_log: str = "", use_llm_router: bool = False) -> LiteLlm:
+    """
+    LiteLlm for an agent. With use_llm_router (local runtimes only; routers cannot be pickled for
+    deployment), calls go through a shared litellm Router that pools clients per deployment,
+    retries throttled calls and fails over to the model doc's alternative 'deployments'.
+    """
+    if not (use_llm_router and LLM_ROUTER_ENABLED):
+        return LiteLlm(**build_litellm_model_kwargs(merged_agent_and_model_config, adk_agent_name, context_for_log))
+
+    primary_params = _router_deployment_params(merged_agent_and_model_config, adk_agent_name, context_for_log)
+    fallback_params = []
+    for deployment_index, deployment in enumerate(merged_agent_and_model_config.get("deployments") or []):
+        if not isinstance(deployment, dict):
+            logger.warn(f"Ignoring invalid deployment at index {deployment_index} for agent '{adk_agent_name}': expected a map, got {type(deployment).__name__}.")
+            continue
+        try:
+            fallback_params.append(_router_deployment_params(
+                _deployment_model_config(merged_agent_and_model_config, deployment),
+                adk_agent_name,
+                f"{context_for_log} (deployment {deployment_index})"
+            ))
+        except ValueError as e_deployment:
+            logger.warn(f"Ignoring deployment at index {deployment_index} for agent '{adk_agent_name}': {e_deployment}")
+    return build_routed_litellm_model(primary_params, fallback_params)
+
+async def _prepare_agent_kwargs_from_config(merged_agent_and_model_config, adk_agent_name: str, context_for_log: str = "", share_mcp_sessions: bool = False, use_llm_router: bool = False): # Made async
+    logger.info(f"Preparing kwargs for ADK agent '{adk_agent_name}' {context_for_log}. Original config name: '{merged_agent_and_model_config.get('name', 'N/A')}'")
+
+    instantiated_tools = []
+    mcp_tools_by_server_and_auth = {}
+    user_defined_tools_config = merged_agent_and_model_config.get("tools", [])
+    logger.info(f"user_defined_tools_config for agent '{adk_agent_name}': {user_defined_tools_config}")
+    for tc_idx, tc in enumerate(user_defined_tools_config):
+        tool_type = tc.get('type')
+        if tool_type is None and tc.get('module_path') and tc.get('class_name'):
+            tool_type = 'gofannon'
+            tc['type'] = 'gofannon'
+            logger.info(f"Auto-detected tool type 'gofannon' for tool with module_path: {tc.get('module_path')}")
+
+        if tool_type == 'mcp':
+            server_url = tc.get('mcpServerUrl')
+            tool_name_on_server = tc.get('mcpToolName')
+            auth_config_from_ui = tc.get('auth') # New: get auth config
+
+            # Create a hashable key for the dictionary
+            auth_key = frozenset(auth_config_from_ui.items()) if auth_config_from_ui else None
+            dict_key = (server_url, auth_key)
+
+            if server_url and tool_name_on_server:
+                if dict_key not in mcp_tools_by_server_and_auth:
+                    mcp_tools_by_server_and_auth[dict_key] = []
+                mcp_tools_by_server_and_auth[dict_key].append(tool_name_on_server)
+                logger.info(f"Queued MCP tool '{tool_name_on_server}' from server '{server_url}' (Auth: {bool(auth_config_from_ui)}) for agent '{adk_agent_name}'.")
+            else:
+                logger.warn(f"Skipping MCP tool for agent '{adk_agent_name}' due to missing mcpServerUrl or mcpToolName: {tc}")
+        elif tool_type == 'gofannon' or tool_type == 'custom_repo':
+            try:
+                # Tool modules are imported on first use; keep that off the event loop so sibling agents build concurrently.
+                tool_instance = await asyncio.to_thread(instantiate_tool, tc)
+                instantiated_tools.append(tool_instance)
+                logger.info(f"Successfully instantiated tool '{tc.get('id', f'index_{tc_idx}')}' (type: {tool_type}) for agent '{adk_agent_name}'.")
+            except ValueError as e:
+                logger.warn(f"Skipping tool for agent '{adk_agent_name}' due to error: {e} (Tool config: {tc.get('id', f'index_{tc_idx}')}, Type: {tool_type})")
+        else:
+            logger.warn(f"Unknown or unhandled tool type '{tool_type}' for agent '{adk_agent_name}'. Tool config: {tc}")
+
+
+            # After iterating all tool_configs, create MCPToolset instances using MCPToolset.from_server
+    for (server_url, auth_key), tool_names_filter in mcp_tools_by_server_and_auth.items():
+        try:
+            auth_config_dict = dict(auth_key) if auth_key else None
+            auth_scheme, auth_credential = _create_mcp_auth_objects(auth_config_dict)
+
+            connection_params = None
+            conn_type_log = ""
+            if server_url.endswith("/sse"):
+                connection_params = SseServerParams(url=server_url)
+                conn_type_log = "SSE"
+            else:
+                connection_params = StreamableHTTPConnectionParams(url=server_url)
+                conn_type_log = "StreamableHTTP"
+
+            unique_tool_filter = list(set(tool_names_filter))
+            logger.info(f"Attempting to create MCPToolset for '{server_url}' ({conn_type_log}) with tool filter: {unique_tool_filter} for agent '{adk_agent_name}'. Auth provided: {bool(auth_scheme)}")
+
+            def _create_toolset():
+                return MCPToolset(
+                    connection_params=connection_params,
+                    tool_filter=unique_tool_filter,
+                    auth_scheme=auth_scheme,
+                    auth_credential=auth_credential,
+                    errlog= None
+                )
+
+            if share_mcp_sessions:
+                # Local diagnostic runs reuse one toolset (and its initialized MCP session) per server, auth
+                # and tool filter. Agents built for deployment get a fresh toolset, since they are pickled.
+                toolset = get_mcp_session_pool().get_toolset(server_url, auth_config_dict, unique_tool_filter, _create_toolset)
+            else:
+                toolset = _create_toolset()
+            logger.info(f"toolset: {toolset}")
+            mcp_toolset_instance = toolset
+
+            instantiated_tools.append(mcp_toolset_instance)
+            logger.info(f"Successfully created and added MCPToolset for server '{server_url}' to agent '{adk_agent_name}' with {len(unique_tool_filter)} tools filtered.")
+        except Exception as e_mcp_toolset:
+            logger.error(f"Failed to create MCPToolset for server '{server_url}' for agent '{adk_agent_name}': {type(e_mcp_toolset).__name__} - {e_mcp_toolset}")
+
 
-    actual_model_for_adk = LiteLlm(**model_constructor_kwargs)
+    actual_model_for_adk = build_agent_model(merged_agent_and_model_config, adk_agent_name, context_for_log, use_llm_router=use_llm_router)
 
     agent_kwargs = {
         "name": adk_agent_name,
@@ -336,9 +464,12 @@ def instantiate_tool(tool_config):
         raise ValueError(f"instantiate_tool received unexpected tool type: {tool_type}. Expected 'gofannon' or 'custom_repo'.")
 
     if module_path and class_name:
+        cached_tool_spec = get_cached_tool_spec(tool_config)
+        if cached_tool_spec is not None:
+            logger.info(f"Reusing cached tool '{tool_config.get('id', class_name)}' ({module_path}.{class_name}).")
+            return cached_tool_spec
         try:
-            module = importlib.import_module(module_path)
-            ToolClass = getattr(module, class_name)
+            ToolClass = resolve_tool_class(module_path, class_name) # Module imported once per process
             instance_specific_kwargs = tool_config.get('configuration', {})
             if instance_specific_kwargs:
                 logger.info(f"Instantiating tool '{tool_config.get('id', class_name)}' with specific configuration keys: {list(instance_specific_kwargs.keys())}")
@@ -353,10 +484,12 @@ def instantiate_tool(tool_config):
                 adk_tool_spec = instance.export_to_adk()
                 tool_source_type = "Gofannon-compatible tool" if tool_type == 'gofannon' else "Custom Repository tool"
                 logger.info(f"Successfully instantiated and exported {tool_source_type} '{tool_config.get('id', class_name)}' to ADK spec.")
+                cache_tool_spec(tool_config, adk_tool_spec)
                 return adk_tool_spec
             else:
                 # If no export_to_adk, assume it's already an ADK-compatible tool instance.
                 logger.info(f"Successfully instantiated tool '{tool_config.get('id', class_name)}' (assumed ADK native or directly compatible).")
+                cache_tool_spec(tool_config, instance)
                 return instance  # Return the instance directly
         except Exception as e:
             tool_id_for_log = tool_config.get('id', class_name or 'N/A')
@@ -402,14 +535,79 @@ def sanitize_adk_agent_name(name_str: str, prefix_if_needed: str = "agent_") ->
 
     return sanitized
 
-async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_context="root", child_index=0): # Made async
-    original_agent_name = agent_config.get('name', f'agent_cfg_{child_index}')
-    # Make ADK agent names more unique to avoid conflicts if multiple deployments happen
-    # or if names are similar across different parts of a composite agent.
-    unique_base_name_for_adk = f"{original_agent_name}_{parent_adk_name_for_context}_{os.urandom(2).hex()}"
-    adk_agent_name = sanitize_adk_agent_name(unique_base_name_for_adk, prefix_if_needed=f"agent_{child_index}_")
+async def compile_agent_plan_from_config(agent_config: dict, model_configs: dict | None = None) -> AgentPlan:
+    """Resolves the tree's models (one batched read) and compiles the config into an AgentPlan."""
+    if model_configs is None:
+        model_configs = await prefetch_model_configs(collect_model_ids(agent_config))
+    return compile_agent_plan(agent_config, model_configs)
+
+
+def _get_built_agent_cache() -> TTLCache:
+    # Shared MCP toolsets belong to the running loop's session pool, so agents built with them
+    # are only reused on that loop.
+    return get_loop_client(
+        ("built_agents",),
+        lambda: TTLCache("BuiltAgents", max_entries=AGENT_BUILD_CACHE_MAX_ENTRIES, ttl_sec=AGENT_BUILD_CACHE_TTL_SEC)
+    )
+
+
+def _router_deployments_key(plan: AgentPlan, model_configs: dict) -> str:
+    return canonical_json({
+        node.model.model_id: (model_configs.get(node.model.model_id) or {}).get("deployments")
+        for node in plan.iter_nodes() if node.model
+    })
+
+
+async def instantiate_adk_agent_from_config(
+        agent_config,
+        parent_adk_name_for_context="root",
+        child_index=0,
+        model_configs: dict | None = None,
+        build_semaphore: asyncio.Semaphore | None = None,
+        share_mcp_sessions: bool = False,
+        plan: AgentPlan | None = None,
+        use_llm_router: bool = False
+): # Made async
+    if model_configs is None:
+        # Top-level call: resolve every model in the tree up front instead of one read per node.
+        model_configs = await prefetch_model_configs(collect_model_ids(agent_config))
+    if build_semaphore is None:
+        build_semaphore = asyncio.Semaphore(max(1, AGENT_BUILD_MAX_CONCURRENCY))
+
+    if plan is None:
+        # Top-level call: compile the whole tree first. Invalid configs fail here, before any
+        # ADK object is built, and every name below is derived from the plan.
+        plan = compile_agent_plan(agent_config, model_configs)
+        logger.info(f"[AgentPlan] Compiled plan {plan.plan_hash[:12]} for '{plan.config_name}' ({sum(1 for _ in plan.iter_nodes())} node(s)).")
+        if share_mcp_sessions:
+            # Local diagnostic runs on the worker loop reuse the root agent built for an identical plan. Only
+            # roots are cached: an ADK agent can be the sub-agent of a single parent.
+            built_agent_cache = _get_built_agent_cache()
+            # Model plans leave out the router's 'deployments', so routed agents also key on them.
+            built_agent_key = (plan.plan_hash, _router_deployments_key(plan, model_configs) if use_llm_router else None)
+            cached_agent = built_agent_cache.get(built_agent_key)
+            if cached_agent is not None:
+                logger.info(f"[AgentPlan] Reusing built agent '{cached_agent.name}' for plan {plan.plan_hash[:12]} (hits: {built_agent_cache.hits}, misses: {built_agent_cache.misses}).")
+                return cached_agent
+            built_agent = await instantiate_adk_agent_from_config(
+                agent_config,
+                parent_adk_name_for_context=parent_adk_name_for_context,
+                child_index=child_index,
+                model_configs=model_configs,
+                build_semaphore=build_semaphore,
+                share_mcp_sessions=share_mcp_sessions,
+                plan=plan,
+                use_llm_router=use_llm_router
+            )
+            built_agent_cache.set(built_agent_key, built_agent)
+            return built_agent
 
-    agent_type_str = agent_config.get("agentType")
+    original_agent_name = plan.config_name
+    # Names are a function of the plan (config name, tree position, content hash): the same config
+    # always builds the same names, and different configs or positions never collide.
+    adk_agent_name = plan.adk_name
+
+    agent_type_str = plan.agent_type
     AgentClass = {
         "Agent": Agent, # This is LlmAgent
         "SequentialAgent": SequentialAgent,
@@ -422,15 +620,16 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
         logger.error(error_msg)
         raise ValueError(error_msg)
 
-    logger.info(f"Instantiating ADK Agent: Name='{adk_agent_name}', Type='{AgentClass.__name__}', Original Config Name='{original_agent_name}' (Context: parent='{parent_adk_name_for_context}', index={child_index})")
+    logger.info(f"Instantiating ADK Agent: Name='{adk_agent_name}', Type='{AgentClass.__name__}', Original Config Name='{original_agent_name}' (Context: parent='{parent_adk_name_for_context}', index={child_index}, plan={plan.plan_hash[:12]})")
 
     if AgentClass in [Agent, LoopAgent]:
         model_id = agent_config.get("modelId")
         if not model_id:
             raise ValueError(f"Agent '{original_agent_name}' is of type {agent_type_str} but is missing required 'modelId'.")
 
-            # Fetch the model configuration from Firestore
-        model_config = await get_model_config_from_firestore(model_id)
+        model_config = model_configs.get(model_id)
+        if model_config is None:
+            raise ValueError(f"Could not fetch model configuration for ID '{model_id}'.")
 
         # Merge agent-specific properties (like tools, outputKey) with the model's properties.
         # Agent properties take precedence.
@@ -440,7 +639,9 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
             agent_kwargs = await _prepare_agent_kwargs_from_config(
                 merged_config,
                 adk_agent_name,
-                context_for_log=f"(type: LlmAgent, parent: {parent_adk_name_for_context}, original: {original_agent_name})"
+                context_for_log=f"(type: LlmAgent, parent: {parent_adk_name_for_context}, original: {original_agent_name})",
+                share_mcp_sessions=share_mcp_sessions,
+                use_llm_router=use_llm_router
             )
             tool_count = len(agent_kwargs.get("tools", []))
             logger.info(f"Final kwargs for LlmAgent '{adk_agent_name}' includes {tool_count} tools")
@@ -456,12 +657,14 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
 
         elif AgentClass == LoopAgent:
             looped_agent_config_name = f"{original_agent_name}_looped_child_config" # For logging
-            looped_agent_adk_name = sanitize_adk_agent_name(f"{adk_agent_name}_looped_child_instance", prefix_if_needed="looped_")
+            looped_agent_adk_name = plan.derived_adk_name("looped")
 
             looped_agent_kwargs = await _prepare_agent_kwargs_from_config( # Await the async call
                 merged_config, # Pass the merged config
                 looped_agent_adk_name,
-                context_for_log=f"(looped child of LoopAgent '{adk_agent_name}', original config: '{looped_agent_config_name}')"
+                context_for_log=f"(looped child of LoopAgent '{adk_agent_name}', original config: '{looped_agent_config_name}')",
+                share_mcp_sessions=share_mcp_sessions,
+                use_llm_router=use_llm_router
             )
             logger.debug(f"Final kwargs for Looped Child ADK Agent '{looped_agent_adk_name}' (for LoopAgent '{adk_agent_name}'): {looped_agent_kwargs}")
             try:
@@ -486,12 +689,12 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
 
             loop_agent_kwargs = {
                 "name": adk_agent_name,
-                "description": agent_config.get("description"),
-                "agent": looped_child_agent_instance, # The LlmAgent to loop
-                "max_loops": max_loops_val
+                "description": agent_config.get("description") or "", # ADK rejects None
+                "sub_agents": [looped_child_agent_instance], # The LlmAgent to loop
+                "max_iterations": max_loops_val
                 # Potentially other LoopAgent specific params like "stopping_condition" if supported/configured
             }
-            logger.debug(f"Final kwargs for LoopAgent '{adk_agent_name}': {{name, description, max_loops, agent_name: {looped_child_agent_instance.name}}}")
+            logger.debug(f"Final kwargs for LoopAgent '{adk_agent_name}': {{name, description, max_iterations, agent_name: {looped_child_agent_instance.name}}}")
             return LoopAgent(**loop_agent_kwargs)
 
     elif AgentClass == SequentialAgent or AgentClass == ParallelAgent:
@@ -500,23 +703,40 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
             logger.info(f"{AgentClass.__name__} '{original_agent_name}' has no child agents configured.")
             instantiated_child_agents = []
         else:
+            async def _instantiate_child(idx, child_config):
+                child_kwargs = {
+                    "parent_adk_name_for_context": adk_agent_name, # Pass current agent's ADK name as context
+                    "child_index": idx,
+                    "model_configs": model_configs,
+                    "build_semaphore": build_semaphore,
+                    "share_mcp_sessions": share_mcp_sessions,
+                    "plan": plan.children[idx],
+                    "use_llm_router": use_llm_router
+                }
+                # Only leaf builds hold the semaphore; composite children just wait on their own
+                # children, so holding a slot there could deadlock deep trees.
+                if child_config.get("agentType") in ("SequentialAgent", "ParallelAgent"):
+                    return await instantiate_adk_agent_from_config(child_config, **child_kwargs)
+                async with build_semaphore:
+                    return await instantiate_adk_agent_from_config(child_config, **child_kwargs)
+
+            # Children are independent, so they are built concurrently; gather keeps their order.
+            child_results = await asyncio.gather(
+                *[_instantiate_child(idx, child_config) for idx, child_config in enumerate(child_agent_configs)],
+                return_exceptions=True
+            )
             instantiated_child_agents = []
-            for idx, child_config in enumerate(child_agent_configs):
-                try:
-                    child_agent_instance = await instantiate_adk_agent_from_config( # Await the recursive async call
-                        child_config,
-                        parent_adk_name_for_context=adk_agent_name, # Pass current agent's ADK name as context
-                        child_index=idx
-                    )
-                    instantiated_child_agents.append(child_agent_instance)
-                except Exception as e_child:
-                    logger.error(f"Failed to instantiate child agent at index {idx} for {AgentClass.__name__} '{original_agent_name}': {e_child}")
-                    # Potentially re-raise or handle to allow partial construction if desired
-                    raise ValueError(f"Error processing child agent for '{original_agent_name}': {e_child}")
+            for idx, child_result in enumerate(child_results):
+                if isinstance(child_result, asyncio.CancelledError):
+                    raise child_result
+                if isinstance(child_result, BaseException):
+                    logger.error(f"Failed to instantiate child agent at index {idx} for {AgentClass.__name__} '{original_agent_name}': {child_result}")
+                    raise ValueError(f"Error processing child agent at index {idx} for '{original_agent_name}': {child_result}")
+                instantiated_child_agents.append(child_result)
 
         orchestrator_kwargs = {
             "name": adk_agent_name,
-            "description": agent_config.get("description"),
+            "description": agent_config.get("description") or "", # ADK rejects None
             "sub_agents": instantiated_child_agents
         }
         logger.debug(f"Final kwargs for {AgentClass.__name__} '{adk_agent_name}': {{name, description, num_sub_agents: {len(instantiated_child_agents)}}}")
@@ -529,6 +749,12 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
 
 __all__ = [
     'generate_vertex_deployment_display_name',
+    'build_litellm_model_kwargs',
+    'build_agent_model',
+    'get_model_config_from_firestore',
+    'collect_model_ids',
+    'prefetch_model_configs',
+    'compile_agent_plan_from_config',
     'instantiate_tool',
     'sanitize_adk_agent_name',
     'instantiate_adk_agent_from_config'
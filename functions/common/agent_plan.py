@@ -0,0 +1,137 @@
+# functions/common/agent_plan.py
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+
+# Firestore fields that describe an agent's or model's lifecycle rather than what gets built.
+# They are left out of plans so that deploying (or editing sharing settings) does not change the hash.
+NON_BUILD_CONFIG_KEYS = frozenset({
+    "id", "userId", "ownerId", "isPublic", "createdAt", "updatedAt",
+    "deploymentStatus", "deploymentError", "vertexAiResourceName", "vertexState",
+    "lastDeployedAt", "lastDeploymentAttemptAt", "lastStatusCheckAt", "lastInteractedAt", "deploymentFingerprint",
+    "deploymentProgress",
+    "childAgents" # Represented by the plan's children
+})
+
+# Model doc fields only read at run time (response cache, streaming, rate limiter, local LLM
+# router), never by the build. Kept out of model plans so toggling them does not redeploy agents.
+MODEL_RUNTIME_ONLY_CONFIG_KEYS = frozenset({"responseCacheEnabled", "streamResponses", "rateLimits", "deployments"})
+
+COMPOSITE_AGENT_TYPES = ("SequentialAgent", "ParallelAgent")
+LEAF_AGENT_TYPES = ("Agent", "LoopAgent")
+
+
+def canonical_json(value) -> str:
+    """Deterministic JSON: sorted keys, no whitespace, non-JSON values (e.g. timestamps) stringified."""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str, ensure_ascii=False)
+
+
+def _build_relevant_config(config: dict | None) -> dict:
+    return {key: value for key, value in (config or {}).items() if key not in NON_BUILD_CONFIG_KEYS}
+
+
+def _build_relevant_model_config(config: dict | None) -> dict:
+    return {key: value for key, value in _build_relevant_config(config).items() if key not in MODEL_RUNTIME_ONLY_CONFIG_KEYS}
+
+
+@dataclass(frozen=True, slots=True)
+class ModelPlan:
+    model_id: str
+    config_json: str # Canonical JSON of the model document's build-relevant fields
+
+    @property
+    def config(self) -> dict:
+        return json.loads(self.config_json)
+
+
+@dataclass(frozen=True, slots=True)
+class AgentPlan:
+    """
+    Immutable, normalized description of one node of an agent tree. plan_hash covers the node's
+    build-relevant config, its resolved model and (recursively) its children, so two configs
+    that would build the same agent have the same hash.
+    """
+    plan_hash: str
+    agent_type: str
+    config_name: str
+    adk_name: str # Deterministic: derived from the config name, tree position and plan hash
+    position: str # "r" for the root, "r_0_2" for the third child of the root's first child
+    node_config_json: str
+    model: ModelPlan | None
+    children: tuple["AgentPlan", ...]
+
+    @property
+    def node_config(self) -> dict:
+        return json.loads(self.node_config_json)
+
+    def derived_adk_name(self, role: str) -> str:
+        """Deterministic name for an extra ADK object built for this node (e.g. a LoopAgent's looped child)."""
+        return _deterministic_adk_name(f"{self.config_name[:40]}_{role}", self.position, self.plan_hash)
+
+    def iter_nodes(self):
+        yield self
+        for child_plan in self.children:
+            yield from child_plan.iter_nodes()
+
+
+def _deterministic_adk_name(config_name: str, position: str, plan_hash: str) -> str:
+    base_name = re.sub(r'[^a-zA-Z0-9_]', '_', config_name or "agent").strip('_') or "agent"
+    if base_name[0].isdigit():
+        base_name = f"a_{base_name}"
+    # Hash and position go last and are kept intact when the name is shortened to 63 chars.
+    suffix = f"_{position}_{plan_hash[:8]}"
+    return re.sub(r'_+', '_', f"{base_name[:63 - len(suffix)]}{suffix}")
+
+
+def compile_agent_plan(agent_config: dict, model_configs: dict[str, dict], position: str = "r") -> AgentPlan:
+    """
+    Compiles a Firestore agent config (with its models already resolved) into an AgentPlan.
+    Raises ValueError for configs that cannot be built, before any ADK object is created.
+    """
+    if not isinstance(agent_config, dict):
+        raise ValueError(f"Agent config at position '{position}' must be a dictionary, got {type(agent_config).__name__}.")
+
+    agent_type = agent_config.get("agentType")
+    child_index = position.rsplit("_", 1)[-1]
+    config_name = agent_config.get("name") or f"agent_cfg_{child_index if child_index.isdigit() else 0}"
+    if agent_type not in LEAF_AGENT_TYPES + COMPOSITE_AGENT_TYPES:
+        raise ValueError(f"Invalid agentType specified: '{agent_type}' for agent config: {config_name}")
+
+    model_plan = None
+    if agent_type in LEAF_AGENT_TYPES:
+        model_id = agent_config.get("modelId")
+        if not model_id:
+            raise ValueError(f"Agent '{config_name}' is of type {agent_type} but is missing required 'modelId'.")
+        if model_id not in model_configs:
+            raise ValueError(f"Could not fetch model configuration for ID '{model_id}'.")
+        model_plan = ModelPlan(model_id=model_id, config_json=canonical_json(_build_relevant_model_config(model_configs[model_id])))
+
+    child_plans = ()
+    if agent_type in COMPOSITE_AGENT_TYPES:
+        child_plans = tuple(
+            compile_agent_plan(child_config, model_configs, position=f"{position}_{child_index}")
+            for child_index, child_config in enumerate(agent_config.get("childAgents") or [])
+        )
+
+    node_config_json = canonical_json(_build_relevant_config(agent_config))
+    plan_hash = hashlib.sha256(canonical_json({
+        "agentType": agent_type,
+        "node": node_config_json,
+        "model": model_plan.config_json if model_plan else None,
+        "children": [child_plan.plan_hash for child_plan in child_plans]
+    }).encode("utf-8")).hexdigest()
+
+    return AgentPlan(
+        plan_hash=plan_hash,
+        agent_type=agent_type,
+        config_name=config_name,
+        adk_name=_deterministic_adk_name(config_name, position, plan_hash),
+        position=position,
+        node_config_json=node_config_json,
+        model=model_plan,
+        children=child_plans
+    )
+
+
+__all__ = ['NON_BUILD_CONFIG_KEYS', 'MODEL_RUNTIME_ONLY_CONFIG_KEYS', 'canonical_json', 'ModelPlan', 'AgentPlan', 'compile_agent_plan']
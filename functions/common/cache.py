@@ -0,0 +1,68 @@
+# functions/common/cache.py
+import threading
+import time
+from collections import OrderedDict
+from .core import logger
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache with a per-entry time-to-live, for objects that are expensive
+    to build and can be reused by later requests on a warm instance.
+
+    Values can carry a version (e.g. a Firestore document update_time): get() treats an entry
+    stored under a different version as a miss and drops it, so a changed source document
+    invalidates the cached object without a separate invalidation path.
+    """
+
+    def __init__(self, name: str, max_entries: int = 32, ttl_sec: float = 1800.0):
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_sec = float(ttl_sec)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (expires_at, version, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, version=None, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, entry_version, value = entry
+                if expires_at > now and entry_version == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                reason = "expired" if expires_at <= now else "stale version"
+                logger.debug(f"[Cache/{self.name}] Dropped {reason} entry for key {key}.")
+            self.misses += 1
+            return default
+
+    def set(self, key, value, version=None, ttl_sec: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl_sec if ttl_sec is None else float(ttl_sec))
+        with self._lock:
+            self._entries[key] = (expires_at, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                logger.debug(f"[Cache/{self.name}] Evicted least recently used key {evicted_key}.")
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+__all__ = ['TTLCache']
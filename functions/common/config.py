@@ -17,6 +17,136 @@ CORS_ORIGINS = [
 # --- Global Constants ---
 GOFANNON_MANIFEST_URL = "https://raw.githubusercontent.com/The-AI-Alliance/gofannon/main/manifest.json"
 
+# --- Run Event Streaming ---
+# Events produced by an agent/model run are buffered and written to the assistant message
+# in coalesced batches instead of one Firestore update per event.
+EVENT_SINK_MAX_BATCH_SIZE = int(os.environ.get("EVENT_SINK_MAX_BATCH_SIZE", "25"))
+EVENT_SINK_FLUSH_INTERVAL_SEC = float(os.environ.get("EVENT_SINK_FLUSH_INTERVAL_SEC", "1.0"))
+# "array" appends events to an array field on the message document (legacy behavior).
+# "subcollection" writes them to chats/{chatId}/messages/{msgId}/events/{seq} and keeps only
+# a compact summary on the message document, so message reads stay small for long runs.
+EVENT_STORAGE_MODE = os.environ.get("EVENT_STORAGE_MODE", "array")
+# While a run streams, the text accumulated so far is written to 'run.partialContent' at most
+# every PARTIAL_CONTENT_UPDATE_INTERVAL_SEC, or sooner once PARTIAL_CONTENT_UPDATE_MIN_CHARS new
+# characters are pending. Set the interval to 0 to disable progressive updates.
+PARTIAL_CONTENT_UPDATE_INTERVAL_SEC = float(os.environ.get("PARTIAL_CONTENT_UPDATE_INTERVAL_SEC", "0.25"))
+PARTIAL_CONTENT_UPDATE_MIN_CHARS = int(os.environ.get("PARTIAL_CONTENT_UPDATE_MIN_CHARS", "200"))
+
+# --- Tool Registry ---
+# Function targets (comma-separated) whose instances pre-import the Gofannon manifest's tool
+# modules on a background thread at start-up. Empty disables the pre-warm.
+TOOL_PREWARM_FUNCTION_TARGETS = [
+    target.strip() for target in os.environ.get("TOOL_PREWARM_FUNCTION_TARGETS", "executeAgentRunTask,executeAgentDeployTask").split(",")
+    if target.strip()
+]
+# Imports slower than this are logged as warnings.
+TOOL_IMPORT_SLOW_THRESHOLD_SEC = float(os.environ.get("TOOL_IMPORT_SLOW_THRESHOLD_SEC", "1.0"))
+TOOL_SPEC_CACHE_MAX_ENTRIES = int(os.environ.get("TOOL_SPEC_CACHE_MAX_ENTRIES", "256"))
+
+# --- MCP Session Pool ---
+# Initialized MCP sessions (tool discovery) and MCPToolsets (local diagnostic runs) are kept per server URL
+# and auth config, and closed after MCP_SESSION_IDLE_TIMEOUT_SEC without use. Sessions idle for
+# longer than MCP_HEALTHCHECK_INTERVAL_SEC are pinged before reuse and reconnected if the ping fails.
+MCP_SESSION_IDLE_TIMEOUT_SEC = float(os.environ.get("MCP_SESSION_IDLE_TIMEOUT_SEC", "300"))
+MCP_HEALTHCHECK_INTERVAL_SEC = float(os.environ.get("MCP_HEALTHCHECK_INTERVAL_SEC", "30"))
+MCP_HEALTHCHECK_TIMEOUT_SEC = float(os.environ.get("MCP_HEALTHCHECK_TIMEOUT_SEC", "5"))
+MCP_CONNECT_TIMEOUT_SEC = float(os.environ.get("MCP_CONNECT_TIMEOUT_SEC", "30"))
+
+# --- Model Runs ---
+# Direct model chats run ADK with StreamingMode.SSE so text deltas reach run.partialContent as
+# they are generated. A model document can override this with a boolean 'streamResponses' field.
+MODEL_RUN_SSE_STREAMING = os.environ.get("MODEL_RUN_SSE_STREAMING", "true").lower() in ("1", "true", "yes")
+# Ready-to-use agents and Runners for model chats are cached per instance, keyed by modelId and
+# invalidated when the model document's update_time changes.
+MODEL_RUNNER_CACHE_MAX_ENTRIES = int(os.environ.get("MODEL_RUNNER_CACHE_MAX_ENTRIES", "32"))
+MODEL_RUNNER_CACHE_TTL_SEC = float(os.environ.get("MODEL_RUNNER_CACHE_TTL_SEC", "1800"))
+# Model documents resolved while building agent trees are cached briefly so repeated deploys and
+# diagnostics of the same agents skip the Firestore reads.
+MODEL_CONFIG_CACHE_MAX_ENTRIES = int(os.environ.get("MODEL_CONFIG_CACHE_MAX_ENTRIES", "256"))
+MODEL_CONFIG_CACHE_TTL_SEC = float(os.environ.get("MODEL_CONFIG_CACHE_TTL_SEC", "60"))
+# Maximum number of leaf agents (LlmAgent/LoopAgent) of one composite agent built at the same time.
+AGENT_BUILD_MAX_CONCURRENCY = int(os.environ.get("AGENT_BUILD_MAX_CONCURRENCY", "8"))
+# Root agents built for local diagnostic runs (share_mcp_sessions) are reused by compiled plan hash.
+AGENT_BUILD_CACHE_MAX_ENTRIES = int(os.environ.get("AGENT_BUILD_CACHE_MAX_ENTRIES", "16"))
+AGENT_BUILD_CACHE_TTL_SEC = float(os.environ.get("AGENT_BUILD_CACHE_TTL_SEC", "900"))
+
+# --- LLM Rate Limiting ---
+# Runs consult a token bucket per provider/model before calling it. "local" keeps the buckets in
+# the instance, "firestore" shares them across instances through sharded documents in
+# 'rateLimits', "off" disables the limiter.
+RATE_LIMITER_MODE = os.environ.get("RATE_LIMITER_MODE", "local").lower()
+# Default limits as JSON keyed by "provider" or "provider/modelString", e.g.
+# {"openai": {"rpm": 500, "tpm": 200000, "maxConcurrent": 8}}. A model doc's 'rateLimits' map overrides them.
+LLM_RATE_LIMITS_JSON = os.environ.get("LLM_RATE_LIMITS_JSON", "{}")
+RATE_LIMIT_FIRESTORE_SHARDS = int(os.environ.get("RATE_LIMIT_FIRESTORE_SHARDS", "4"))
+# Waits up to this long are spent in the task; longer ones requeue the run with a delay.
+RATE_LIMIT_MAX_INLINE_WAIT_SEC = float(os.environ.get("RATE_LIMIT_MAX_INLINE_WAIT_SEC", "5"))
+# After this many requeues a run proceeds anyway and relies on provider-side retries.
+RATE_LIMIT_MAX_DEFERRALS = int(os.environ.get("RATE_LIMIT_MAX_DEFERRALS", "20"))
+
+# --- Model Response Cache ---
+# Opt-in per model doc ('responseCacheEnabled') and only used at temperature 0. Entries live in an
+# in-memory LRU and in the 'responseCache' collection, which has a Firestore TTL policy on 'expiresAt'.
+RESPONSE_CACHE_TTL_SEC = float(os.environ.get("RESPONSE_CACHE_TTL_SEC", "86400"))
+RESPONSE_CACHE_MEMORY_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MEMORY_MAX_ENTRIES", "128"))
+# Responses whose events serialize larger than this are only kept in memory (Firestore documents are capped at 1 MiB).
+RESPONSE_CACHE_MAX_DOC_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_DOC_BYTES", "800000"))
+
+# --- Conversation History Windowing ---
+# Token budget for the verbatim recent turns sent to Vertex agents and models. Older turns are
+# replaced by a rolling summary stored in the chat's historySummaries subcollection. 0 disables windowing.
+# A model document can override the budget with a 'historyTokenBudget' field.
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "16000"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.environ.get("HISTORY_SUMMARY_MAX_TOKENS", "1024"))
+# Model used for summaries when the participant itself has no single model (e.g. composite agents).
+HISTORY_SUMMARY_MODEL_ID = os.environ.get("HISTORY_SUMMARY_MODEL_ID")
+
+# --- A2A Transport ---
+# Pooled keep-alive connections per A2A endpoint origin, shared by the card fetcher and the task runners.
+A2A_HTTP2_ENABLED = os.environ.get("A2A_HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+A2A_POOL_MAX_CONNECTIONS = int(os.environ.get("A2A_POOL_MAX_CONNECTIONS", "20"))
+A2A_POOL_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("A2A_POOL_MAX_KEEPALIVE_CONNECTIONS", "10"))
+A2A_KEEPALIVE_EXPIRY_SEC = float(os.environ.get("A2A_KEEPALIVE_EXPIRY_SEC", "60"))
+A2A_CONNECT_TIMEOUT_SEC = float(os.environ.get("A2A_CONNECT_TIMEOUT_SEC", "10"))
+A2A_READ_TIMEOUT_SEC = float(os.environ.get("A2A_READ_TIMEOUT_SEC", "120"))
+
+# --- LiteLLM Router ---
+# Local runtimes send model calls through a litellm Router per model: one pooled client per
+# deployment, retries with backoff, and failover to the model doc's alternative 'deployments'.
+LLM_ROUTER_ENABLED = os.environ.get("LLM_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_ROUTER_NUM_RETRIES = int(os.environ.get("LLM_ROUTER_NUM_RETRIES", "2"))
+LLM_ROUTER_ALLOWED_FAILS = int(os.environ.get("LLM_ROUTER_ALLOWED_FAILS", "1")) # Failures per minute before a deployment cools down
+LLM_ROUTER_COOLDOWN_SEC = float(os.environ.get("LLM_ROUTER_COOLDOWN_SEC", "30"))
+LLM_ROUTER_TIMEOUT_SEC = float(os.environ.get("LLM_ROUTER_TIMEOUT_SEC", "120"))
+LLM_ROUTER_CLIENT_TTL_SEC = int(os.environ.get("LLM_ROUTER_CLIENT_TTL_SEC", "3600"))
+LLM_ROUTER_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_ROUTER_CACHE_MAX_ENTRIES", "32"))
+
+# --- Agent Deployment Pipeline ---
+# deploy_agent_to_vertex only enqueues; executeAgentDeployTask builds the engine in the background.
+# A deployment still marked as in progress after DEPLOY_TASK_STALE_AFTER_SEC is treated as lost
+# (e.g. the worker instance died) and can be retried or reported by the status check.
+DEPLOY_TASK_STALE_AFTER_SEC = float(os.environ.get("DEPLOY_TASK_STALE_AFTER_SEC", "3600"))
+# Custom tool repos on a branch or tag are pinned to the commit it points to at deploy time.
+GIT_LS_REMOTE_TIMEOUT_SEC = float(os.environ.get("GIT_LS_REMOTE_TIMEOUT_SEC", "20"))
+GIT_REF_CACHE_MAX_ENTRIES = int(os.environ.get("GIT_REF_CACHE_MAX_ENTRIES", "256"))
+GIT_REF_CACHE_TTL_SEC = float(os.environ.get("GIT_REF_CACHE_TTL_SEC", "60"))
+# Pinned custom repos are installed from wheels built once per commit and kept in the staging
+# bucket ("gcs"), in WHEELHOUSE_LOCAL_DIR only ("local", for tests), or built from source ("off").
+WHEELHOUSE_MODE = os.environ.get("WHEELHOUSE_MODE", "gcs").lower()
+WHEELHOUSE_LOCAL_DIR = os.environ.get("WHEELHOUSE_LOCAL_DIR", "/tmp/agentlab-wheelhouse")
+WHEELHOUSE_GCS_PREFIX = os.environ.get("WHEELHOUSE_GCS_PREFIX", "wheelhouse")
+WHEELHOUSE_BUILD_TIMEOUT_SEC = float(os.environ.get("WHEELHOUSE_BUILD_TIMEOUT_SEC", "300"))
+
+# --- Fleet Operations ---
+# Bulk deploy/redeploy/delete runs as a chain of short executeFleetOperationTask ticks. Each tick
+# polls the agents in flight, starts pending ones up to the operation's concurrency limit, and
+# reschedules itself FLEET_POLL_INTERVAL_SEC later until every agent has finished.
+FLEET_MAX_AGENTS = int(os.environ.get("FLEET_MAX_AGENTS", "100"))
+FLEET_DEFAULT_CONCURRENCY = int(os.environ.get("FLEET_DEFAULT_CONCURRENCY", "5"))
+FLEET_MAX_CONCURRENCY = int(os.environ.get("FLEET_MAX_CONCURRENCY", "20"))
+FLEET_MAX_ATTEMPTS_PER_AGENT = int(os.environ.get("FLEET_MAX_ATTEMPTS_PER_AGENT", "3"))
+FLEET_POLL_INTERVAL_SEC = float(os.environ.get("FLEET_POLL_INTERVAL_SEC", "20"))
+
 def get_gcp_project_config():
     """
     Determines GCP project ID, location, and staging bucket.
@@ -43,4 +173,65 @@ def get_gcp_project_config():
     logger.info(f"Using Project ID: {project_id}, Location: {location}, Staging Bucket: {staging_bucket}")
     return project_id, location, staging_bucket
 
-__all__ = ['CORS_ORIGINS', 'GOFANNON_MANIFEST_URL', 'get_gcp_project_config']
\ No newline at end of file
+__all__ = [
+    'CORS_ORIGINS',
+    'GOFANNON_MANIFEST_URL',
+    'EVENT_SINK_MAX_BATCH_SIZE',
+    'EVENT_SINK_FLUSH_INTERVAL_SEC',
+    'EVENT_STORAGE_MODE',
+    'PARTIAL_CONTENT_UPDATE_INTERVAL_SEC',
+    'PARTIAL_CONTENT_UPDATE_MIN_CHARS',
+    'TOOL_PREWARM_FUNCTION_TARGETS',
+    'TOOL_IMPORT_SLOW_THRESHOLD_SEC',
+    'TOOL_SPEC_CACHE_MAX_ENTRIES',
+    'MCP_SESSION_IDLE_TIMEOUT_SEC',
+    'MCP_HEALTHCHECK_INTERVAL_SEC',
+    'MCP_HEALTHCHECK_TIMEOUT_SEC',
+    'MCP_CONNECT_TIMEOUT_SEC',
+    'MODEL_RUN_SSE_STREAMING',
+    'MODEL_RUNNER_CACHE_MAX_ENTRIES',
+    'MODEL_RUNNER_CACHE_TTL_SEC',
+    'MODEL_CONFIG_CACHE_MAX_ENTRIES',
+    'MODEL_CONFIG_CACHE_TTL_SEC',
+    'AGENT_BUILD_MAX_CONCURRENCY',
+    'AGENT_BUILD_CACHE_MAX_ENTRIES',
+    'AGENT_BUILD_CACHE_TTL_SEC',
+    'RATE_LIMITER_MODE',
+    'LLM_RATE_LIMITS_JSON',
+    'RATE_LIMIT_FIRESTORE_SHARDS',
+    'RATE_LIMIT_MAX_INLINE_WAIT_SEC',
+    'RATE_LIMIT_MAX_DEFERRALS',
+    'RESPONSE_CACHE_TTL_SEC',
+    'RESPONSE_CACHE_MEMORY_MAX_ENTRIES',
+    'RESPONSE_CACHE_MAX_DOC_BYTES',
+    'HISTORY_TOKEN_BUDGET',
+    'HISTORY_SUMMARY_MAX_TOKENS',
+    'HISTORY_SUMMARY_MODEL_ID',
+    'A2A_HTTP2_ENABLED',
+    'A2A_POOL_MAX_CONNECTIONS',
+    'A2A_POOL_MAX_KEEPALIVE_CONNECTIONS',
+    'A2A_KEEPALIVE_EXPIRY_SEC',
+    'A2A_CONNECT_TIMEOUT_SEC',
+    'A2A_READ_TIMEOUT_SEC',
+    'LLM_ROUTER_ENABLED',
+    'LLM_ROUTER_NUM_RETRIES',
+    'LLM_ROUTER_ALLOWED_FAILS',
+    'LLM_ROUTER_COOLDOWN_SEC',
+    'LLM_ROUTER_TIMEOUT_SEC',
+    'LLM_ROUTER_CLIENT_TTL_SEC',
+    'LLM_ROUTER_CACHE_MAX_ENTRIES',
+    'DEPLOY_TASK_STALE_AFTER_SEC',
+    'GIT_LS_REMOTE_TIMEOUT_SEC',
+    'GIT_REF_CACHE_MAX_ENTRIES',
+    'GIT_REF_CACHE_TTL_SEC',
+    'WHEELHOUSE_MODE',
+    'WHEELHOUSE_LOCAL_DIR',
+    'WHEELHOUSE_GCS_PREFIX',
+    'WHEELHOUSE_BUILD_TIMEOUT_SEC',
+    'FLEET_MAX_AGENTS',
+    'FLEET_DEFAULT_CONCURRENCY',
+    'FLEET_MAX_CONCURRENCY',
+    'FLEET_MAX_ATTEMPTS_PER_AGENT',
+    'FLEET_POLL_INTERVAL_SEC',
+    'get_gcp_project_config'
+]
\ No newline at end of file
@@ -1,4 +1,6 @@
 import os
+import asyncio
+import threading
 import firebase_admin
 from firebase_admin import firestore
 from firebase_functions import logger, options
@@ -14,6 +16,25 @@ except ValueError as e:
 
 db = firestore.client() # Initialize Firestore client globally
 
+# gRPC asyncio channels are bound to the event loop they are first used on, so one
+# AsyncClient is kept per running loop. Clients of closed loops are dropped on the next lookup.
+_async_db_clients = {}
+_async_db_clients_lock = threading.Lock()
+
+def get_async_db() -> firestore.AsyncClient:
+    """Returns the Firestore AsyncClient for the running event loop (must be called from a coroutine)."""
+    loop = asyncio.get_running_loop()
+    with _async_db_clients_lock:
+        for stale_loop_id in [loop_id for loop_id, (client_loop, _) in _async_db_clients.items() if client_loop.is_closed()]:
+            del _async_db_clients[stale_loop_id]
+        loop_entry = _async_db_clients.get(id(loop))
+        if loop_entry is None or loop_entry[0] is not loop:
+            app = firebase_admin.get_app()
+            async_client = firestore.AsyncClient(project=db.project, credentials=app.credential.get_credential())
+            loop_entry = (loop, async_client)
+            _async_db_clients[id(loop)] = loop_entry
+        return loop_entry[1]
+
 def setup_global_options():
     """Sets global options for Firebase Functions."""
     if os.environ.get('FUNCTION_TARGET', None): # Ensures this runs in the Cloud Functions environment
@@ -29,4 +50,4 @@ if os.environ.get('FUNCTION_TARGET', None):
     setup_global_options()
 
 # Export logger for other modules to use consistently
-__all__ = ['db', 'logger', 'setup_global_options']
\ No newline at end of file
+__all__ = ['db', 'get_async_db', 'logger', 'setup_global_options']
\ No newline at end of file
@@ -0,0 +1,95 @@
+# functions/common/git_refs.py
+import os
+import re
+import shutil
+import subprocess
+
+from .core import logger
+from .cache import TTLCache
+from .config import GIT_LS_REMOTE_TIMEOUT_SEC, GIT_REF_CACHE_MAX_ENTRIES, GIT_REF_CACHE_TTL_SEC
+
+FULL_COMMIT_SHA_PATTERN = re.compile(r"[0-9a-f]{40}")
+
+# Short-lived: a branch that moves must be picked up by the next deploy, but the agents of a
+# fleet deploy that share a tool repo should not each run ls-remote.
+_resolved_refs = TTLCache("GitRefs", max_entries=GIT_REF_CACHE_MAX_ENTRIES, ttl_sec=GIT_REF_CACHE_TTL_SEC)
+
+
+def to_git_remote_url(pip_vcs_url: str) -> str:
+    """'git+https://host/repo.git' -> 'https://host/repo.git' (likewise for git+ssh and git+file)."""
+    return pip_vcs_url[len("git+"):] if pip_vcs_url.startswith("git+") else pip_vcs_url
+
+
+def _pick_commit_sha(ls_remote_output: str, ref: str | None) -> str | None:
+    """Picks the commit for ref from 'git ls-remote' output; annotated tags resolve to their peeled commit."""
+    shas_by_ref = {}
+    for line in ls_remote_output.splitlines():
+        parts = line.strip().split("\t", 1)
+        if len(parts) == 2 and FULL_COMMIT_SHA_PATTERN.fullmatch(parts[0].lower()):
+            shas_by_ref[parts[1]] = parts[0].lower()
+    if ref is None:
+        return shas_by_ref.get("HEAD")
+    for candidate in (f"refs/heads/{ref}", f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}", ref, f"{ref}^{{}}"):
+        if candidate in shas_by_ref:
+            return shas_by_ref[candidate]
+    return None
+
+
+class GitLsRemoteResolver:
+    """Resolves a branch, tag or HEAD (ref=None) of a git remote to a commit SHA with 'git ls-remote'."""
+
+    def __init__(self, timeout_sec: float = GIT_LS_REMOTE_TIMEOUT_SEC, git_executable: str | None = None):
+        self.timeout_sec = timeout_sec
+        self.git_executable = git_executable or shutil.which("git")
+
+    def resolve(self, remote_url: str, ref: str | None) -> str | None:
+        if not self.git_executable:
+            logger.warn("[GitRefs] 'git' is not available; custom repository refs cannot be pinned.")
+            return None
+        command = [self.git_executable, "ls-remote", remote_url]
+        if ref:
+            command += [f"refs/heads/{ref}", f"refs/tags/{ref}", f"refs/tags/{ref}^{{}}"]
+        else:
+            command.append("HEAD")
+        completed = subprocess.run(
+            command,
+            capture_output=True,
+            text=True,
+            timeout=self.timeout_sec,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"}, # Fail instead of waiting for credentials
+            check=False
+        )
+        if completed.returncode != 0:
+            logger.warn(f"[GitRefs] 'git ls-remote {remote_url}' failed ({completed.returncode}): {completed.stderr.strip()[:300]}")
+            return None
+        return _pick_commit_sha(completed.stdout, ref)
+
+
+_default_resolver = GitLsRemoteResolver()
+
+
+def resolve_git_ref(pip_vcs_url: str, ref: str | None, resolver=None) -> str | None:
+    """
+    The commit SHA that ref (None for the default branch) currently points to in the repository
+    at pip_vcs_url, or None if it cannot be resolved. resolver is any object with a
+    resolve(remote_url, ref) method; defaults to GitLsRemoteResolver.
+    """
+    resolver = resolver or _default_resolver
+    remote_url = to_git_remote_url(pip_vcs_url)
+    cache_key = (remote_url, ref)
+    cached_sha = _resolved_refs.get(cache_key) if resolver is _default_resolver else None
+    if cached_sha:
+        return cached_sha
+    try:
+        commit_sha = resolver.resolve(remote_url, ref)
+    except Exception as e:
+        logger.warn(f"[GitRefs] Could not resolve '{ref or 'HEAD'}' of {remote_url}: {type(e).__name__}: {e}")
+        return None
+    if commit_sha and resolver is _default_resolver:
+        _resolved_refs.set(cache_key, commit_sha)
+    if commit_sha:
+        logger.info(f"[GitRefs] Resolved '{ref or 'HEAD'}' of {remote_url} to {commit_sha}.")
+    return commit_sha
+
+
+__all__ = ['FULL_COMMIT_SHA_PATTERN', 'GitLsRemoteResolver', 'resolve_git_ref', 'to_git_remote_url']
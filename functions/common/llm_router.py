@@ -0,0 +1,82 @@
+# functions/common/llm_router.py
+import hashlib
+import json
+from litellm import Router
+from google.adk.models.lite_llm import LiteLlm, LiteLLMClient
+from .core import logger
+from .cache import TTLCache
+from .config import (
+    LLM_ROUTER_NUM_RETRIES,
+    LLM_ROUTER_ALLOWED_FAILS,
+    LLM_ROUTER_COOLDOWN_SEC,
+    LLM_ROUTER_TIMEOUT_SEC,
+    LLM_ROUTER_CLIENT_TTL_SEC,
+    LLM_ROUTER_CACHE_MAX_ENTRIES
+)
+from .worker_runtime import get_loop_client
+
+
+class RouterLiteLLMClient(LiteLLMClient):
+    """LiteLLMClient that sends ADK's completion calls to a model group of a litellm Router."""
+
+    def __init__(self, router: Router, model_group: str):
+        self.router = router
+        self.model_group = model_group
+
+    async def acompletion(self, model, messages, tools, **kwargs):
+        return await self.router.acompletion(model=self.model_group, messages=messages, tools=tools, **kwargs)
+
+    def completion(self, model, messages, tools, stream=False, **kwargs):
+        return self.router.completion(model=self.model_group, messages=messages, tools=tools, stream=stream, **kwargs)
+
+
+def _routers() -> TTLCache:
+    # litellm caches its async HTTP clients on the router, and those belong to the loop that created them.
+    return get_loop_client(("llm_routers",), lambda: TTLCache("LLMRouters", max_entries=LLM_ROUTER_CACHE_MAX_ENTRIES, ttl_sec=24 * 3600))
+
+
+def router_model_group(primary_params: dict, fallback_params: list[dict]) -> str:
+    """Model group name for a set of deployments. Credentials only enter the hash, never the name."""
+    key_material = json.dumps({"primary": primary_params, "fallbacks": fallback_params}, sort_keys=True, default=str)
+    return f"agentlab-{hashlib.sha256(key_material.encode('utf-8')).hexdigest()[:16]}"
+
+
+def get_llm_router(primary_params: dict, fallback_params: list[dict]) -> tuple[Router, str]:
+    """
+    Returns (router, model_group) for the deployments, creating the Router on first use. The primary
+    deployment forms the model group; alternatives form '<group>-fallback', tried (load-balanced)
+    once the primary fails with a retryable error (429, 5xx, timeouts) after its retries. A
+    deployment that keeps failing cools down, so throttled deployments are skipped for a while.
+    """
+    model_group = router_model_group(primary_params, fallback_params)
+    routers = _routers()
+    router = routers.get(model_group)
+    if router is not None:
+        return router, model_group
+
+    fallback_group = f"{model_group}-fallback"
+    model_list = [{"model_name": model_group, "litellm_params": dict(primary_params)}]
+    model_list.extend({"model_name": fallback_group, "litellm_params": dict(params)} for params in fallback_params)
+    router = Router(
+        model_list=model_list,
+        fallbacks=[{model_group: [fallback_group]}] if fallback_params else [],
+        num_retries=LLM_ROUTER_NUM_RETRIES,
+        allowed_fails=LLM_ROUTER_ALLOWED_FAILS,
+        cooldown_time=LLM_ROUTER_COOLDOWN_SEC,
+        timeout=LLM_ROUTER_TIMEOUT_SEC,
+        client_ttl=LLM_ROUTER_CLIENT_TTL_SEC,
+        routing_strategy="simple-shuffle"
+    )
+    routers.set(model_group, router)
+    logger.info(f"[LLMRouter] Created router '{model_group}' for '{primary_params.get('model')}' with {len(fallback_params)} fallback deployment(s): "
+                f"{[params.get('model') for params in fallback_params]}.")
+    return router, model_group
+
+
+def build_routed_litellm_model(primary_params: dict, fallback_params: list[dict]) -> LiteLlm:
+    """LiteLlm whose calls go through the shared router for the deployments (and its pooled clients)."""
+    router, model_group = get_llm_router(primary_params, fallback_params)
+    return LiteLlm(model=model_group, llm_client=RouterLiteLLMClient(router, model_group))
+
+
+__all__ = ['RouterLiteLLMClient', 'router_model_group', 'get_llm_router', 'build_routed_litellm_model']
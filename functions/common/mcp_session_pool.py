@@ -0,0 +1,230 @@
+# functions/common/mcp_session_pool.py
+import asyncio
+import hashlib
+import json
+import time
+from mcp.client.session import ClientSession
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+from .core import logger
+from .config import (
+    MCP_SESSION_IDLE_TIMEOUT_SEC,
+    MCP_HEALTHCHECK_INTERVAL_SEC,
+    MCP_HEALTHCHECK_TIMEOUT_SEC,
+    MCP_CONNECT_TIMEOUT_SEC
+)
+from .worker_runtime import get_loop_client
+
+
+def build_mcp_auth_headers(auth_config: dict | None) -> dict:
+    """Translates a UI auth config (bearer / header API key) into HTTP headers."""
+    headers = {}
+    if auth_config and isinstance(auth_config, dict):
+        auth_type = auth_config.get("type")
+        if auth_type == "bearer" and auth_config.get("token"):
+            headers["Authorization"] = f"Bearer {auth_config['token']}"
+        elif auth_type == "apiKey" and auth_config.get("key") and auth_config.get("name"):
+            headers[auth_config["name"]] = auth_config["key"]
+    return headers
+
+
+def mcp_connection_key(server_url: str, auth_config: dict | None) -> tuple[str, str]:
+    """Pool key: the server URL plus a hash of the auth config (credentials are never logged)."""
+    auth_hash = hashlib.sha256(json.dumps(auth_config or {}, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return server_url, auth_hash
+
+
+class _PooledMcpConnection:
+    """
+    One initialized ClientSession. The MCP transports are anyio context managers that must be
+    entered and exited by the same task, so a dedicated owner task holds them open until close().
+    """
+
+    def __init__(self, server_url: str, auth_config: dict | None):
+        self.server_url = server_url
+        self.auth_config = auth_config
+        self.session = None
+        self.transport_description = "SSE" if server_url.endswith("/sse") else "StreamableHTTP"
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self.last_healthy_at = self.created_at
+        self.active_users = 0
+        self._ready = None
+        self._stop_event = None
+        self._owner_task = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._owner_task is not None and not self._owner_task.done() and self.session is not None
+
+    async def open(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._ready = loop.create_future()
+        self._stop_event = asyncio.Event()
+        self._owner_task = loop.create_task(self._own_connection(), name=f"mcp-session-{self.server_url}")
+        try:
+            await asyncio.wait_for(asyncio.shield(self._ready), timeout=MCP_CONNECT_TIMEOUT_SEC)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _own_connection(self) -> None:
+        headers = build_mcp_auth_headers(self.auth_config)
+        client_kwargs = {"headers": headers} if headers else {}
+        if self.transport_description == "SSE":
+            client_context_manager = sse_client(url=self.server_url, **client_kwargs)
+        else:
+            client_context_manager = streamablehttp_client(url=self.server_url, **client_kwargs)
+        try:
+            async with client_context_manager as client_streams_tuple:
+                read_stream, write_stream = client_streams_tuple[0], client_streams_tuple[1]
+                async with ClientSession(read_stream, write_stream) as mcp_client:
+                    await mcp_client.initialize()
+                    self.session = mcp_client
+                    logger.info(f"[MCPPool] Initialized {self.transport_description} session with {self.server_url}.")
+                    if not self._ready.done():
+                        self._ready.set_result(True)
+                    await self._stop_event.wait()
+        except BaseException as e_connection:
+            if not self._ready.done():
+                self._ready.set_exception(e_connection if isinstance(e_connection, Exception) else ConnectionError(str(e_connection)))
+            elif not isinstance(e_connection, asyncio.CancelledError):
+                logger.warn(f"[MCPPool] Session with {self.server_url} ended unexpectedly: {type(e_connection).__name__} - {e_connection}")
+        finally:
+            self.session = None
+
+    async def ping(self) -> bool:
+        if not self.is_open:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=MCP_HEALTHCHECK_TIMEOUT_SEC)
+            self.last_healthy_at = time.monotonic()
+            return True
+        except Exception as e_ping:
+            logger.warn(f"[MCPPool] Health check failed for {self.server_url}: {type(e_ping).__name__} - {e_ping}")
+            return False
+
+    async def close(self) -> None:
+        if self._stop_event is not None:
+            self._stop_event.set()
+        if self._owner_task is not None and not self._owner_task.done():
+            try:
+                await asyncio.wait_for(self._owner_task, timeout=MCP_HEALTHCHECK_TIMEOUT_SEC)
+            except BaseException:
+                self._owner_task.cancel()
+        self.session = None
+
+
+class McpSessionPool:
+    """
+    Initialized MCP sessions and ADK MCPToolsets keyed by (server URL, auth hash), shared by tool
+    discovery (list_mcp_server_tools) and local diagnostic runs on one event loop. Use
+    get_mcp_session_pool() to obtain it.
+    """
+
+    def __init__(self):
+        self._connections = {}
+        self._connection_locks = {}
+        self._toolsets = {} # key -> [toolset, last_used_at]
+        self._reaper_task = None
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.get_running_loop().create_task(self._reap_idle(), name="mcp-pool-reaper")
+
+    async def _reap_idle(self) -> None:
+        while self._connections or self._toolsets:
+            await asyncio.sleep(max(1.0, MCP_SESSION_IDLE_TIMEOUT_SEC / 4))
+            now = time.monotonic()
+            for key, connection in list(self._connections.items()):
+                if connection.active_users == 0 and now - connection.last_used_at >= MCP_SESSION_IDLE_TIMEOUT_SEC:
+                    self._connections.pop(key, None)
+                    logger.info(f"[MCPPool] Closing idle session with {connection.server_url}.")
+                    await connection.close()
+            for key, (toolset, last_used_at) in list(self._toolsets.items()):
+                if now - last_used_at >= MCP_SESSION_IDLE_TIMEOUT_SEC:
+                    self._toolsets.pop(key, None)
+                    await self._close_toolset(key, toolset)
+
+    @staticmethod
+    async def _close_toolset(key, toolset) -> None:
+        try:
+            await toolset.close()
+            logger.info(f"[MCPPool] Closed idle MCPToolset for {key[0]}.")
+        except Exception as e_close:
+            # ADK toolsets may refuse to close from a task other than the one that opened them;
+            # dropping the reference still lets the connection be garbage collected.
+            logger.warn(f"[MCPPool] Could not close MCPToolset for {key[0]} cleanly: {type(e_close).__name__} - {e_close}")
+
+    async def _get_connection(self, server_url: str, auth_config: dict | None, force_reconnect: bool = False) -> _PooledMcpConnection:
+        key = mcp_connection_key(server_url, auth_config)
+        lock = self._connection_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            connection = self._connections.get(key)
+            if connection is not None and not force_reconnect and connection.is_open:
+                if time.monotonic() - connection.last_healthy_at < MCP_HEALTHCHECK_INTERVAL_SEC or await connection.ping():
+                    return connection
+            if connection is not None:
+                self._connections.pop(key, None)
+                logger.info(f"[MCPPool] Reconnecting to {server_url}.")
+                await connection.close()
+            connection = _PooledMcpConnection(server_url, auth_config)
+            await connection.open()
+            self._connections[key] = connection
+            self._ensure_reaper()
+            return connection
+
+    async def run(self, server_url: str, auth_config: dict | None, operation):
+        """
+        Runs operation(session) on the pooled session for the server. If it fails on a reused
+        session, the session is reconnected and the operation retried once.
+        """
+        connection = await self._get_connection(server_url, auth_config)
+        for attempt in range(2):
+            connection.active_users += 1
+            try:
+                return await operation(connection.session)
+            except Exception as e_operation:
+                reused_session = connection.created_at < connection.last_used_at
+                if attempt > 0 or not reused_session:
+                    raise
+                logger.warn(f"[MCPPool] Operation failed on reused session with {server_url} ({type(e_operation).__name__}: {e_operation}). Reconnecting and retrying once.")
+            finally:
+                connection.active_users -= 1
+                connection.last_used_at = time.monotonic()
+            connection = await self._get_connection(server_url, auth_config, force_reconnect=True)
+
+    def get_toolset(self, server_url: str, auth_config: dict | None, tool_filter: list, factory):
+        """
+        Returns a shared MCPToolset for the server, auth and tool filter, creating it with factory().
+        Only agents built with share_mcp_sessions (local diagnostic runs) use pooled toolsets.
+        The toolset's own session manager keeps its session open between runs and reconnects it
+        when it drops; the pool closes toolsets that stay unused past the idle timeout.
+        """
+        key = (*mcp_connection_key(server_url, auth_config), tuple(sorted(set(tool_filter))))
+        entry = self._toolsets.get(key)
+        if entry is None:
+            entry = [factory(), time.monotonic()]
+            self._toolsets[key] = entry
+            logger.info(f"[MCPPool] Created shared MCPToolset for {server_url} with {len(key[2])} tool(s).")
+        else:
+            entry[1] = time.monotonic()
+            logger.info(f"[MCPPool] Reusing shared MCPToolset for {server_url}.")
+        self._ensure_reaper()
+        return entry[0]
+
+    async def close_all(self) -> None:
+        connections, self._connections = list(self._connections.values()), {}
+        toolsets, self._toolsets = list(self._toolsets.items()), {}
+        for connection in connections:
+            await connection.close()
+        for key, (toolset, _) in toolsets:
+            await self._close_toolset(key, toolset)
+
+
+def get_mcp_session_pool() -> McpSessionPool:
+    """The pool for the running event loop (in practice, the worker loop)."""
+    return get_loop_client(("mcp_session_pool",), McpSessionPool)
+
+
+__all__ = ['build_mcp_auth_headers', 'mcp_connection_key', 'McpSessionPool', 'get_mcp_session_pool']
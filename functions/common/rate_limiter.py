@@ -0,0 +1,238 @@
+# functions/common/rate_limiter.py
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from firebase_admin import firestore
+from .core import logger, get_async_db
+from .config import (
+    RATE_LIMITER_MODE,
+    LLM_RATE_LIMITS_JSON,
+    RATE_LIMIT_FIRESTORE_SHARDS,
+    RATE_LIMIT_MAX_INLINE_WAIT_SEC
+)
+from .worker_runtime import get_loop_client
+
+RATE_LIMITS_COLLECTION = "rateLimits"
+
+
+def _parse_default_limits(raw_json: str) -> dict:
+    try:
+        parsed_limits = json.loads(raw_json or "{}")
+        if isinstance(parsed_limits, dict):
+            return {scope: limits for scope, limits in parsed_limits.items() if isinstance(limits, dict)}
+        logger.warn("[RateLimiter] LLM_RATE_LIMITS_JSON must be a JSON object. Ignoring it.")
+    except ValueError as e_parse:
+        logger.warn(f"[RateLimiter] Could not parse LLM_RATE_LIMITS_JSON: {e_parse}. Ignoring it.")
+    return {}
+
+_default_limits = _parse_default_limits(LLM_RATE_LIMITS_JSON)
+
+
+class RateLimitDeferred(Exception):
+    """Raised when a call would have to wait longer than RATE_LIMIT_MAX_INLINE_WAIT_SEC for capacity."""
+
+    def __init__(self, limit_key: str, retry_after_sec: float):
+        super().__init__(f"Rate limit for '{limit_key}' reached; retry in {retry_after_sec:.1f}s.")
+        self.limit_key = limit_key
+        self.retry_after_sec = retry_after_sec
+
+
+@dataclass(frozen=True, slots=True)
+class RateLimitSpec:
+    key: str # "provider" or "provider/modelString": the scope the limits were configured for
+    rpm: float | None
+    tpm: float | None
+    max_concurrent: int | None
+
+
+def _positive_number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0 else None
+
+
+def resolve_rate_limit_spec(model_config: dict | None) -> RateLimitSpec | None:
+    """
+    Limits for a model: the model doc's 'rateLimits' map, then LLM_RATE_LIMITS_JSON for
+    "provider/modelString", then for "provider". None when the limiter is off or nothing is configured.
+    """
+    if RATE_LIMITER_MODE == "off" or not model_config:
+        return None
+    provider = model_config.get("provider")
+    if not provider:
+        return None
+    model_scope = f"{provider}/{model_config.get('modelString') or ''}"
+    for scope, limits in ((model_scope, model_config.get("rateLimits")), (model_scope, _default_limits.get(model_scope)), (provider, _default_limits.get(provider))):
+        if not isinstance(limits, dict):
+            continue
+        rpm, tpm = _positive_number(limits.get("rpm")), _positive_number(limits.get("tpm"))
+        max_concurrent = _positive_number(limits.get("maxConcurrent"))
+        if rpm or tpm or max_concurrent:
+            return RateLimitSpec(key=scope, rpm=rpm, tpm=tpm, max_concurrent=int(max_concurrent) if max_concurrent else None)
+    return None
+
+
+def estimate_request_tokens(prompt_text: str, model_config: dict | None) -> int:
+    """Rough TPM cost of a call: prompt characters / 4 plus the configured output allowance."""
+    max_output_tokens = _positive_number((model_config or {}).get("maxOutputTokens")) or 0
+    return max(1, len(prompt_text or "") // 4) + int(max_output_tokens)
+
+
+def _refilled_bucket(state: dict, rpm: float | None, tpm: float | None, now: float, capacity_share: float) -> dict:
+    """A bucket's state refilled up to now. Each bucket holds one minute of its share and refills continuously."""
+    new_state = {"updatedAt": now}
+    for field, limit in (("requests", rpm), ("tokens", tpm)):
+        if not limit:
+            continue
+        capacity = limit * capacity_share
+        elapsed = max(0.0, now - state.get("updatedAt", now))
+        new_state[field] = min(capacity, state.get(field, capacity) + elapsed * capacity / 60.0)
+    return new_state
+
+
+def _take_from_buckets(states: list[dict], rpm: float | None, tpm: float | None, request_tokens: int, now: float, shard_count: int | None = None) -> tuple[list[dict], float]:
+    """
+    Token-bucket step shared by both backends. The limits are split evenly over shard_count buckets
+    (default: len(states)), and states are the buckets this step may draw from. A request is charged
+    its real cost, drawn from as many of them as needed, so no split admits more than the limit.
+    Returns (new_states, wait_sec); wait_sec is 0 when the request was admitted.
+    """
+    shard_count = shard_count or len(states)
+    capacity_share = 1.0 / shard_count
+    new_states = [_refilled_bucket(state, rpm, tpm, now, capacity_share) for state in states]
+    # A request larger than the whole limit waits for full buckets (and takes all of them), not forever.
+    costs = {field: min(cost, limit) for field, limit, cost in (("requests", rpm, 1), ("tokens", tpm, request_tokens)) if limit}
+    wait_sec = 0.0
+    for field, cost in costs.items():
+        limit = rpm if field == "requests" else tpm
+        available = sum(state[field] for state in new_states)
+        if available < cost:
+            refill_per_sec = limit * capacity_share * len(new_states) / 60.0
+            wait_sec = max(wait_sec, (cost - available) / refill_per_sec)
+    if wait_sec == 0.0:
+        for field, cost in costs.items():
+            remaining = cost
+            for state in new_states:
+                drawn = min(remaining, max(0.0, state[field]))
+                state[field] -= drawn
+                remaining -= drawn
+    return new_states, wait_sec
+
+
+class _LocalBuckets:
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def take(self, spec: RateLimitSpec, request_tokens: int) -> float:
+        with self._lock:
+            new_states, wait_sec = _take_from_buckets([self._states.get(spec.key, {})], spec.rpm, spec.tpm, request_tokens, time.monotonic())
+            self._states[spec.key] = new_states[0]
+        return wait_sec
+
+_local_buckets = _LocalBuckets()
+
+
+def _shard_doc_id(limit_key: str, shard_index: int) -> str:
+    readable_key = re.sub(r'[^a-zA-Z0-9_.-]', '_', limit_key)[:80]
+    return f"{readable_key}_{hashlib.sha256(limit_key.encode('utf-8')).hexdigest()[:8]}_{shard_index}"
+
+
+def _fits_one_shard(spec: RateLimitSpec, request_tokens: int, shard_count: int) -> bool:
+    return (not spec.rpm or 1 <= spec.rpm / shard_count) and (not spec.tpm or request_tokens <= spec.tpm / shard_count)
+
+
+async def _take_from_firestore(spec: RateLimitSpec, request_tokens: int) -> float:
+    """
+    Each of RATE_LIMIT_FIRESTORE_SHARDS documents holds an equal share of the limits, so concurrent
+    instances rarely contend on one document. A request that fits in one share is first tried on a
+    random shard alone; otherwise (or if that shard is short) it is charged across all shards in
+    one transaction.
+    """
+    shard_count = max(1, RATE_LIMIT_FIRESTORE_SHARDS)
+    async_db = get_async_db()
+    limits_col = async_db.collection(RATE_LIMITS_COLLECTION)
+    shard_refs = [limits_col.document(_shard_doc_id(spec.key, shard_index)) for shard_index in range(shard_count)]
+
+    async def _take_from_shards(refs: list) -> float:
+        @firestore.async_transactional
+        async def _take_in_transaction(transaction):
+            shard_snaps = {snap.id: snap async for snap in async_db.get_all(refs, transaction=transaction)}
+            shard_states = [(shard_snaps[ref.id].to_dict() or {}) if ref.id in shard_snaps and shard_snaps[ref.id].exists else None for ref in refs]
+            # Wall-clock time: the buckets are shared by instances whose monotonic clocks differ.
+            new_states, wait_sec = _take_from_buckets([state or {} for state in shard_states], spec.rpm, spec.tpm, request_tokens, time.time(), shard_count)
+            for ref, state, new_state in zip(refs, shard_states, new_states):
+                if wait_sec == 0.0 or state is None:
+                    transaction.set(ref, {**new_state, "limitKey": spec.key})
+            return wait_sec
+
+        return await _take_in_transaction(async_db.transaction())
+
+    if shard_count > 1 and _fits_one_shard(spec, request_tokens, shard_count):
+        if await _take_from_shards([random.choice(shard_refs)]) == 0.0:
+            return 0.0
+    return await _take_from_shards(shard_refs)
+
+
+async def _take(spec: RateLimitSpec, request_tokens: int) -> float:
+    if not (spec.rpm or spec.tpm):
+        return 0.0
+    if RATE_LIMITER_MODE == "firestore":
+        try:
+            return await _take_from_firestore(spec, request_tokens)
+        except Exception as e_firestore:
+            # Never fail a run because the shared limiter is unavailable; fall back to this instance's view.
+            logger.warn(f"[RateLimiter] Firestore limiter unavailable for '{spec.key}' ({type(e_firestore).__name__}: {e_firestore}). Using the local limiter.")
+    return _local_buckets.take(spec, request_tokens)
+
+
+def _concurrency_semaphore(spec: RateLimitSpec) -> asyncio.Semaphore | None:
+    if not spec.max_concurrent:
+        return None
+    return get_loop_client(("provider_concurrency", spec.key, spec.max_concurrent), lambda: asyncio.Semaphore(spec.max_concurrent))
+
+
+@asynccontextmanager
+async def rate_limited_call(spec: RateLimitSpec | None, request_tokens: int):
+    """
+    Admits one call under spec: waits for a concurrency slot and for RPM/TPM capacity for up to
+    RATE_LIMIT_MAX_INLINE_WAIT_SEC in total, then raises RateLimitDeferred. The concurrency slot
+    (limited per instance) is held until the block exits.
+    """
+    if spec is None:
+        yield
+        return
+    deadline = time.monotonic() + RATE_LIMIT_MAX_INLINE_WAIT_SEC
+    semaphore = _concurrency_semaphore(spec)
+    if semaphore is not None:
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise RateLimitDeferred(spec.key, max(1.0, RATE_LIMIT_MAX_INLINE_WAIT_SEC))
+    try:
+        while True:
+            wait_sec = await _take(spec, request_tokens)
+            if wait_sec <= 0:
+                break
+            if time.monotonic() + wait_sec > deadline:
+                raise RateLimitDeferred(spec.key, wait_sec)
+            logger.info(f"[RateLimiter] Waiting {wait_sec:.2f}s for capacity on '{spec.key}'.")
+            await asyncio.sleep(wait_sec)
+        yield
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+
+
+__all__ = [
+    'RATE_LIMITS_COLLECTION',
+    'RateLimitDeferred',
+    'RateLimitSpec',
+    'resolve_rate_limit_spec',
+    'estimate_request_tokens',
+    'rate_limited_call'
+]
@@ -0,0 +1,38 @@
+# functions/common/task_queue.py
+import json
+from datetime import datetime, timedelta, timezone
+from google.cloud import tasks_v2
+from google.protobuf import timestamp_pb2
+from .core import logger
+from .config import get_gcp_project_config
+from .worker_runtime import get_cloud_tasks_client
+
+
+def enqueue_function_task(function_name: str, payload: dict, delay_sec: float = 0) -> str:
+    """
+    Enqueues a Cloud Task for the task-queue function function_name with payload as its data,
+    optionally scheduled delay_sec seconds from now. Returns the created task's name.
+    """
+    project_id, location, _ = get_gcp_project_config()
+    tasks_client = get_cloud_tasks_client()
+    queue_path = tasks_client.queue_path(project_id, location, function_name)
+
+    task = {
+        "http_request": {
+            "http_method": tasks_v2.HttpMethod.POST,
+            "url": f"https://{location}-{project_id}.cloudfunctions.net/{function_name}",
+            "headers": {"Content-type": "application/json"},
+            "body": json.dumps({"data": payload}).encode(),
+        }
+    }
+    if delay_sec and delay_sec > 0:
+        schedule_time = timestamp_pb2.Timestamp()
+        schedule_time.FromDatetime(datetime.now(timezone.utc) + timedelta(seconds=delay_sec))
+        task["schedule_time"] = schedule_time
+
+    created_task = tasks_client.create_task(parent=queue_path, task=task)
+    logger.info(f"[TaskQueue] Enqueued task for '{function_name}'" + (f" with a {delay_sec:.1f}s delay." if delay_sec and delay_sec > 0 else "."))
+    return created_task.name
+
+
+__all__ = ['enqueue_function_task']
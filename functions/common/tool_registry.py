@@ -0,0 +1,131 @@
+# functions/common/tool_registry.py
+import hashlib
+import importlib
+import json
+import os
+import threading
+import time
+from .core import logger
+from .cache import TTLCache
+from .config import TOOL_PREWARM_FUNCTION_TARGETS, TOOL_IMPORT_SLOW_THRESHOLD_SEC, TOOL_SPEC_CACHE_MAX_ENTRIES
+
+# (module_path, class_name) -> class. Classes never change within a process, so no expiry.
+_tool_classes = {}
+_tool_classes_lock = threading.Lock()
+# module_path -> seconds spent in the first import_module() call in this process.
+_module_import_timings = {}
+
+# Exported ADK specs keyed by a hash of the tool config. Tools are stateless between calls, so one
+# spec can be shared by every agent that configures the same tool the same way.
+_tool_spec_cache = TTLCache("ToolSpecs", max_entries=TOOL_SPEC_CACHE_MAX_ENTRIES, ttl_sec=24 * 3600)
+
+_prewarm_thread = None
+_prewarm_lock = threading.Lock()
+
+
+def _import_module_timed(module_path: str):
+    if module_path in _module_import_timings:
+        return importlib.import_module(module_path)
+    import_start_time = time.monotonic()
+    module = importlib.import_module(module_path)
+    import_duration = time.monotonic() - import_start_time
+    _module_import_timings.setdefault(module_path, import_duration)
+    if import_duration >= TOOL_IMPORT_SLOW_THRESHOLD_SEC:
+        logger.warn(f"[ToolRegistry] Slow tool import: '{module_path}' took {import_duration:.2f}s.")
+    else:
+        logger.debug(f"[ToolRegistry] Imported '{module_path}' in {import_duration:.3f}s.")
+    return module
+
+
+def resolve_tool_class(module_path: str, class_name: str):
+    """Imports module_path (once per process) and returns its class_name attribute."""
+    class_key = (module_path, class_name)
+    tool_class = _tool_classes.get(class_key)
+    if tool_class is not None:
+        return tool_class
+    module = _import_module_timed(module_path)
+    tool_class = getattr(module, class_name)
+    with _tool_classes_lock:
+        _tool_classes[class_key] = tool_class
+    return tool_class
+
+
+def tool_config_cache_key(tool_config: dict) -> str:
+    """Stable hash of the parts of a tool config that determine the built tool."""
+    key_material = {
+        "type": tool_config.get("type"),
+        "module_path": tool_config.get("module_path"),
+        "class_name": tool_config.get("class_name"),
+        "configuration": tool_config.get("configuration") or {}
+    }
+    return hashlib.sha256(json.dumps(key_material, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_cached_tool_spec(tool_config: dict):
+    return _tool_spec_cache.get(tool_config_cache_key(tool_config))
+
+
+def cache_tool_spec(tool_config: dict, tool_spec) -> None:
+    _tool_spec_cache.set(tool_config_cache_key(tool_config), tool_spec)
+
+
+def get_import_timings() -> dict[str, float]:
+    """Per-module import durations (seconds), slowest first."""
+    return dict(sorted(_module_import_timings.items(), key=lambda item: item[1], reverse=True))
+
+
+def _prewarm_from_manifest(manifest_path: str) -> None:
+    prewarm_start_time = time.monotonic()
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest_root_object = json.load(f)
+        tool_entries = manifest_root_object.get("tools", []) if isinstance(manifest_root_object, dict) else []
+    except Exception as e_manifest:
+        logger.warn(f"[ToolRegistry] Could not read tool manifest '{manifest_path}' for pre-warm: {e_manifest}")
+        return
+
+    resolved_count, failed_count = 0, 0
+    for tool_entry in tool_entries:
+        module_path = tool_entry.get("module_path")
+        class_name = tool_entry.get("class_name")
+        if not module_path or not class_name:
+            continue
+        try:
+            resolve_tool_class(module_path, class_name)
+            resolved_count += 1
+        except Exception as e_import:
+            failed_count += 1
+            logger.warn(f"[ToolRegistry] Pre-warm could not resolve {module_path}.{class_name}: {type(e_import).__name__} - {e_import}")
+
+    slowest_imports = list(get_import_timings().items())[:5]
+    logger.info(f"[ToolRegistry] Pre-warm finished in {time.monotonic() - prewarm_start_time:.2f}s. "
+                f"Resolved: {resolved_count}, Failed: {failed_count}. Slowest imports: "
+                + ", ".join(f"{module_path} ({duration:.2f}s)" for module_path, duration in slowest_imports))
+
+
+def start_manifest_prewarm(manifest_path: str) -> bool:
+    """
+    Starts pre-importing the manifest's tool modules on a daemon thread, once per process and
+    only for the function targets listed in TOOL_PREWARM_FUNCTION_TARGETS. Returns True if started.
+    """
+    global _prewarm_thread
+    function_target = os.environ.get('FUNCTION_TARGET')
+    if not function_target or function_target not in TOOL_PREWARM_FUNCTION_TARGETS:
+        return False
+    with _prewarm_lock:
+        if _prewarm_thread is not None:
+            return False
+        _prewarm_thread = threading.Thread(target=_prewarm_from_manifest, args=(manifest_path,), name="tool-prewarm", daemon=True)
+        _prewarm_thread.start()
+    logger.info(f"[ToolRegistry] Started background pre-warm of tool modules from '{manifest_path}' for '{function_target}'.")
+    return True
+
+
+__all__ = [
+    'resolve_tool_class',
+    'tool_config_cache_key',
+    'get_cached_tool_spec',
+    'cache_tool_spec',
+    'get_import_timings',
+    'start_manifest_prewarm'
+]
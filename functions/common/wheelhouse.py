@@ -0,0 +1,177 @@
+# functions/common/wheelhouse.py
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from .core import logger
+from .agent_plan import canonical_json
+from .config import (
+    get_gcp_project_config,
+    WHEELHOUSE_MODE,
+    WHEELHOUSE_LOCAL_DIR,
+    WHEELHOUSE_GCS_PREFIX,
+    WHEELHOUSE_BUILD_TIMEOUT_SEC
+)
+from .worker_runtime import get_shared_client
+
+# Custom repo requirements as written by the deployment logic once their ref is pinned to a commit:
+# git+<url>@<40-hex sha>#egg=<name>[&subdirectory=<dir>]
+PINNED_GIT_REQUIREMENT_PATTERN = re.compile(r"^git\+(?P<url>.+)@(?P<sha>[0-9a-f]{40})(?:#(?P<fragment>.*))?$")
+
+
+def wheelhouse_key(commit_sha: str, subdirectory: str | None = None) -> str:
+    """Store key for the wheels of one package at one commit, for this interpreter's Python version."""
+    python_tag = f"cp{sys.version_info.major}{sys.version_info.minor}"
+    digest = hashlib.sha256(canonical_json({"sha": commit_sha, "subdirectory": subdirectory or "", "python": python_tag}).encode("utf-8")).hexdigest()
+    return f"{commit_sha[:12]}-{python_tag}-{digest[:12]}"
+
+
+def _list_wheels(directory: str) -> list[str]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".whl"))
+
+
+class LocalWheelStore:
+    """Wheels kept in <root_dir>/<key>/. Used for tests, and as the download target of GcsWheelStore."""
+
+    def __init__(self, root_dir: str = WHEELHOUSE_LOCAL_DIR):
+        self.root_dir = root_dir
+
+    def key_dir(self, key: str) -> str:
+        return os.path.join(self.root_dir, key)
+
+    def get(self, key: str) -> list[str] | None:
+        return _list_wheels(self.key_dir(key)) or None
+
+    def put(self, key: str, wheel_paths: list[str]) -> list[str]:
+        target_dir = self.key_dir(key)
+        existing_wheels = _list_wheels(target_dir)
+        if existing_wheels:
+            return existing_wheels # Same key, same commit: a concurrent build got here first
+        os.makedirs(self.root_dir, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f".{key}-", dir=self.root_dir)
+        for wheel_path in wheel_paths:
+            shutil.copy2(wheel_path, staging_dir)
+        try:
+            os.rename(staging_dir, target_dir) # Atomic: readers never see a partial key directory
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return _list_wheels(target_dir)
+
+
+class GcsWheelStore:
+    """Wheels kept in gs://<bucket>/<prefix>/<key>/ and downloaded to a LocalWheelStore before use."""
+
+    def __init__(self, bucket_name: str, prefix: str = WHEELHOUSE_GCS_PREFIX, local_store: LocalWheelStore | None = None):
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip("/")
+        self.local_store = local_store or LocalWheelStore()
+
+    def _bucket(self):
+        from google.cloud import storage
+        storage_client = get_shared_client(("storage_client",), storage.Client)
+        return storage_client.bucket(self.bucket_name)
+
+    def get(self, key: str) -> list[str] | None:
+        local_wheels = self.local_store.get(key)
+        if local_wheels:
+            return local_wheels
+        blobs = [blob for blob in self._bucket().list_blobs(prefix=f"{self.prefix}/{key}/") if blob.name.endswith(".whl")]
+        if not blobs:
+            return None
+        download_dir = tempfile.mkdtemp(prefix="wheelhouse-download-")
+        try:
+            for blob in blobs:
+                blob.download_to_filename(os.path.join(download_dir, os.path.basename(blob.name)))
+            return self.local_store.put(key, _list_wheels(download_dir))
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+    def put(self, key: str, wheel_paths: list[str]) -> list[str]:
+        bucket = self._bucket()
+        for wheel_path in wheel_paths:
+            bucket.blob(f"{self.prefix}/{key}/{os.path.basename(wheel_path)}").upload_from_filename(wheel_path)
+        return self.local_store.put(key, wheel_paths)
+
+
+class PipWheelBuilder:
+    """Builds the wheel of a single requirement (without its dependencies) with 'pip wheel'."""
+
+    def __init__(self, timeout_sec: float = WHEELHOUSE_BUILD_TIMEOUT_SEC):
+        self.timeout_sec = timeout_sec
+
+    def build(self, requirement: str, output_dir: str) -> list[str]:
+        completed = subprocess.run(
+            [sys.executable, "-m", "pip", "wheel", "--no-deps", "--disable-pip-version-check", "--wheel-dir", output_dir, requirement],
+            capture_output=True,
+            text=True,
+            timeout=self.timeout_sec,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+            check=False
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"pip wheel exited with {completed.returncode}: {completed.stderr.strip()[-500:]}")
+        return _list_wheels(output_dir)
+
+
+def get_default_wheel_store():
+    """The store selected by WHEELHOUSE_MODE ("gcs", "local" or "off"), or None when disabled."""
+    if WHEELHOUSE_MODE == "off":
+        return None
+    if WHEELHOUSE_MODE == "local":
+        return LocalWheelStore()
+    _, _, staging_bucket = get_gcp_project_config()
+    return GcsWheelStore(staging_bucket.replace("gs://", ""))
+
+
+class Wheelhouse:
+    """Resolves pinned custom repo requirements to prebuilt wheels, building and storing missing ones."""
+
+    def __init__(self, store, builder=None):
+        self.store = store
+        self.builder = builder or PipWheelBuilder()
+
+    def ensure_wheels(self, requirement: str) -> list[str] | None:
+        """
+        Local paths of the wheels for a requirement pinned to a commit SHA, or None if it is not
+        pinned or cannot be built (the caller then keeps installing it from source).
+        """
+        match = PINNED_GIT_REQUIREMENT_PATTERN.match(requirement)
+        if not match:
+            return None
+        fragment_params = dict(part.split("=", 1) for part in (match.group("fragment") or "").split("&") if "=" in part)
+        key = wheelhouse_key(match.group("sha"), fragment_params.get("subdirectory"))
+        try:
+            cached_wheels = self.store.get(key)
+            if cached_wheels:
+                logger.info(f"[Wheelhouse] Using prebuilt wheel(s) {[os.path.basename(path) for path in cached_wheels]} for {key}.")
+                return cached_wheels
+            build_dir = tempfile.mkdtemp(prefix="wheelhouse-build-")
+            try:
+                built_wheels = self.builder.build(requirement, build_dir)
+                if not built_wheels:
+                    raise RuntimeError("no wheel was produced")
+                stored_wheels = self.store.put(key, built_wheels)
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+            logger.info(f"[Wheelhouse] Built and stored wheel(s) {[os.path.basename(path) for path in stored_wheels]} for {key}.")
+            return stored_wheels
+        except Exception as e:
+            logger.warn(f"[Wheelhouse] Could not provide wheels for '{requirement}': {type(e).__name__}: {e}. It will be installed from source.")
+            return None
+
+
+__all__ = [
+    'PINNED_GIT_REQUIREMENT_PATTERN',
+    'wheelhouse_key',
+    'LocalWheelStore',
+    'GcsWheelStore',
+    'PipWheelBuilder',
+    'Wheelhouse',
+    'get_default_wheel_store'
+]
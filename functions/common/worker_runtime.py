@@ -0,0 +1,138 @@
+# functions/common/worker_runtime.py
+import asyncio
+import concurrent.futures
+import threading
+import time
+from .core import logger
+
+# One background event loop per function instance. Task handlers submit their coroutines to it
+# instead of calling asyncio.run(), so loop-bound clients (gRPC aio channels, httpx pools) and the
+# clients in the registry below survive between tasks on a warm instance.
+_worker_loop = None
+_worker_thread = None
+_worker_loop_lock = threading.Lock()
+
+_client_registry = {}
+_client_registry_lock = threading.Lock()
+
+
+def _run_worker_loop(loop: asyncio.AbstractEventLoop, loop_ready: threading.Event):
+    asyncio.set_event_loop(loop)
+    loop_ready.set()
+    loop.run_forever()
+
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    """Returns the instance-wide worker loop, starting its thread on first use."""
+    global _worker_loop, _worker_thread
+    with _worker_loop_lock:
+        if _worker_loop is None or _worker_loop.is_closed() or not _worker_thread.is_alive():
+            loop = asyncio.new_event_loop()
+            loop_ready = threading.Event()
+            _worker_thread = threading.Thread(target=_run_worker_loop, args=(loop, loop_ready), name="agent-worker-loop", daemon=True)
+            _worker_thread.start()
+            loop_ready.wait()
+            _worker_loop = loop
+            logger.info("[WorkerRuntime] Started background worker event loop.")
+        return _worker_loop
+
+
+def run_in_worker_loop(coro, timeout: float | None = None):
+    """
+    Runs a coroutine on the worker loop and blocks the calling thread until it finishes.
+    Drop-in replacement for asyncio.run() in synchronous function entry points.
+    """
+    loop = get_worker_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        coro.close()
+        raise RuntimeError("run_in_worker_loop() cannot be called from the worker loop itself; await the coroutine instead.")
+
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+
+def get_shared_client(key, factory, ttl_sec: float | None = None):
+    """
+    Returns a lazily created client that is reused across tasks on this instance.
+
+    Args:
+        key: Hashable registry key, e.g. ("vertex_session_service", project, location).
+        factory: Zero-argument callable that creates the client.
+        ttl_sec: Optional lifetime after which the client is recreated on next use.
+    """
+    now = time.monotonic()
+    with _client_registry_lock:
+        entry = _client_registry.get(key)
+        if entry is not None and (entry[1] is None or entry[1] > now):
+            return entry[0]
+    # Created outside the lock so a slow factory does not block unrelated lookups; if two
+    # threads race, the first stored client wins.
+    client = factory()
+    with _client_registry_lock:
+        entry = _client_registry.get(key)
+        if entry is not None and (entry[1] is None or entry[1] > now):
+            return entry[0]
+        _client_registry[key] = (client, now + ttl_sec if ttl_sec else None)
+    logger.info(f"[WorkerRuntime] Created shared client for key {key}.")
+    return client
+
+
+def get_loop_client(key, factory):
+    """Like get_shared_client(), for clients bound to the running event loop (httpx/gRPC aio)."""
+    with _client_registry_lock:
+        # Entries of loops that have finished (e.g. an asyncio.run() call) can never be used again.
+        for stale_key in [registry_key for registry_key in _client_registry
+                          if isinstance(registry_key, tuple) and len(registry_key) == 3 and registry_key[0] == "loop" and registry_key[1].is_closed()]:
+            del _client_registry[stale_key]
+    return get_shared_client(("loop", asyncio.get_running_loop(), key), factory)
+
+
+def drop_shared_client(key) -> None:
+    """Removes a client from the registry so the next lookup recreates it."""
+    with _client_registry_lock:
+        _client_registry.pop(key, None)
+
+
+def get_vertex_session_service(project_id: str, location: str):
+    from google.adk.sessions import VertexAiSessionService
+    return get_shared_client(
+        ("vertex_session_service", project_id, location),
+        lambda: VertexAiSessionService(project=project_id, location=location)
+    )
+
+
+def get_agent_engine(resource_name: str, ttl_sec: float = 600.0):
+    """Cached agent_engines handle; the TTL picks up redeployed engines with changed operations."""
+    from vertexai.agent_engines import get as get_engine
+    return get_shared_client(("agent_engine", resource_name), lambda: get_engine(resource_name), ttl_sec=ttl_sec)
+
+
+def get_cloud_tasks_client():
+    from google.cloud import tasks_v2
+    return get_shared_client(("cloud_tasks_client",), tasks_v2.CloudTasksClient)
+
+
+def get_logging_client():
+    from google.cloud.logging_v2.services.logging_service_v2 import LoggingServiceV2Client
+    return get_shared_client(("logging_client",), LoggingServiceV2Client)
+
+
+__all__ = [
+    'get_worker_loop',
+    'run_in_worker_loop',
+    'get_shared_client',
+    'get_loop_client',
+    'drop_shared_client',
+    'get_vertex_session_service',
+    'get_agent_engine',
+    'get_cloud_tasks_client',
+    'get_logging_client'
+]
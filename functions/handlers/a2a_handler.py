@@ -3,6 +3,7 @@ import httpx
 import asyncio
 from firebase_functions import https_fn
 from common.core import logger
+from common.a2a_transport import get_a2a_client, a2a_timeout
 import traceback
 from urllib.parse import urljoin
 
@@ -20,23 +21,23 @@ async def _fetch_a2a_agent_card_logic_async(req: https_fn.CallableRequest):
     logger.info(f"[A2AHandler] Fetching AgentCard from well-known URL: {agent_card_url}")
 
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            # According to the A2A spec, the AgentCard is at a standardized well-known path.
-            response = await client.get(agent_card_url)
-            response.raise_for_status() # Raise an exception for 4xx/5xx status codes
-            agent_card_data = response.json()
-
-            # Basic validation of the agent card structure
-            required_keys = ["name", "description", "url", "version", "defaultInputModes", "defaultOutputModes", "capabilities"]
-            if not all(key in agent_card_data for key in required_keys):
-                logger.error(f"[A2AHandler] Fetched AgentCard from {agent_card_url} is missing required keys. Data: {agent_card_data}")
-                raise https_fn.HttpsError(
-                    code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-                    message="The provided URL did not return a valid A2A AgentCard. It is missing required fields."
-                )
-
-            logger.info(f"[A2AHandler] Successfully fetched AgentCard for '{agent_card_data.get('name')}' from {agent_card_url}")
-            return {"success": True, "agentCard": agent_card_data}
+        client = get_a2a_client(agent_card_url)
+        # According to the A2A spec, the AgentCard is at a standardized well-known path.
+        response = await client.get(agent_card_url, timeout=a2a_timeout(read_timeout_sec=15.0))
+        response.raise_for_status() # Raise an exception for 4xx/5xx status codes
+        agent_card_data = response.json()
+
+        # Basic validation of the agent card structure
+        required_keys = ["name", "description", "url", "version", "defaultInputModes", "defaultOutputModes", "capabilities"]
+        if not all(key in agent_card_data for key in required_keys):
+            logger.error(f"[A2AHandler] Fetched AgentCard from {agent_card_url} is missing required keys. Data: {agent_card_data}")
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="The provided URL did not return a valid A2A AgentCard. It is missing required fields."
+            )
+
+        logger.info(f"[A2AHandler] Successfully fetched AgentCard for '{agent_card_data.get('name')}' from {agent_card_url}")
+        return {"success": True, "agentCard": agent_card_data}
 
     except httpx.HTTPStatusError as e:
         logger.error(f"[A2AHandler] HTTP error when fetching AgentCard from {agent_card_url}: {e.response.status_code} - {e.response.text[:200]}")
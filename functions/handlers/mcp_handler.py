@@ -5,11 +5,10 @@ import traceback
 import httpx # Import for specific httpx exceptions
 from firebase_functions import https_fn
 
-from mcp.client.session import ClientSession
-from mcp.client.sse import sse_client
-from mcp.client.streamable_http import streamablehttp_client # Import StreamableHTTP client
 from mcp.shared.metadata_utils import get_display_name
 from common.core import logger
+from common.mcp_session_pool import get_mcp_session_pool
+from common.worker_runtime import run_in_worker_loop
 
 
 async def _list_mcp_server_tools_logic_async(req: https_fn.CallableRequest):
@@ -30,58 +29,29 @@ async def _list_mcp_server_tools_logic_async(req: https_fn.CallableRequest):
 
     logger.info(f"Attempting to list tools from MCP server: {server_url}")
 
-    # --- New: Construct headers from auth_config ---
-    headers = {}
-    if auth_config and isinstance(auth_config, dict):
-        auth_type = auth_config.get("type")
-        if auth_type == "bearer" and auth_config.get("token"):
-            headers["Authorization"] = f"Bearer {auth_config['token']}"
-            logger.info(f"Using Bearer Token authentication for {server_url}.")
-        elif auth_type == "apiKey" and auth_config.get("key") and auth_config.get("name"):
-            headers[auth_config["name"]] = auth_config["key"]
-            logger.info(f"Using API Key authentication for {server_url} (Header: {auth_config['name']}).")
+    if auth_config and isinstance(auth_config, dict) and auth_config.get("type"):
+        logger.info(f"Using '{auth_config.get('type')}' authentication for {server_url}.")
 
-    client_context_manager = None
-    transport_description = ""
-    client_kwargs = {"headers": headers} if headers else {}
+    async def _list_tools(mcp_client):
+        mcp_server_tools = await mcp_client.list_tools()
+        logger.info(f"Retrieved {len(mcp_server_tools.tools)} tools from MCP server: {server_url}")
 
-
-    # Determine which client to use based on the URL
-    if server_url.endswith("/sse"):
-        client_context_manager = sse_client(url=server_url, **client_kwargs)
-        transport_description = "SSE"
-    else:
-        client_context_manager = streamablehttp_client(url=server_url, **client_kwargs)
-        transport_description = "StreamableHTTP"
-
-    logger.info(f"Attempting to connect to MCP server at {server_url} using {transport_description} client.")
+        tools_for_client = []
+        for tool_obj in mcp_server_tools.tools: # tool_obj is of type mcp.types.Tool
+            tools_for_client.append({
+                "name": tool_obj.name,
+                "description": tool_obj.description,
+                "title": get_display_name(tool_obj), # Use get_display_name here
+                "input_schema": tool_obj.inputSchema
+            })
+        return tools_for_client
 
     try:
-        async with client_context_manager as client_streams_tuple:
-            if transport_description == "SSE":
-                read_stream, write_stream = client_streams_tuple
-            else:  # StreamableHTTP
-                read_stream, write_stream, _get_session_id = client_streams_tuple
-                # _get_session_id is available if needed for StreamableHTTP, but not used here.
-
-            logger.info(f"Connection established via {transport_description} client.")
-            async with ClientSession(read_stream, write_stream) as mcp_client:
-                logger.info("Client session established with MCP server.")
-                await mcp_client.initialize()
-
-                mcp_server_tools = await mcp_client.list_tools()
-                logger.info(f"Retrieved {len(mcp_server_tools.tools)} tools from MCP server: {server_url}")
-
-                tools_for_client = []
-                for tool_obj in mcp_server_tools.tools: # tool_obj is of type mcp.types.Tool
-                    tools_for_client.append({
-                        "name": tool_obj.name,
-                        "description": tool_obj.description,
-                        "title": get_display_name(tool_obj), # Use get_display_name here
-                        "input_schema": tool_obj.inputSchema
-                    })
-                logger.info(f"Successfully listed {len(tools_for_client)} tools from MCP server: {server_url}")
-                return {"success": True, "tools": tools_for_client, "serverUrl": server_url}
+        # Initialized sessions are pooled per server URL and auth, so repeated discovery calls
+        # skip the connect + initialize handshake.
+        tools_for_client = await get_mcp_session_pool().run(server_url, auth_config, _list_tools)
+        logger.info(f"Successfully listed {len(tools_for_client)} tools from MCP server: {server_url}")
+        return {"success": True, "tools": tools_for_client, "serverUrl": server_url}
 
     except httpx.HTTPStatusError as e: # Specific error for HTTP status issues (4xx, 5xx)
         logger.error(f"HTTP error {e.response.status_code} while communicating with MCP server at {server_url}: {e.response.text[:200]}")
@@ -137,7 +107,7 @@ async def _list_mcp_server_tools_logic_async(req: https_fn.CallableRequest):
         )
 
 def _list_mcp_server_tools_logic(req: https_fn.CallableRequest):
-    return asyncio.run(_list_mcp_server_tools_logic_async(req))
+    return run_in_worker_loop(_list_mcp_server_tools_logic_async(req))
 
 
 __all__ = ['_list_mcp_server_tools_logic', '_list_mcp_server_tools_logic_async']  
\ No newline at end of file
@@ -2,69 +2,40 @@
 import traceback
 import re
 import time
+import hashlib
+import logging
+import threading
+import uuid
 import asyncio # Import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from firebase_admin import firestore
 from firebase_functions import https_fn
 from vertexai import agent_engines as deployed_agent_engines
 import os
 
 from common.core import db, logger
-from common.config import get_gcp_project_config
+from common.config import get_gcp_project_config, DEPLOY_TASK_STALE_AFTER_SEC
 from common.utils import initialize_vertex_ai
+from common.task_queue import enqueue_function_task
+from common.git_refs import resolve_git_ref
+from common.wheelhouse import Wheelhouse, get_default_wheel_store
+from common.agent_plan import canonical_json, compile_agent_plan
 from common.adk_helpers import (
     generate_vertex_deployment_display_name,
     instantiate_adk_agent_from_config, # This is now async
+    collect_model_ids,
+    prefetch_model_configs,
     BACKEND_LITELLM_PROVIDER_CONFIG
 )
 
-def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest): # Remains synchronous
-    agent_config_data = req.data.get("agentConfig")
-    agent_doc_id = req.data.get("agentDocId")
-
-    if not agent_config_data or not agent_doc_id:
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Agent config (agentConfig) and Firestore document ID (agentDocId) are required.")
-
-    original_config_name = agent_config_data.get('name', 'N/A')
-    logger.info(f"Initiating deployment for agent '{agent_doc_id}'. Config name: '{original_config_name}'")
-
-    try:
-        db.collection("agents").document(agent_doc_id).update({
-            "deploymentStatus": "deploying_initiated", "lastDeploymentAttemptAt": firestore.SERVER_TIMESTAMP,
-            "vertexAiResourceName": firestore.DELETE_FIELD, "deploymentError": firestore.DELETE_FIELD,
-            "lastDeployedAt": firestore.DELETE_FIELD
-        })
-        logger.info(f"Agent '{agent_doc_id}' status in Firestore set to 'deploying_initiated'.")
-    except Exception as e:
-        logger.error(f"CRITICAL: Failed to update agent '{agent_doc_id}' status to 'deploying_initiated': {e}. Aborting.")
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.ABORTED, message=f"Failed to set initial deployment status for agent {agent_doc_id}.")
-
-    initialize_vertex_ai()
-    adk_agent = None
-
-    try:
-        # Run the async agent instantiation within the synchronous function
-        adk_agent = asyncio.run(instantiate_adk_agent_from_config(
-            agent_config_data,
-            parent_adk_name_for_context=f"root_{agent_doc_id[:4]}"
-        ))
-        logger.info(f"Root ADK Agent object '{adk_agent.name}' of type {type(adk_agent).__name__} prepared for deployment.")
-    except ValueError as e_instantiate:
-        error_msg = f"Failed to instantiate agent hierarchy for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_instantiate)}"
-        logger.error(error_msg)
-        db.collection("agents").document(agent_doc_id).update({"deploymentStatus": "error", "deploymentError": error_msg, "lastDeployedAt": firestore.SERVER_TIMESTAMP})
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=error_msg)
-    except Exception as e_unhandled_instantiate: # Catch any other errors from asyncio.run or instantiation
-        error_msg = f"Unexpected error during agent hierarchy instantiation for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_unhandled_instantiate)}"
-        logger.error(f"{error_msg}\n{traceback.format_exc()}")
-        db.collection("agents").document(agent_doc_id).update({"deploymentStatus": "error", "deploymentError": error_msg, "lastDeployedAt": firestore.SERVER_TIMESTAMP})
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=error_msg)
-
-    if adk_agent is None:
-        error_msg = f"ADK Agent object could not be constructed for agent '{agent_doc_id}'." # Should be caught above
-        logger.error(error_msg)
-        db.collection("agents").document(agent_doc_id).update({"deploymentStatus": "error", "deploymentError": error_msg})
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=error_msg)
 
+def _build_requirements_list(agent_config_data: dict, ref_resolver=None) -> list[str]:
+    """
+    pip requirements for the deployed engine. Custom repos on a branch, tag or the default branch
+    are pinned to the commit SHA it currently points to (see common.git_refs; ref_resolver
+    replaces 'git ls-remote', e.g. for local test repos).
+    """
     requirements_list = [
         "google-cloud-aiplatform[adk,agent_engines]>=1.93.1", # Ensure version compatibility
         "gofannon", # For Gofannon tools
@@ -100,9 +71,11 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest): # Remains sync
                 user_specified_ref = None
                 match_repo_and_ref = re.match(r"^(.*\/[^@/]+(?:\.git)?)(?:@([^#]+))?$", base_url_for_pip)
                 repo_path_for_install = base_url_for_pip # Default if no @ref
+                repo_url_without_ref = base_url_for_pip
 
                 if match_repo_and_ref:
                     repo_path_for_install = match_repo_and_ref.group(1) # The repo path part
+                    repo_url_without_ref = match_repo_and_ref.group(1)
                     if match_repo_and_ref.group(2): # If ref (group 2) was found
                         user_specified_ref = match_repo_and_ref.group(2)
                         repo_path_for_install += f"@{user_specified_ref}" # Append ref back
@@ -110,6 +83,14 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest): # Remains sync
                 # Check if the ref is a commit hash (to avoid cache-busting timestamp)
                 is_commit_hash_ref = bool(user_specified_ref and re.fullmatch(r"[0-9a-fA-F]{7,40}", user_specified_ref))
 
+                # Pin branches and tags to their current commit. The requirement string then only
+                # changes when the repo does, so pip and the Vertex build cache can be reused.
+                pinned_commit_sha = None
+                if not is_commit_hash_ref:
+                    pinned_commit_sha = resolve_git_ref(repo_url_without_ref, user_specified_ref, ref_resolver)
+                    if pinned_commit_sha:
+                        repo_path_for_install = f"{repo_url_without_ref}@{pinned_commit_sha}"
+
 
                 # Construct #egg= part carefully
                 # Try to parse egg name from fragment first
@@ -129,9 +110,9 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest): # Remains sync
                 sanitized_egg_name = re.sub(r'[^a-zA-Z0-9_.-]', '_', parsed_egg_name)
 
                 current_egg_name_for_fragment = sanitized_egg_name
-                # Add timestamp to egg name for cache busting IF NOT a commit hash ref
+                # Add timestamp to egg name for cache busting IF the ref could not be pinned to a commit
                 # This helps ensure pip re-fetches if the branch/tag has updated.
-                if not is_commit_hash_ref:
+                if not is_commit_hash_ref and not pinned_commit_sha:
                     timestamp_val = int(time.time())
                     # Pip egg names can't have brackets in the core name if it's for extras.
                     # Appending a version-like string or unique suffix is safer.
@@ -150,10 +131,10 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest): # Remains sync
                 if final_install_string not in requirements_list:
                     requirements_list.append(final_install_string)
                     logger.info(f"Added custom tool repository to requirements: {final_install_string}")
+    return requirements_list
 
 
-    deployment_display_name = generate_vertex_deployment_display_name(original_config_name, agent_doc_id)
-
+def _build_vertex_env_vars() -> dict:
     vertex_env_vars = {}
     # Pass API keys and necessary config from function environment to Vertex deployment environment
     for provider_id, config_details in BACKEND_LITELLM_PROVIDER_CONFIG.items():
@@ -180,44 +161,454 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest): # Remains sync
                 if os.getenv(watsonx_env_key):
                     vertex_env_vars[watsonx_env_key] = os.getenv(watsonx_env_key)
                     logger.info(f"Adding WatsonX env var '{watsonx_env_key}' for Vertex AI deployment.")
+    return vertex_env_vars
+
+
+def _substitute_prebuilt_wheels(requirements_list: list[str], wheelhouse: Wheelhouse | None) -> tuple[list[str], list[str]]:
+    """
+    Replaces pinned custom repo requirements with prebuilt wheels. Returns (requirements, extra_packages).
+    The SDK archives each extra package under its path without the leading '/', and the engine
+    build installs the requirements from the directory that archive is unpacked in.
+    """
+    if wheelhouse is None:
+        return requirements_list, []
+    final_requirements, extra_packages = [], []
+    for requirement in requirements_list:
+        wheel_paths = wheelhouse.ensure_wheels(requirement)
+        if not wheel_paths:
+            final_requirements.append(requirement)
+            continue
+        for wheel_path in wheel_paths:
+            extra_packages.append(wheel_path)
+            final_requirements.append("./" + wheel_path.lstrip("/"))
+    return final_requirements, extra_packages
+
+
+def _get_wheelhouse() -> Wheelhouse | None:
+    try:
+        wheel_store = get_default_wheel_store()
+    except Exception as e:
+        logger.warn(f"[Wheelhouse] Wheel store unavailable ({e}). Custom repositories will be installed from source.")
+        return None
+    return Wheelhouse(wheel_store) if wheel_store is not None else None
+
+
+def _compute_deployment_fingerprint(plan_hash: str, requirements_list: list[str], env_var_names) -> dict:
+    """
+    Hashes what a deployed engine is built from. "fingerprint" covers everything; "requirementsHash"
+    only the environment (requirements and env var names), which agent_engines.update keeps.
+    Env var values are secrets and are not part of the hash.
+    """
+    requirements_hash = hashlib.sha256(canonical_json({
+        "requirements": sorted(requirements_list),
+        "envVarNames": sorted(env_var_names)
+    }).encode("utf-8")).hexdigest()
+    fingerprint = hashlib.sha256(canonical_json({"planHash": plan_hash, "requirementsHash": requirements_hash}).encode("utf-8")).hexdigest()
+    return {"fingerprint": fingerprint, "planHash": plan_hash, "requirementsHash": requirements_hash}
+
+
+def _get_live_engine(agent_data: dict):
+    """The agent's stored engine if Vertex still has it, else None."""
+    resource_name = agent_data.get("vertexAiResourceName")
+    if not resource_name:
+        return None
+    try:
+        return deployed_agent_engines.get(resource_name) # Uncached: a stale handle must not mask a deleted engine
+    except Exception as e:
+        logger.info(f"[DeployFingerprint] Stored engine '{resource_name}' is not available ({type(e).__name__}: {e}). A new engine will be created.")
+        return None
+
+
+DEPLOYMENT_PHASES = ("instantiate", "package", "upload", "build", "activate")
+DEPLOYMENT_IN_PROGRESS_STATUSES = ("deploying_initiated", "deploying_in_progress")
+
+# agent_engines.create/update run package -> upload -> build -> activate in one blocking call.
+# The SDK logs a line as each step starts; these markers map those lines to our phases.
+_VERTEX_SDK_LOGGER_NAME = "vertexai.agent_engines"
+_SDK_PHASE_MARKERS = (
+    ("Using bucket", "upload"),
+    ("Creating bucket", "upload"),
+    ("backing LRO", "build"),
+    ("created. Resource name", "activate"),
+    ("updated. Resource name", "activate")
+)
 
 
+class _DeploymentProgress:
+    """
+    Records the deployment phases of one task on the agent doc under 'deploymentProgress':
+    which phase is running, and the status and duration of each phase. Phases only move forward.
+    """
+
+    def __init__(self, agent_doc_ref, task_id: str):
+        self._agent_doc_ref = agent_doc_ref
+        self._task_id = task_id
+        self._lock = threading.Lock() # SDK log records can arrive from its own threads
+        self._current_phase = None
+        self._phase_started_at = None
+        self._task_started_at = time.perf_counter()
+
+    def _finish_current_phase(self, updates: dict, phase_status: str) -> None:
+        if self._current_phase is None:
+            return
+        phase_path = f"deploymentProgress.phases.{self._current_phase}"
+        updates[f"{phase_path}.status"] = phase_status
+        updates[f"{phase_path}.durationSec"] = round(time.perf_counter() - self._phase_started_at, 2)
+
+    def _write(self, updates: dict) -> None:
+        updates["deploymentProgress.updatedAt"] = firestore.SERVER_TIMESTAMP
+        try:
+            self._agent_doc_ref.update(updates)
+        except Exception as e:
+            logger.warn(f"[DeployTask] Could not record deployment progress for task {self._task_id}: {e}")
+
+    def advance_to(self, phase: str) -> None:
+        with self._lock:
+            if self._current_phase is not None and DEPLOYMENT_PHASES.index(phase) <= DEPLOYMENT_PHASES.index(self._current_phase):
+                return
+            updates = {}
+            self._finish_current_phase(updates, "completed")
+            updates[f"deploymentProgress.phases.{phase}"] = {"status": "running", "startedAt": firestore.SERVER_TIMESTAMP}
+            updates["deploymentProgress.currentPhase"] = phase
+            self._current_phase = phase
+            self._phase_started_at = time.perf_counter()
+            logger.info(f"[DeployTask] Task {self._task_id}: phase '{phase}' started.")
+            self._write(updates)
+
+    def complete(self, state: str = "completed", extra_updates: dict | None = None) -> None:
+        with self._lock:
+            updates = dict(extra_updates or {})
+            self._finish_current_phase(updates, "completed")
+            updates["deploymentProgress.state"] = state
+            updates["deploymentProgress.currentPhase"] = None
+            updates["deploymentProgress.totalDurationSec"] = round(time.perf_counter() - self._task_started_at, 2)
+            self._current_phase = None
+            self._write(updates)
+
+    def fail(self, error_message: str, extra_updates: dict | None = None) -> None:
+        with self._lock:
+            updates = dict(extra_updates or {})
+            self._finish_current_phase(updates, "failed")
+            updates["deploymentProgress.state"] = "failed"
+            updates["deploymentProgress.failedPhase"] = self._current_phase
+            updates["deploymentProgress.totalDurationSec"] = round(time.perf_counter() - self._task_started_at, 2)
+            updates["deploymentStatus"] = "error"
+            updates["deploymentError"] = error_message
+            updates["lastDeployedAt"] = firestore.SERVER_TIMESTAMP # Signify when the error occurred
+            self._current_phase = None
+            self._write(updates)
+
+
+class _SdkPhaseLogHandler(logging.Handler):
+    """Advances a _DeploymentProgress on the SDK's progress log lines, for one task's thread only."""
+
+    def __init__(self, progress: _DeploymentProgress, thread_id: int):
+        super().__init__(level=logging.INFO)
+        self._progress = progress
+        self._thread_id = thread_id
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.thread != self._thread_id: # Other deployments running on this instance
+            return
+        message = record.getMessage()
+        for marker, phase in _SDK_PHASE_MARKERS:
+            if marker in message:
+                self._progress.advance_to(phase)
+                return
+
+
+@contextmanager
+def _track_sdk_phases(progress: _DeploymentProgress):
+    sdk_logger = logging.getLogger(_VERTEX_SDK_LOGGER_NAME)
+    handler = _SdkPhaseLogHandler(progress, threading.get_ident())
+    sdk_logger.addHandler(handler)
+    try:
+        yield
+    finally:
+        sdk_logger.removeHandler(handler)
+
+
+def is_deployment_in_flight(agent_data: dict) -> bool:
+    """True if a deployment task was started for the agent and has not finished or gone stale."""
+    if agent_data.get("deploymentStatus") not in DEPLOYMENT_IN_PROGRESS_STATUSES:
+        return False
+    attempt_at = agent_data.get("lastDeploymentAttemptAt")
+    if not isinstance(attempt_at, datetime):
+        return False
+    return (datetime.now(timezone.utc) - attempt_at).total_seconds() < DEPLOY_TASK_STALE_AFTER_SEC
+
+
+def start_agent_deployment(agent_doc_id: str, agent_config_data: dict, stored_agent_data: dict, force_rebuild: bool = False) -> str:
+    """
+    Marks the agent 'deploying_initiated' and enqueues an executeAgentDeployTask for it. Returns the
+    deployment task ID. force_rebuild rebuilds the engine even if the fingerprint is unchanged
+    (e.g. to pick up new releases of unpinned requirements such as gofannon).
+    Raises HttpsError if a deployment is already in flight or the task cannot be started.
+    """
+    if is_deployment_in_flight(stored_agent_data):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.FAILED_PRECONDITION, message=f"A deployment of agent {agent_doc_id} is already in progress.")
+
+    agent_doc_ref = db.collection("agents").document(agent_doc_id)
+    deployment_task_id = uuid.uuid4().hex
+    try:
+        agent_doc_ref.update({
+            "deploymentStatus": "deploying_initiated", "lastDeploymentAttemptAt": firestore.SERVER_TIMESTAMP,
+            "deploymentError": firestore.DELETE_FIELD,
+            "deploymentProgress": {
+                "taskId": deployment_task_id, "state": "queued", "currentPhase": None, "phases": {},
+                "enqueuedAt": firestore.SERVER_TIMESTAMP
+            }
+        })
+        logger.info(f"Agent '{agent_doc_id}' status in Firestore set to 'deploying_initiated'.")
+    except Exception as e:
+        logger.error(f"CRITICAL: Failed to update agent '{agent_doc_id}' status to 'deploying_initiated': {e}. Aborting.")
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.ABORTED, message=f"Failed to set initial deployment status for agent {agent_doc_id}.")
+
+    try:
+        enqueue_function_task("executeAgentDeployTask", {
+            "agentDocId": agent_doc_id,
+            "agentConfig": agent_config_data,
+            "deploymentTaskId": deployment_task_id,
+            # The worker only skips an unchanged redeploy if the agent was deployed before this request.
+            "previousDeploymentStatus": stored_agent_data.get("deploymentStatus"),
+            "forceRebuild": force_rebuild
+        })
+        logger.info(f"[DeployTask] Enqueued deployment task {deployment_task_id} for agent '{agent_doc_id}'" + (" (forced rebuild)." if force_rebuild else "."))
+    except Exception as e:
+        logger.error(f"[DeployTask] CRITICAL: Failed to enqueue deployment task for agent '{agent_doc_id}': {e}")
+        agent_doc_ref.update({
+            "deploymentStatus": "error",
+            "deploymentError": f"Failed to start deployment (task enqueue error): {str(e)[:300]}",
+            "deploymentProgress.state": "failed"
+        })
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Failed to start the deployment.")
+    return deployment_task_id
+
+
+def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest):
+    """
+    IMMEDIATE RESPONSE: Validates the request, marks the agent 'deploying_initiated' and enqueues an
+    executeAgentDeployTask. The build runs in the background; progress is written to the agent doc.
+    """
+    agent_config_data = req.data.get("agentConfig")
+    agent_doc_id = req.data.get("agentDocId")
+
+    if not agent_config_data or not agent_doc_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Agent config (agentConfig) and Firestore document ID (agentDocId) are required.")
+
+    original_config_name = agent_config_data.get('name', 'N/A')
+    logger.info(f"Initiating deployment for agent '{agent_doc_id}'. Config name: '{original_config_name}'")
+
+    agent_snap = db.collection("agents").document(agent_doc_id).get()
+    if not agent_snap.exists:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message=f"Agent document {agent_doc_id} not found.")
+
+    deployment_task_id = start_agent_deployment(
+        agent_doc_id,
+        agent_config_data,
+        agent_snap.to_dict() or {},
+        force_rebuild=bool(req.data.get("forceRebuild"))
+    )
+    return {"success": True, "deploymentTaskId": deployment_task_id, "message": f"Deployment of agent '{original_config_name}' queued."}
+
+
+def _claim_deployment_task(agent_doc_ref, deployment_task_id: str) -> dict | None:
+    """Moves the queued task to 'running'. Returns the agent doc, or None if the task is stale or a duplicate delivery."""
+
+    @firestore.transactional
+    def _claim_in_transaction(transaction):
+        agent_snap = agent_doc_ref.get(transaction=transaction)
+        if not agent_snap.exists:
+            return None
+        agent_data = agent_snap.to_dict() or {}
+        progress = agent_data.get("deploymentProgress") or {}
+        if progress.get("taskId") != deployment_task_id or progress.get("state") != "queued":
+            return None
+        transaction.update(agent_doc_ref, {
+            "deploymentStatus": "deploying_in_progress",
+            "deploymentProgress.state": "running",
+            "deploymentProgress.startedAt": firestore.SERVER_TIMESTAMP
+        })
+        return agent_data
+
+    return _claim_in_transaction(db.transaction())
+
+
+def _deployment_error_message(e_deploy: Exception) -> str:
+    firestore_error_message = f"Deployment Error: {type(e_deploy).__name__} - {str(e_deploy)[:500]}"
+    # Check for common Pydantic validation errors from ADK that are useful to surface
+    if "validation error" in str(e_deploy).lower() and ("Agent" in str(e_deploy) or "LlmAgent" in str(e_deploy)):
+        if "Extra inputs are not permitted" in str(e_deploy): # Common Pydantic error
+            firestore_error_message = f"ADK Pydantic validation error (likely during remote_app.create for an Agent/LlmAgent). Detail: {str(e_deploy)[:300]}"
+        else:
+            firestore_error_message = f"ADK Pydantic validation error for Agent/LlmAgent components. Detail: {str(e_deploy)[:300]}"
+    return firestore_error_message
+
+
+def _run_agent_deploy_task(data: dict):
+    """
+    Background worker for executeAgentDeployTask: builds the agent and creates, updates or skips
+    its Vertex AI engine. Failures are recorded on the agent doc rather than raised, so Cloud Tasks
+    does not start a second multi-minute build for the same request.
+    """
+    agent_doc_id = data.get("agentDocId")
+    agent_config_data = data.get("agentConfig")
+    deployment_task_id = data.get("deploymentTaskId")
+    previous_deployment_status = data.get("previousDeploymentStatus")
+    force_rebuild = bool(data.get("forceRebuild"))
+    if not agent_doc_id or not agent_config_data or not deployment_task_id:
+        logger.error(f"[DeployTask] Invalid task payload; agentDocId, agentConfig and deploymentTaskId are required. Keys: {list((data or {}).keys())}")
+        return
+
+    original_config_name = agent_config_data.get('name', 'N/A')
+    agent_doc_ref = db.collection("agents").document(agent_doc_id)
+    stored_agent_data = _claim_deployment_task(agent_doc_ref, deployment_task_id)
+    if stored_agent_data is None:
+        logger.warn(f"[DeployTask] Task {deployment_task_id} for agent '{agent_doc_id}' is superseded or already running. Skipping.")
+        return
+
+    logger.info(f"[DeployTask] Starting deployment task {deployment_task_id} for agent '{agent_doc_id}'. Config name: '{original_config_name}'")
+    progress = _DeploymentProgress(agent_doc_ref, deployment_task_id)
+    progress.advance_to("instantiate")
+
+    try:
+        # One batched model read serves both the fingerprint and the agent build below.
+        model_configs = asyncio.run(prefetch_model_configs(collect_model_ids(agent_config_data)))
+        plan = compile_agent_plan(agent_config_data, model_configs)
+    except ValueError as e_plan:
+        error_msg = f"Failed to compile agent hierarchy for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_plan)}"
+        logger.error(error_msg)
+        progress.fail(error_msg)
+        return
+    except Exception as e_plan_unhandled:
+        error_msg = f"Unexpected error while preparing deployment for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_plan_unhandled)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        progress.fail(error_msg)
+        return
+
+    try:
+        requirements_list = _build_requirements_list(agent_config_data)
+        vertex_env_vars = _build_vertex_env_vars()
+        # Custom repos are pinned to commit SHAs, so the fingerprint changes exactly when one moves. A
+        # repo whose ref cannot be resolved keeps a timestamped egg name and always rebuilds.
+        deployment_fingerprint = _compute_deployment_fingerprint(plan.plan_hash, requirements_list, vertex_env_vars.keys())
+        stored_fingerprint = stored_agent_data.get("deploymentFingerprint") or {}
+
+        initialize_vertex_ai()
+        live_engine = None
+        if force_rebuild or stored_fingerprint.get("requirementsHash") == deployment_fingerprint["requirementsHash"]:
+            live_engine = _get_live_engine(stored_agent_data)
+
+        if live_engine is not None and not force_rebuild and previous_deployment_status == "deployed" \
+                and stored_fingerprint.get("fingerprint") == deployment_fingerprint["fingerprint"]:
+            logger.info(f"[DeployFingerprint] Agent '{agent_doc_id}' is unchanged since its last deployment (fingerprint {deployment_fingerprint['fingerprint'][:12]}). Skipping the build of '{live_engine.resource_name}'.")
+            progress.complete(state="skipped", extra_updates={"deploymentStatus": "deployed", "deploymentProgress.mode": "skipped"})
+            return
+
+        # "rebuild" updates the existing engine together with its requirements and env, which makes
+        # Vertex reinstall them; "update" only swaps the agent.
+        deploy_mode = "create" if live_engine is None else ("rebuild" if force_rebuild else "update")
+        logger.info(f"[DeployFingerprint] Agent '{agent_doc_id}' fingerprint {deployment_fingerprint['fingerprint'][:12]} (stored: {(stored_fingerprint.get('fingerprint') or 'none')[:12]}). Deploy mode: {deploy_mode}.")
+    except Exception as e_prepare:
+        error_msg = f"Unexpected error while selecting the deploy mode for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_prepare)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        progress.fail(error_msg)
+        return
+
+    mode_updates = {"deploymentProgress.mode": deploy_mode}
+    if deploy_mode == "create":
+        mode_updates.update({"vertexAiResourceName": firestore.DELETE_FIELD, "lastDeployedAt": firestore.DELETE_FIELD, "deploymentFingerprint": firestore.DELETE_FIELD})
+    try:
+        agent_doc_ref.update(mode_updates)
+    except Exception as e:
+        logger.warn(f"[DeployTask] Could not record deploy mode for agent '{agent_doc_id}': {e}")
+
+    adk_agent = None
+
+    try:
+        # Run the async agent instantiation within the synchronous function
+        adk_agent = asyncio.run(instantiate_adk_agent_from_config(
+            agent_config_data,
+            parent_adk_name_for_context=f"root_{agent_doc_id[:4]}",
+            model_configs=model_configs,
+            plan=plan
+        ))
+        logger.info(f"Root ADK Agent object '{adk_agent.name}' of type {type(adk_agent).__name__} prepared for deployment.")
+    except ValueError as e_instantiate:
+        error_msg = f"Failed to instantiate agent hierarchy for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_instantiate)}"
+        logger.error(error_msg)
+        progress.fail(error_msg)
+        return
+    except Exception as e_unhandled_instantiate: # Catch any other errors from asyncio.run or instantiation
+        error_msg = f"Unexpected error during agent hierarchy instantiation for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_unhandled_instantiate)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        progress.fail(error_msg)
+        return
+
+    if adk_agent is None:
+        error_msg = f"ADK Agent object could not be constructed for agent '{agent_doc_id}'." # Should be caught above
+        logger.error(error_msg)
+        progress.fail(error_msg)
+        return
+
+    deployment_display_name = generate_vertex_deployment_display_name(original_config_name, agent_doc_id)
+
     logger.info(f"Attempting to deploy ADK agent '{adk_agent.name}' to Vertex AI with display_name: '{deployment_display_name}'. Requirements: {requirements_list}. Environment Variables for Vertex: {list(vertex_env_vars.keys())}")
 
+    progress.advance_to("package")
     try:
-        remote_app = deployed_agent_engines.create(
-            agent_engine=adk_agent,
-            requirements=requirements_list,
-            display_name=deployment_display_name,
-            description=agent_config_data.get("description", f"ADK Agent: {deployment_display_name}"),
-            env_vars=vertex_env_vars if vertex_env_vars else None # Pass None if empty
-        )
-        logger.info(f"Vertex AI agent deployment successful for '{agent_doc_id}'. Resource: {remote_app.resource_name}")
-        db.collection("agents").document(agent_doc_id).update({
+        install_requirements, extra_packages = requirements_list, []
+        if deploy_mode in ("create", "rebuild"):
+            # The fingerprint stays on the SHA-pinned source requirements; wheels are how they get installed.
+            install_requirements, extra_packages = _substitute_prebuilt_wheels(requirements_list, _get_wheelhouse())
+        with _track_sdk_phases(progress):
+            if deploy_mode == "update":
+                # Same requirements and env: swap the agent on the existing engine instead of building a new one.
+                remote_app = deployed_agent_engines.update(
+                    resource_name=live_engine.resource_name,
+                    agent_engine=adk_agent,
+                    display_name=deployment_display_name,
+                    description=agent_config_data.get("description", f"ADK Agent: {deployment_display_name}")
+                )
+            elif deploy_mode == "rebuild":
+                remote_app = deployed_agent_engines.update(
+                    resource_name=live_engine.resource_name,
+                    agent_engine=adk_agent,
+                    requirements=install_requirements,
+                    extra_packages=extra_packages or None,
+                    display_name=deployment_display_name,
+                    description=agent_config_data.get("description", f"ADK Agent: {deployment_display_name}"),
+                    env_vars=vertex_env_vars if vertex_env_vars else None
+                )
+            else:
+                remote_app = deployed_agent_engines.create(
+                    agent_engine=adk_agent,
+                    requirements=install_requirements,
+                    extra_packages=extra_packages or None,
+                    display_name=deployment_display_name,
+                    description=agent_config_data.get("description", f"ADK Agent: {deployment_display_name}"),
+                    env_vars=vertex_env_vars if vertex_env_vars else None # Pass None if empty
+                )
+        progress.advance_to("activate") # No-op unless the SDK's completion line was not seen
+        logger.info(f"Vertex AI agent deployment ({deploy_mode}) successful for '{agent_doc_id}'. Resource: {remote_app.resource_name}")
+        progress.complete(extra_updates={
             "vertexAiResourceName": remote_app.resource_name, "deploymentStatus": "deployed",
-            "lastDeployedAt": firestore.SERVER_TIMESTAMP, "deploymentError": firestore.DELETE_FIELD
+            "lastDeployedAt": firestore.SERVER_TIMESTAMP, "deploymentError": firestore.DELETE_FIELD,
+            "deploymentFingerprint": deployment_fingerprint
         })
-        return {"success": True, "resourceName": remote_app.resource_name, "message": f"Agent '{deployment_display_name}' deployment initiated."}
     except Exception as e_deploy:
         tb_str = traceback.format_exc()
         error_message_for_log = f"Error during Vertex AI agent deployment for '{agent_doc_id}' (ADK name: '{getattr(adk_agent, 'name', 'N/A')}', Display: '{deployment_display_name}'): {str(e_deploy)}"
         logger.error(f"{error_message_for_log}\nFull Traceback:\n{tb_str}")
+        progress.fail(_deployment_error_message(e_deploy))
 
-        firestore_error_message = f"Deployment Error: {type(e_deploy).__name__} - {str(e_deploy)[:500]}"
-        # Check for common Pydantic validation errors from ADK that are useful to surface
-        if "validation error" in str(e_deploy).lower() and ("Agent" in str(e_deploy) or "LlmAgent" in str(e_deploy)):
-            if "Extra inputs are not permitted" in str(e_deploy): # Common Pydantic error
-                firestore_error_message = f"ADK Pydantic validation error (likely during remote_app.create for an Agent/LlmAgent). Detail: {str(e_deploy)[:300]}"
-            else:
-                firestore_error_message = f"ADK Pydantic validation error for Agent/LlmAgent components. Detail: {str(e_deploy)[:300]}"
 
-        db.collection("agents").document(agent_doc_id).update({
-            "deploymentStatus": "error",
-            "deploymentError": firestore_error_message,
-            "lastDeployedAt": firestore.SERVER_TIMESTAMP # Signify when the error occurred
-        })
-
-        if isinstance(e_deploy, https_fn.HttpsError): raise # Re-raise if already an HttpsError
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Deployment to Vertex AI failed: {str(e_deploy)[:300]}. See function logs for details.")
+def run_agent_deploy_task_wrapper(data: dict):
+    """Entry point for the executeAgentDeployTask task queue function."""
+    try:
+        _run_agent_deploy_task(data)
+    except Exception as e:
+        # Never let Cloud Tasks retry a deployment: the agent doc already reflects what happened.
+        logger.error(f"[DeployTask] Unhandled error in deployment task {data.get('deploymentTaskId')}: {e}\n{traceback.format_exc()}")
 
-__all__ = ['_deploy_agent_to_vertex_logic']  
\ No newline at end of file
+__all__ = ['_deploy_agent_to_vertex_logic', 'start_agent_deployment', 'run_agent_deploy_task_wrapper', 'is_deployment_in_flight']
@@ -0,0 +1,265 @@
+# functions/handlers/vertex/fleet_logic.py
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+from firebase_functions import https_fn
+
+from common.core import db, logger
+from common.config import (
+    FLEET_MAX_AGENTS,
+    FLEET_DEFAULT_CONCURRENCY,
+    FLEET_MAX_CONCURRENCY,
+    FLEET_MAX_ATTEMPTS_PER_AGENT,
+    FLEET_POLL_INTERVAL_SEC
+)
+from common.agent_plan import canonical_json
+from common.task_queue import enqueue_function_task
+
+from .deployment_logic import start_agent_deployment, is_deployment_in_flight
+from .management_logic import delete_agent_deployment
+
+FLEET_ACTIONS = ("deploy", "redeploy", "delete")
+FLEET_AGENT_FINAL_STATUSES = ("succeeded", "failed", "skipped")
+FLEET_OPERATION_FINAL_STATUSES = ("completed", "completed_with_errors", "error")
+
+
+def _caller_is_admin(uid: str) -> bool:
+    user_snap = db.collection("users").document(uid).get()
+    return bool(user_snap.exists and ((user_snap.to_dict() or {}).get("permissions") or {}).get("isAdmin"))
+
+
+def _initial_agent_state(agent_snap, caller_uid: str, caller_is_admin: bool, action: str) -> dict:
+    if not agent_snap.exists:
+        return {"status": "skipped", "attempts": 0, "error": "Agent not found."}
+    agent_data = agent_snap.to_dict() or {}
+    if not caller_is_admin and caller_uid not in (agent_data.get("userId"), agent_data.get("ownerId")):
+        return {"status": "skipped", "attempts": 0, "error": "Permission denied."}
+    if agent_data.get("platform") == "a2a":
+        return {"status": "skipped", "attempts": 0, "error": "A2A agents are not deployed to Vertex AI."}
+    if action == "delete" and not agent_data.get("vertexAiResourceName"):
+        return {"status": "skipped", "attempts": 0, "error": "Agent is not deployed."}
+    return {"status": "pending", "attempts": 0}
+
+
+def _count_agent_states(agent_states: dict) -> dict:
+    counts = {"total": len(agent_states), "pending": 0, "running": 0, "succeeded": 0, "failed": 0, "skipped": 0}
+    for agent_state in agent_states.values():
+        counts[agent_state["status"]] += 1
+    return counts
+
+
+def _fleet_agent_operation_logic(req: https_fn.CallableRequest):
+    """
+    IMMEDIATE RESPONSE: Validates a bulk deploy/redeploy/delete request, creates its fleetOperations
+    document and enqueues the first executeFleetOperationTask tick. Clients poll that one document.
+    """
+    action = req.data.get("action")
+    agent_doc_ids = req.data.get("agentDocIds")
+    caller_uid = req.auth.uid
+
+    if action not in FLEET_ACTIONS:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"action must be one of {', '.join(FLEET_ACTIONS)}.")
+    if not isinstance(agent_doc_ids, list) or not all(isinstance(agent_doc_id, str) and agent_doc_id.strip() for agent_doc_id in agent_doc_ids):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="agentDocIds must be a list of agent document IDs.")
+    agent_doc_ids = list(dict.fromkeys(agent_doc_id.strip() for agent_doc_id in agent_doc_ids)) # De-duplicated, order kept
+    if not agent_doc_ids or len(agent_doc_ids) > FLEET_MAX_AGENTS:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Between 1 and {FLEET_MAX_AGENTS} agents can be processed per fleet operation.")
+    try:
+        max_concurrency = int(req.data.get("maxConcurrency") or FLEET_DEFAULT_CONCURRENCY)
+    except (TypeError, ValueError):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="maxConcurrency must be an integer.")
+    max_concurrency = max(1, min(max_concurrency, FLEET_MAX_CONCURRENCY))
+
+    caller_is_admin = _caller_is_admin(caller_uid)
+    agent_refs = [db.collection("agents").document(agent_doc_id) for agent_doc_id in agent_doc_ids]
+    agent_states = {
+        agent_snap.id: _initial_agent_state(agent_snap, caller_uid, caller_is_admin, action)
+        for agent_snap in db.get_all(agent_refs)
+    }
+    counts = _count_agent_states(agent_states)
+
+    fleet_operation_ref = db.collection("fleetOperations").document()
+    fleet_operation_ref.set({
+        "id": fleet_operation_ref.id,
+        "userId": caller_uid,
+        "action": action,
+        "status": "queued",
+        "maxConcurrency": max_concurrency,
+        "maxAttemptsPerAgent": FLEET_MAX_ATTEMPTS_PER_AGENT,
+        "agentDocIds": agent_doc_ids,
+        "agents": agent_states,
+        "counts": counts,
+        "tick": 0,
+        "createdAt": firestore.SERVER_TIMESTAMP,
+        "updatedAt": firestore.SERVER_TIMESTAMP
+    })
+    logger.info(f"[Fleet] Created fleet operation {fleet_operation_ref.id}: {action} of {len(agent_doc_ids)} agent(s), concurrency {max_concurrency}. Counts: {counts}")
+
+    try:
+        enqueue_function_task("executeFleetOperationTask", {"fleetOperationId": fleet_operation_ref.id, "tick": 0})
+    except Exception as e:
+        logger.error(f"[Fleet] CRITICAL: Failed to enqueue fleet operation {fleet_operation_ref.id}: {e}")
+        fleet_operation_ref.update({"status": "error", "error": f"Failed to start the fleet operation (task enqueue error): {str(e)[:300]}", "updatedAt": firestore.SERVER_TIMESTAMP})
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Failed to start the fleet operation.")
+
+    return {"success": True, "fleetOperationId": fleet_operation_ref.id, "counts": counts}
+
+
+def _claim_fleet_tick(fleet_operation_ref, tick: int) -> dict | None:
+    """Advances the operation's tick counter. Returns the operation, or None for stale or duplicate ticks."""
+
+    @firestore.transactional
+    def _claim_in_transaction(transaction):
+        operation_snap = fleet_operation_ref.get(transaction=transaction)
+        if not operation_snap.exists:
+            return None
+        operation = operation_snap.to_dict() or {}
+        if operation.get("tick") != tick or operation.get("status") in FLEET_OPERATION_FINAL_STATUSES:
+            return None
+        transaction.update(fleet_operation_ref, {"tick": tick + 1, "status": "running"})
+        return operation
+
+    return _claim_in_transaction(db.transaction())
+
+
+def _record_attempt_failure(agent_state: dict, error_message: str, max_attempts: int) -> dict:
+    """Back to 'pending' for another attempt, or 'failed' once the agent has used its attempts."""
+    final_failure = agent_state.get("attempts", 0) >= max_attempts
+    return {
+        **agent_state,
+        "status": "failed" if final_failure else "pending",
+        "error": error_message[:500],
+        "deploymentTaskId": None
+    }
+
+
+def _poll_running_deployment(agent_state: dict, agent_snap, max_attempts: int) -> dict:
+    if not agent_snap.exists:
+        return {**agent_state, "status": "failed", "error": "Agent was deleted during the fleet operation."}
+    agent_data = agent_snap.to_dict() or {}
+    progress = agent_data.get("deploymentProgress") or {}
+    if progress.get("taskId") != agent_state.get("deploymentTaskId"):
+        return _record_attempt_failure(agent_state, "The deployment was superseded by another deployment of this agent.", max_attempts)
+    if progress.get("state") in ("completed", "skipped"):
+        return {**agent_state, "status": "succeeded", "result": progress.get("mode") or progress.get("state"), "error": None}
+    if progress.get("state") == "failed":
+        return _record_attempt_failure(agent_state, agent_data.get("deploymentError") or "Deployment failed.", max_attempts)
+    if not is_deployment_in_flight(agent_data):
+        return _record_attempt_failure(agent_state, "The deployment task did not finish in time.", max_attempts)
+    return agent_state
+
+
+def _start_deployment(agent_doc_id: str, agent_state: dict, agent_snap, force_rebuild: bool) -> dict:
+    if not agent_snap.exists:
+        return {**agent_state, "status": "failed", "error": "Agent not found."}
+    agent_data = agent_snap.to_dict() or {}
+    if is_deployment_in_flight(agent_data):
+        return agent_state # Someone else's deployment is running; try again on a later tick
+    attempt_state = {**agent_state, "attempts": agent_state.get("attempts", 0) + 1}
+    try:
+        # JSON round trip: the task payload cannot carry Firestore timestamps.
+        agent_config_data = json.loads(canonical_json({**agent_data, "id": agent_doc_id}))
+        deployment_task_id = start_agent_deployment(agent_doc_id, agent_config_data, agent_data, force_rebuild=force_rebuild)
+    except Exception as e:
+        return {**attempt_state, "status": "pending", "error": str(e)[:500], "lastStartFailed": True}
+    return {**attempt_state, "status": "running", "deploymentTaskId": deployment_task_id, "error": None, "lastStartFailed": False}
+
+
+def _delete_deployment(agent_doc_id: str, agent_state: dict, max_attempts: int) -> dict:
+    attempt_state = {**agent_state, "attempts": agent_state.get("attempts", 0) + 1}
+    try:
+        agent_snap = db.collection("agents").document(agent_doc_id).get()
+        if not agent_snap.exists:
+            return {**attempt_state, "status": "skipped", "error": "Agent not found."}
+        agent_data = agent_snap.to_dict() or {}
+        if is_deployment_in_flight(agent_data):
+            return agent_state # Wait for the running deployment instead of deleting under it
+        resource_name = agent_data.get("vertexAiResourceName")
+        if not resource_name:
+            return {**attempt_state, "status": "skipped", "error": "Agent is not deployed."}
+        delete_agent_deployment(resource_name, agent_doc_id)
+        return {**attempt_state, "status": "succeeded", "result": "deleted", "error": None}
+    except Exception as e:
+        logger.warn(f"[Fleet] Deleting the deployment of agent '{agent_doc_id}' failed (attempt {attempt_state['attempts']}): {e}")
+        return _record_attempt_failure(attempt_state, str(e), max_attempts)
+
+
+def _advance_fleet_operation(fleet_operation_ref, operation: dict, tick: int) -> bool:
+    """Polls, starts and aggregates the agents of a claimed tick. Returns True if another tick is needed."""
+    fleet_operation_id = fleet_operation_ref.id
+    action = operation["action"]
+    max_concurrency = operation.get("maxConcurrency") or FLEET_DEFAULT_CONCURRENCY
+    max_attempts = operation.get("maxAttemptsPerAgent") or FLEET_MAX_ATTEMPTS_PER_AGENT
+    agent_states = dict(operation.get("agents") or {})
+    ordered_agent_ids = [agent_doc_id for agent_doc_id in operation.get("agentDocIds", []) if agent_doc_id in agent_states]
+
+    # 1. Deployments started by earlier ticks: one batched read of their agent docs.
+    running_ids = [agent_doc_id for agent_doc_id in ordered_agent_ids if agent_states[agent_doc_id]["status"] == "running"]
+    if running_ids:
+        for agent_snap in db.get_all([db.collection("agents").document(agent_doc_id) for agent_doc_id in running_ids]):
+            agent_states[agent_snap.id] = _poll_running_deployment(agent_states[agent_snap.id], agent_snap, max_attempts)
+
+    # 2. Start pending agents up to the concurrency limit.
+    free_slots = max_concurrency - sum(1 for agent_state in agent_states.values() if agent_state["status"] == "running")
+    to_start = [agent_doc_id for agent_doc_id in ordered_agent_ids if agent_states[agent_doc_id]["status"] == "pending"][:max(0, free_slots)]
+    if to_start and action == "delete":
+        # Deletes finish within the tick, so they run here in parallel.
+        with ThreadPoolExecutor(max_workers=len(to_start)) as executor:
+            results = executor.map(lambda agent_doc_id: (agent_doc_id, _delete_deployment(agent_doc_id, agent_states[agent_doc_id], max_attempts)), to_start)
+            agent_states.update(dict(results))
+    elif to_start:
+        for agent_snap in db.get_all([db.collection("agents").document(agent_doc_id) for agent_doc_id in to_start]):
+            new_state = _start_deployment(agent_snap.id, agent_states[agent_snap.id], agent_snap, force_rebuild=action == "redeploy")
+            if new_state.get("lastStartFailed") and new_state["attempts"] >= max_attempts:
+                new_state = {**new_state, "status": "failed"}
+            agent_states[agent_snap.id] = new_state
+
+    # 3. Aggregate into the single document clients poll.
+    counts = _count_agent_states(agent_states)
+    finished = counts["pending"] == 0 and counts["running"] == 0
+    operation_update = {"agents": agent_states, "counts": counts, "updatedAt": firestore.SERVER_TIMESTAMP}
+    if finished:
+        operation_update["status"] = "completed_with_errors" if counts["failed"] else "completed"
+        operation_update["completedAt"] = firestore.SERVER_TIMESTAMP
+    fleet_operation_ref.update(operation_update)
+    logger.info(f"[Fleet] Tick {tick} of fleet operation {fleet_operation_id} ({action}): {counts}" + (" Finished." if finished else ""))
+    return not finished
+
+
+def _run_fleet_operation_tick(fleet_operation_id: str, tick: int) -> bool:
+    """Runs one tick of a fleet operation. Returns True if another tick is needed."""
+    fleet_operation_ref = db.collection("fleetOperations").document(fleet_operation_id)
+    # Not caught: if the claim fails, Cloud Tasks retries this same tick.
+    operation = _claim_fleet_tick(fleet_operation_ref, tick)
+    if operation is None:
+        logger.warn(f"[Fleet] Tick {tick} of fleet operation {fleet_operation_id} is stale or a duplicate. Skipping.")
+        return False
+    try:
+        return _advance_fleet_operation(fleet_operation_ref, operation, tick)
+    except Exception as e:
+        # The tick is claimed, so the next one picks up where this one stopped.
+        logger.error(f"[Fleet] Tick {tick} of fleet operation {fleet_operation_id} failed: {e}\n{traceback.format_exc()}")
+        return True
+
+
+def run_fleet_operation_task_wrapper(data: dict):
+    """Entry point for the executeFleetOperationTask task queue function."""
+    fleet_operation_id = data.get("fleetOperationId")
+    tick = int(data.get("tick") or 0)
+    if not fleet_operation_id:
+        logger.error("[Fleet] Invalid task payload; fleetOperationId is required.")
+        return
+    needs_next_tick = _run_fleet_operation_tick(fleet_operation_id, tick)
+    if needs_next_tick:
+        try:
+            enqueue_function_task("executeFleetOperationTask", {"fleetOperationId": fleet_operation_id, "tick": tick + 1}, FLEET_POLL_INTERVAL_SEC)
+        except Exception as e:
+            logger.error(f"[Fleet] CRITICAL: Could not schedule tick {tick + 1} of fleet operation {fleet_operation_id}: {e}")
+            db.collection("fleetOperations").document(fleet_operation_id).update({
+                "status": "error", "error": f"Failed to schedule the next step: {str(e)[:300]}", "updatedAt": firestore.SERVER_TIMESTAMP
+            })
+
+
+__all__ = ['_fleet_agent_operation_logic', 'run_fleet_operation_task_wrapper']
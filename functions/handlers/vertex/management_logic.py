@@ -10,6 +10,7 @@ from common.core import db, logger
 from common.config import get_gcp_project_config
 from common.utils import initialize_vertex_ai
 from common.adk_helpers import generate_vertex_deployment_display_name
+from .deployment_logic import is_deployment_in_flight
 
 
 def _delete_vertex_agent_logic(req: https_fn.CallableRequest):
@@ -19,6 +20,11 @@ def _delete_vertex_agent_logic(req: https_fn.CallableRequest):
     if not resource_name or not agent_doc_id:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Vertex AI resourceName and agentDocId are required.")
 
+    return delete_agent_deployment(resource_name, agent_doc_id)
+
+
+def delete_agent_deployment(resource_name: str, agent_doc_id: str) -> dict:
+    """Deletes the agent's Vertex AI engine and clears its deployment fields. Raises HttpsError on failure."""
     logger.info(f"Attempting to delete Vertex AI agent '{resource_name}' (FS doc: '{agent_doc_id}').")
     initialize_vertex_ai() # Ensures Vertex AI SDK is initialized
 
@@ -40,6 +46,7 @@ def _delete_vertex_agent_logic(req: https_fn.CallableRequest):
             "vertexAiResourceName": firestore.DELETE_FIELD,
             "deploymentStatus": "deleted", # Or "not_found_on_vertex" if that's more accurate based on above
             "lastDeployedAt": firestore.DELETE_FIELD,
+            "deploymentFingerprint": firestore.DELETE_FIELD,
             "deploymentError": firestore.DELETE_FIELD,
             "lastStatusCheckAt": firestore.SERVER_TIMESTAMP
         })
@@ -77,6 +84,19 @@ def _check_vertex_agent_deployment_status_logic(req: https_fn.CallableRequest):
             raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message=f"Agent document {agent_doc_id} not found.")
         agent_data = agent_snap.to_dict()
 
+        if is_deployment_in_flight(agent_data):
+            # The deployment task owns the status until it finishes. Before the build starts there is
+            # no engine to find, and during an update the old engine still reports ACTIVE.
+            deployment_progress = agent_data.get("deploymentProgress") or {}
+            agent_doc_ref.update({"lastStatusCheckAt": firestore.SERVER_TIMESTAMP})
+            return {
+                "success": True,
+                "status": agent_data.get("deploymentStatus"),
+                "resourceName": agent_data.get("vertexAiResourceName"),
+                "vertexState": None,
+                "deploymentPhase": deployment_progress.get("currentPhase")
+            }
+
         expected_config_name = agent_data.get("name") # Used for display name generation
         expected_vertex_display_name = generate_vertex_deployment_display_name(expected_config_name, agent_doc_id)
         current_stored_resource_name = agent_data.get("vertexAiResourceName")
@@ -187,4 +207,10 @@ def _check_vertex_agent_deployment_status_logic(req: https_fn.CallableRequest):
             code=https_fn.FunctionsErrorCode.INTERNAL,
             message=f"Failed to check agent deployment status: {str(e)[:200]}"
         )
-  
\ No newline at end of file
+
+
+__all__ = [
+    '_delete_vertex_agent_logic',
+    'delete_agent_deployment',
+    '_check_vertex_agent_deployment_status_logic'
+]
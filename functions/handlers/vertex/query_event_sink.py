@@ -0,0 +1,283 @@
+# functions/handlers/vertex/query_event_sink.py
+import threading
+import time
+import traceback
+from firebase_admin import firestore
+from common.core import db, logger
+from common.config import (
+    EVENT_SINK_MAX_BATCH_SIZE,
+    EVENT_SINK_FLUSH_INTERVAL_SEC,
+    PARTIAL_CONTENT_UPDATE_INTERVAL_SEC,
+    PARTIAL_CONTENT_UPDATE_MIN_CHARS
+)
+
+EVENT_STORAGE_ARRAY = "array"
+EVENT_STORAGE_SUBCOLLECTION = "subcollection"
+EVENTS_SUBCOLLECTION_NAME = "events"
+EVENTS_SUMMARY_FIELD = "run.eventsSummary"
+PARTIAL_CONTENT_FIELD = "run.partialContent"
+_MAX_EVENTS_PER_BATCH_WRITE = 450 # Firestore allows 500 writes per batch; leave room for the summary update
+
+
+def event_doc_id_for_seq(seq: int) -> str:
+    """Zero-padded so that document IDs sort in sequence order."""
+    return f"{seq:010d}"
+
+
+class FirestoreEventSink:
+    """
+    Buffers run events and writes them to Firestore in coalesced writes instead of
+    one update per event.
+
+    In "array" storage mode the events are appended to an array field of the message
+    document with a single ArrayUnion per flush. In "subcollection" mode each event becomes
+    its own document under events/{seq} with a monotonically increasing sequence number,
+    and the message document only carries a compact summary (count, lastSeq, status).
+
+    Buffered events are flushed by a background thread when the buffer reaches
+    max_batch_size or every flush_interval_sec, and a final flush happens on close().
+    add() never performs I/O itself, so the sink is safe to use from both the
+    threaded Vertex runner and the async A2A/model loops.
+
+    The text accumulated so far can be published with set_partial_content(). It is written
+    to run.partialContent by the same thread, throttled to partial_interval_sec or
+    partial_min_chars new characters, and piggybacks on event writes when both are due.
+    """
+
+    def __init__(
+            self,
+            doc_ref,
+            field_path: str = "run.outputEvents",
+            max_batch_size: int = EVENT_SINK_MAX_BATCH_SIZE,
+            flush_interval_sec: float = EVENT_SINK_FLUSH_INTERVAL_SEC,
+            log_prefix: str = "[EventSink]",
+            storage_mode: str = EVENT_STORAGE_ARRAY,
+            start_seq: int = 0,
+            partial_interval_sec: float = PARTIAL_CONTENT_UPDATE_INTERVAL_SEC,
+            partial_min_chars: int = PARTIAL_CONTENT_UPDATE_MIN_CHARS
+    ):
+        if storage_mode not in (EVENT_STORAGE_ARRAY, EVENT_STORAGE_SUBCOLLECTION):
+            raise ValueError(f"Unsupported event storage mode: '{storage_mode}'. Expected '{EVENT_STORAGE_ARRAY}' or '{EVENT_STORAGE_SUBCOLLECTION}'.")
+
+        self.doc_ref = doc_ref
+        self.field_path = field_path
+        self.max_batch_size = max(1, min(int(max_batch_size), _MAX_EVENTS_PER_BATCH_WRITE))
+        self.flush_interval_sec = max(0.05, float(flush_interval_sec))
+        self.log_prefix = log_prefix
+        self.storage_mode = storage_mode
+        self.next_seq = max(0, int(start_seq))
+        self.partial_interval_sec = max(0.0, float(partial_interval_sec))
+        self.partial_min_chars = max(1, int(partial_min_chars))
+
+        self.events_received = 0
+        self.events_written = 0
+        self.flush_count = 0
+        self.failed_flush_count = 0
+        self.partial_write_count = 0
+        self.errors = [] # Only events that could not be written at all end up here
+
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock() # Serializes writes so events keep their order
+        self._wake_event = threading.Event()
+        self._closed = False
+        self._flusher_thread = None
+        self._last_flush_error = None
+        self._last_event_flush_time = time.monotonic()
+        self._partial_text = None # Latest text not yet written
+        self._partial_written_len = 0
+        self._last_partial_write_time = 0.0
+
+    def _ensure_flusher_started(self) -> None:
+        # Caller holds _buffer_lock
+        if self._flusher_thread is None:
+            self._flusher_thread = threading.Thread(target=self._flusher_loop, name=f"event-sink-{self.doc_ref.id}", daemon=True)
+            self._flusher_thread.start()
+
+    def add(self, event: dict) -> None:
+        """Queues an event for the next flush."""
+        if self._closed:
+            raise RuntimeError(f"{self.log_prefix} Cannot add events to a closed sink for doc {self.doc_ref.id}.")
+        with self._buffer_lock:
+            self._buffer.append(event)
+            self.events_received += 1
+            buffered_count = len(self._buffer)
+            self._ensure_flusher_started()
+        if buffered_count >= self.max_batch_size:
+            self._wake_event.set()
+
+    def set_partial_content(self, text: str) -> None:
+        """Publishes the response text accumulated so far; only the latest value is written."""
+        if self._closed or self.partial_interval_sec <= 0 or not text:
+            return
+        with self._buffer_lock:
+            was_clean = self._partial_text is None
+            if (not was_clean and self._partial_text == text) or (was_clean and len(text) == self._partial_written_len):
+                return # Accumulated text only grows, so an unchanged length means nothing new
+            self._partial_text = text
+            self._ensure_flusher_started()
+        if was_clean or len(text) - self._partial_written_len >= self.partial_min_chars:
+            # Wake the flusher so it can schedule the write on the shorter partial-content interval.
+            self._wake_event.set()
+
+    def _take_partial_update(self) -> dict:
+        # Caller holds _buffer_lock
+        if self._partial_text is None:
+            return {}
+        return {PARTIAL_CONTENT_FIELD: self._partial_text}
+
+    def _mark_partial_written(self, partial_update: dict) -> None:
+        if not partial_update:
+            return
+        written_text = partial_update[PARTIAL_CONTENT_FIELD]
+        with self._buffer_lock:
+            if self._partial_text == written_text:
+                self._partial_text = None
+            self._partial_written_len = len(written_text)
+        self.partial_write_count += 1
+
+    def flush(self) -> bool:
+        """
+        Writes all buffered events. On failure the events are kept in the buffer so the
+        next flush retries them. Returns True if nothing is left pending.
+        """
+        with self._flush_lock:
+            with self._buffer_lock:
+                partial_update = self._take_partial_update()
+                if partial_update:
+                    # Throttle by attempt time so a failing write is not retried in a tight loop.
+                    self._last_partial_write_time = time.monotonic()
+                if not self._buffer:
+                    if partial_update:
+                        self._write_partial_content(partial_update)
+                    return True
+                batch = self._buffer
+                self._buffer = []
+            self._last_event_flush_time = time.monotonic()
+
+            write_start_time = time.monotonic()
+            committed_count = 0
+            try:
+                # The buffer can grow past one batch after failed flushes, so write in chunks.
+                for chunk_start in range(0, len(batch), _MAX_EVENTS_PER_BATCH_WRITE):
+                    chunk = batch[chunk_start:chunk_start + _MAX_EVENTS_PER_BATCH_WRITE]
+                    # The partial text rides along with the last chunk's document update.
+                    is_last_chunk = chunk_start + _MAX_EVENTS_PER_BATCH_WRITE >= len(batch)
+                    chunk_partial_update = partial_update if is_last_chunk else {}
+                    if self.storage_mode == EVENT_STORAGE_SUBCOLLECTION:
+                        self._write_to_subcollection(chunk, chunk_partial_update)
+                    else:
+                        self.doc_ref.update({self.field_path: firestore.ArrayUnion(chunk), **chunk_partial_update})
+                    self._mark_partial_written(chunk_partial_update)
+                    committed_count += len(chunk)
+                    self.events_written += len(chunk)
+                    self.flush_count += 1
+            except Exception as e_flush:
+                self.failed_flush_count += 1
+                self._last_flush_error = e_flush
+                logger.error(f"{self.log_prefix} Failed to flush {len(batch) - committed_count} event(s) ({self.storage_mode}) for doc {self.doc_ref.id}: {e_flush}\n{traceback.format_exc()}")
+                with self._buffer_lock:
+                    self._buffer = batch[committed_count:] + self._buffer
+                return False
+
+            logger.debug(f"{self.log_prefix} Flushed {len(batch)} event(s) ({self.storage_mode}) to doc {self.doc_ref.id} in {time.monotonic() - write_start_time:.3f}s (total written: {self.events_written}).")
+            return True
+
+    def _write_partial_content(self, partial_update: dict) -> None:
+        try:
+            self.doc_ref.update(partial_update)
+            self._mark_partial_written(partial_update)
+        except Exception as e_partial:
+            # Not retried separately: a newer value is written on the next tick, and the final
+            # content is written by the task handler when the run completes.
+            logger.warn(f"{self.log_prefix} Failed to write partial content for doc {self.doc_ref.id}: {e_partial}")
+
+    def _write_to_subcollection(self, batch: list, partial_update: dict) -> None:
+        # Sequence numbers only advance after a successful commit, so a retried batch
+        # rewrites the same event documents instead of leaving gaps or duplicates.
+        events_col_ref = self.doc_ref.collection(EVENTS_SUBCOLLECTION_NAME)
+        write_batch = db.batch()
+        seq = self.next_seq
+        for event in batch:
+            write_batch.set(events_col_ref.document(event_doc_id_for_seq(seq)), {
+                "seq": seq,
+                "event": event,
+                "createdAt": firestore.SERVER_TIMESTAMP
+            })
+            seq += 1
+        write_batch.update(self.doc_ref, {
+            f"{EVENTS_SUMMARY_FIELD}.count": seq,
+            f"{EVENTS_SUMMARY_FIELD}.lastSeq": seq - 1,
+            f"{EVENTS_SUMMARY_FIELD}.status": "streaming",
+            f"{EVENTS_SUMMARY_FIELD}.updatedAt": firestore.SERVER_TIMESTAMP,
+            **partial_update
+        })
+        write_batch.commit()
+        self.next_seq = seq
+
+    def close(self) -> None:
+        """Stops the background flusher and writes any remaining events."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake_event.set()
+        if self._flusher_thread is not None:
+            self._flusher_thread.join()
+
+        if not self.flush():
+            # One retry for the final batch; after that the remaining events are dropped.
+            if not self.flush():
+                with self._buffer_lock:
+                    dropped_count = len(self._buffer)
+                    self._buffer = []
+                self.errors.append(f"Firestore write error, {dropped_count} event(s) not saved: {str(self._last_flush_error)[:150]}")
+                logger.error(f"{self.log_prefix} Dropping {dropped_count} event(s) for doc {self.doc_ref.id} after repeated write failures.")
+
+        if self.storage_mode == EVENT_STORAGE_SUBCOLLECTION:
+            try:
+                self.doc_ref.update({f"{EVENTS_SUMMARY_FIELD}.status": "closed"})
+            except Exception as e_summary:
+                logger.warn(f"{self.log_prefix} Could not mark events summary as closed for doc {self.doc_ref.id}: {e_summary}")
+        logger.info(f"{self.log_prefix} Closed sink for doc {self.doc_ref.id}. Mode: {self.storage_mode}, Events: {self.events_received}, Written: {self.events_written}, Writes: {self.flush_count}, Failed writes: {self.failed_flush_count}, Partial content writes: {self.partial_write_count}")
+
+    def _flusher_loop(self) -> None:
+        while not self._closed:
+            now = time.monotonic()
+            with self._buffer_lock:
+                partial_pending = self._partial_text is not None
+            wait_sec = self.flush_interval_sec - (now - self._last_event_flush_time)
+            if partial_pending:
+                wait_sec = min(wait_sec, self.partial_interval_sec - (now - self._last_partial_write_time))
+            if wait_sec > 0:
+                self._wake_event.wait(timeout=wait_sec)
+            self._wake_event.clear()
+            if self._closed:
+                break
+
+            now = time.monotonic()
+            with self._buffer_lock:
+                buffered_count = len(self._buffer)
+                partial_text = self._partial_text
+            events_due = buffered_count > 0 and (
+                    buffered_count >= self.max_batch_size or now - self._last_event_flush_time >= self.flush_interval_sec)
+            partial_due = partial_text is not None and (
+                    now - self._last_partial_write_time >= self.partial_interval_sec
+                    or len(partial_text) - self._partial_written_len >= self.partial_min_chars)
+            if events_due or partial_due:
+                self.flush()
+            elif buffered_count == 0 and now - self._last_event_flush_time >= self.flush_interval_sec:
+                self._last_event_flush_time = now # Idle: restart the interval instead of spinning
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        return False
+
+
+__all__ = [
+    'EVENT_STORAGE_ARRAY',
+    'EVENT_STORAGE_SUBCOLLECTION',
+    'FirestoreEventSink'
+]
@@ -0,0 +1,230 @@
+# functions/handlers/vertex/query_history_window.py
+import asyncio
+import traceback
+import litellm
+from firebase_admin import firestore
+from common.core import get_async_db, logger
+from common.config import HISTORY_TOKEN_BUDGET, HISTORY_SUMMARY_MAX_TOKENS, HISTORY_SUMMARY_MODEL_ID
+from common.adk_helpers import build_litellm_model_kwargs, get_model_config_from_firestore
+from common.rate_limiter import RateLimitDeferred, RateLimitSpec, resolve_rate_limit_spec, estimate_request_tokens, rate_limited_call
+
+# Rolling summaries live in chats/{chatId}/historySummaries/{lastCoveredMessageId}, so they do not
+# grow the chat document or wake its listeners on every turn.
+HISTORY_SUMMARIES_COLLECTION = "historySummaries"
+HISTORY_SUMMARY_GET_ALL_CHUNK_SIZE = 100
+# Messages tokenized per worker-thread hop.
+TOKEN_COUNT_BATCH_SIZE = 32
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+_SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and one or more AI assistants. "
+    "Update the existing summary with the new messages. Keep facts, decisions, open questions, names and "
+    "user preferences; drop pleasantries and repetition. Reply with the updated summary only."
+)
+
+
+def count_text_tokens(text: str, litellm_model: str | None) -> int:
+    """Counts tokens with the model's tokenizer via LiteLLM, falling back to a character estimate."""
+    if not text:
+        return 0
+    if litellm_model:
+        try:
+            return litellm.token_counter(model=litellm_model, text=text)
+        except Exception as e_count:
+            logger.debug(f"[HistoryWindow] token_counter failed for model '{litellm_model}': {e_count}. Using character estimate.")
+    return max(1, len(text) // 4)
+
+
+async def count_texts_tokens(texts: list, litellm_model: str | None) -> list[int]:
+    """count_text_tokens for several texts in one worker thread, keeping tokenizers off the event loop."""
+    if not texts:
+        return []
+    return await asyncio.to_thread(lambda: [count_text_tokens(text, litellm_model) for text in texts])
+
+
+async def resolve_history_model_config(agent_id: str | None, model_id: str | None, participant_config: dict) -> dict | None:
+    """
+    Returns the model config used to count tokens and write summaries for a participant:
+    the model itself for model runs, the agent's root model for single-model agents, or
+    HISTORY_SUMMARY_MODEL_ID as a fallback. None disables windowing for this run.
+    """
+    if model_id:
+        return participant_config
+    summary_model_id = participant_config.get("modelId") or HISTORY_SUMMARY_MODEL_ID
+    if not summary_model_id:
+        logger.info(f"[HistoryWindow] Agent '{agent_id}' has no root model and HISTORY_SUMMARY_MODEL_ID is not set. History windowing disabled.")
+        return None
+    try:
+        return await get_model_config_from_firestore(summary_model_id)
+    except ValueError as e_model:
+        logger.warn(f"[HistoryWindow] Could not load model '{summary_model_id}' for history windowing: {e_model}")
+        return None
+
+
+def _format_messages_for_summary(messages: list) -> str:
+    return "\n\n".join(f"[{msg.get('participant', 'unknown')}]: {msg.get('content', '')}" for msg in messages)
+
+
+async def _extend_summary(previous_summary: str | None, new_messages: list, litellm_kwargs: dict, rate_limit_spec: RateLimitSpec | None = None) -> str:
+    user_prompt = (
+        f"Existing summary:\n{previous_summary or '(none yet)'}\n\n"
+        f"New messages:\n{_format_messages_for_summary(new_messages)}"
+    )
+    # Same model as the turn's own call, so summaries count against the same provider limits.
+    request_tokens = estimate_request_tokens(_SUMMARY_SYSTEM_PROMPT + user_prompt, {"maxOutputTokens": HISTORY_SUMMARY_MAX_TOKENS})
+    async with rate_limited_call(rate_limit_spec, request_tokens):
+        response = await litellm.acompletion(
+            **litellm_kwargs,
+            messages=[
+                {"role": "system", "content": _SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+            temperature=0
+        )
+    summary_text = (response.choices[0].message.content or "").strip()
+    if not summary_text:
+        raise ValueError("Summarization returned empty text.")
+    return summary_text
+
+
+async def _store_summary(summaries_ref, chat_id: str, last_covered_id: str | None, summary: str, covered_message_count: int) -> None:
+    if not last_covered_id:
+        return
+    try:
+        await summaries_ref.document(last_covered_id).set({
+            "summary": summary,
+            "coveredMessageCount": covered_message_count,
+            "updatedAt": firestore.SERVER_TIMESTAMP
+        })
+    except Exception as e_write:
+        logger.warn(f"[HistoryWindow] Could not store rolling summary for chat {chat_id}: {e_write}")
+
+
+async def _get_rolling_summary(chat_id: str, older_messages: list, litellm_kwargs: dict, chunk_token_budget: int, rate_limit_spec: RateLimitSpec | None = None) -> tuple[str | None, list]:
+    """
+    Returns (summary, unsummarized_messages) for the given prefix of the conversation.
+
+    Summaries are stored in the chat's historySummaries subcollection keyed by the last message
+    they cover, so they are shared by every branch passing through that message. Only the
+    messages after the deepest stored summary are folded in, chunk by chunk, and the result is
+    stored under the last older message; nothing is ever re-summarized from scratch.
+    Summary calls go through the rate limiter; RateLimitDeferred is raised after the progress
+    made so far has been stored.
+    """
+    async_db = get_async_db()
+    summaries_ref = async_db.collection("chats").document(chat_id).collection(HISTORY_SUMMARIES_COLLECTION)
+    index_by_message_id = {msg["id"]: idx for idx, msg in enumerate(older_messages) if msg.get("id")}
+    newest_first_ids = sorted(index_by_message_id, key=index_by_message_id.get, reverse=True)
+
+    base_summary = None
+    base_index = -1
+    try:
+        # Newest chunk first: the deepest stored summary is usually among the latest messages.
+        for chunk_start in range(0, len(newest_first_ids), HISTORY_SUMMARY_GET_ALL_CHUNK_SIZE):
+            chunk_refs = [summaries_ref.document(message_id) for message_id in newest_first_ids[chunk_start:chunk_start + HISTORY_SUMMARY_GET_ALL_CHUNK_SIZE]]
+            async for summary_snap in async_db.get_all(chunk_refs):
+                stored_summary = (summary_snap.to_dict() or {}).get("summary") if summary_snap.exists else None
+                if stored_summary and index_by_message_id[summary_snap.id] > base_index:
+                    base_summary, base_index = stored_summary, index_by_message_id[summary_snap.id]
+            if base_summary:
+                break
+    except Exception as e_read:
+        logger.warn(f"[HistoryWindow] Could not read stored summaries for chat {chat_id}: {e_read}")
+        base_summary, base_index = None, -1
+
+    pending_messages = older_messages[base_index + 1:]
+    if not pending_messages:
+        return base_summary, []
+
+    litellm_model = litellm_kwargs.get("model")
+    summary = base_summary
+    summarized_count = 0
+    try:
+        pending_token_counts = await count_texts_tokens([msg.get("content", "") for msg in pending_messages], litellm_model)
+        chunk, chunk_tokens = [], 0
+        for msg, msg_tokens in zip(pending_messages, pending_token_counts):
+            if chunk and chunk_tokens + msg_tokens > chunk_token_budget:
+                summary = await _extend_summary(summary, chunk, litellm_kwargs, rate_limit_spec)
+                summarized_count += len(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append(msg)
+            chunk_tokens += msg_tokens
+        if chunk:
+            summary = await _extend_summary(summary, chunk, litellm_kwargs, rate_limit_spec)
+            summarized_count += len(chunk)
+    except RateLimitDeferred:
+        if summarized_count:
+            # The requeued turn continues from here instead of re-summarizing these chunks.
+            last_summarized_index = len(older_messages) - len(pending_messages) + summarized_count - 1
+            await _store_summary(summaries_ref, chat_id, older_messages[last_summarized_index].get("id"), summary, last_summarized_index + 1)
+        raise
+    except Exception as e_summarize:
+        logger.error(f"[HistoryWindow] Incremental summarization failed for chat {chat_id}: {e_summarize}\n{traceback.format_exc()}")
+        if summarized_count == 0:
+            return base_summary, pending_messages
+        # Keep the progress made so far; the rest is sent verbatim this turn.
+        return summary, pending_messages[summarized_count:]
+
+    await _store_summary(summaries_ref, chat_id, older_messages[-1].get("id"), summary, len(older_messages))
+    return summary, []
+
+
+async def build_windowed_history_text(chat_id: str, conversation_history: list, model_config: dict | None, enforce_rate_limits: bool = True) -> str:
+    """
+    Builds the conversation text for a prompt. The most recent turns are kept verbatim within
+    the token budget (counted with the model's tokenizer via LiteLLM); older turns are replaced
+    by an incrementally maintained summary. Without a usable model config the full history is
+    returned, matching the previous behavior.
+    """
+    messages_with_content = [msg for msg in conversation_history if msg.get("content")]
+    full_history_text = "\n\n".join(msg["content"] for msg in messages_with_content)
+    if not model_config or not messages_with_content:
+        return full_history_text
+
+    token_budget = model_config.get("historyTokenBudget")
+    if not isinstance(token_budget, int):
+        token_budget = HISTORY_TOKEN_BUDGET
+    if token_budget <= 0:
+        return full_history_text
+
+    try:
+        litellm_kwargs = build_litellm_model_kwargs(model_config, "history_summarizer", context_for_log="(history window)")
+    except ValueError as e_model:
+        logger.warn(f"[HistoryWindow] Model config unusable for windowing, sending full history: {e_model}")
+        return full_history_text
+    litellm_model = litellm_kwargs.get("model")
+
+    # Walk newest to oldest; the newest message is always kept even if it alone exceeds the budget.
+    # Messages are tokenized in batches off the event loop, stopping at the first batch over budget.
+    recent_count, used_tokens = 0, 0
+    budget_reached = False
+    newest_first = messages_with_content[::-1]
+    for batch_start in range(0, len(newest_first), TOKEN_COUNT_BATCH_SIZE):
+        batch_texts = [msg["content"] for msg in newest_first[batch_start:batch_start + TOKEN_COUNT_BATCH_SIZE]]
+        for msg_tokens in await count_texts_tokens(batch_texts, litellm_model):
+            if recent_count and used_tokens + msg_tokens > token_budget:
+                budget_reached = True
+                break
+            recent_count += 1
+            used_tokens += msg_tokens
+        if budget_reached:
+            break
+
+    older_messages = messages_with_content[:len(messages_with_content) - recent_count]
+    recent_messages = messages_with_content[len(messages_with_content) - recent_count:]
+    if not older_messages:
+        return full_history_text
+
+    rate_limit_spec = resolve_rate_limit_spec(model_config) if enforce_rate_limits else None
+    summary, unsummarized_messages = await _get_rolling_summary(chat_id, older_messages, litellm_kwargs, token_budget, rate_limit_spec)
+    logger.info(f"[HistoryWindow] Chat {chat_id}: {len(recent_messages)} recent message(s) (~{used_tokens} tokens) kept verbatim, {len(older_messages) - len(unsummarized_messages)} older message(s) summarized.")
+
+    text_parts = []
+    if summary:
+        text_parts.append(f"{SUMMARY_HEADER}\n{summary}")
+    text_parts.extend(msg["content"] for msg in unsummarized_messages + recent_messages)
+    return "\n\n".join(text_parts)
+
+
+__all__ = ['build_windowed_history_text', 'resolve_history_model_config', 'count_text_tokens', 'count_texts_tokens', 'HISTORY_SUMMARIES_COLLECTION']
@@ -65,7 +65,9 @@ async def try_local_diagnostic_run(
         # instantiate_adk_agent_from_config is now async
         local_adk_agent = await instantiate_adk_agent_from_config(
             agent_config_data,
-            parent_adk_name_for_context=f"local_diag_{firestore_agent_id[:4]}"
+            parent_adk_name_for_context=f"local_diag_{firestore_agent_id[:4]}",
+            share_mcp_sessions=True, # Local run: reuse pooled MCP sessions
+            use_llm_router=True
         )
         logger.info(f"[LocalDiag] Successfully instantiated local ADK agent: {local_adk_agent.name} of type {type(local_adk_agent).__name__}")
 
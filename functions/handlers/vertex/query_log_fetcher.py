@@ -4,10 +4,8 @@ import traceback
 import json
 import time
 from datetime import datetime, timedelta, timezone
-from google.cloud.logging_v2.services.logging_service_v2 import LoggingServiceV2Client
 from common.core import logger
-
-logging_client = LoggingServiceV2Client()
+from common.worker_runtime import get_logging_client
 
 def _fetch_vertex_logs_sync(project_id: str, location: str, reasoning_engine_id: str, adk_session_id: str | None, start_time_dt_aware: datetime):
     """
@@ -52,7 +50,7 @@ def _fetch_vertex_logs_sync(project_id: str, location: str, reasoning_engine_id:
             "page_size": 10 # Limit the number of logs fetched for brevity
         }
 
-        entries_iterator = logging_client.list_log_entries(request=log_request)
+        entries_iterator = get_logging_client().list_log_entries(request=log_request)
         fetched_count = 0
         for entry in entries_iterator:
             message_content = ""
@@ -1,19 +1,36 @@
 # functions/handlers/vertex/query_orchestrator.py
 import traceback
-import json
 from datetime import datetime, timezone
-from google.cloud import tasks_v2
 
 from firebase_admin import firestore
 from firebase_functions import https_fn
 
 from common.core import db, logger
-from common.config import get_gcp_project_config
 from common.utils import initialize_vertex_ai
 from common.adk_helpers import get_model_config_from_firestore
+from common.task_queue import enqueue_function_task
 
 # The executor logic is now in the task handler, so we remove the import here.
 
+def _get_child_ancestor_path(messages_col_ref, parent_message_id: str | None) -> list | None:
+    """
+    Returns the materialized ancestor path (root first) for a new child of parent_message_id,
+    or None if the parent predates ancestor paths and the chain cannot be derived cheaply.
+    """
+    if not parent_message_id:
+        return []
+    try:
+        parent_snap = messages_col_ref.document(parent_message_id).get(field_paths=["ancestorPath"])
+    except Exception as e:
+        logger.warn(f"[Orchestrator] Could not read ancestorPath of parent message {parent_message_id}: {e}")
+        return None
+    if not parent_snap.exists:
+        return None
+    parent_ancestor_path = (parent_snap.to_dict() or {}).get("ancestorPath")
+    if not isinstance(parent_ancestor_path, list):
+        return None
+    return parent_ancestor_path + [parent_message_id]
+
 def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
     """
     IMMEDIATE RESPONSE: Validates request, creates a placeholder message in Firestore (and a user message if content is provided),
@@ -36,7 +53,6 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Either agentId or modelId must be provided.")
 
     initialize_vertex_ai()
-    project_id, location, _ = get_gcp_project_config()
 
     # --- Start Firestore Batch ---
     batch = db.batch()
@@ -44,6 +60,8 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
     messages_col_ref = chat_ref.collection("messages")
 
     effective_parent_id = parent_message_id
+    # Materialized chain of ancestor IDs; lets the task handler load history with batched reads.
+    effective_parent_ancestor_path = _get_child_ancestor_path(messages_col_ref, parent_message_id)
 
     # 1. If there's message content, create a new user message.
     #    This is the core of the fix: this block is skipped for "Reply as..." actions.
@@ -58,6 +76,9 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
             "childMessageIds": [], # Will be linked to the new assistant message
             "timestamp": firestore.SERVER_TIMESTAMP,
         }
+        if effective_parent_ancestor_path is not None:
+            user_message_data["ancestorPath"] = effective_parent_ancestor_path
+            effective_parent_ancestor_path = effective_parent_ancestor_path + [user_message_id]
         batch.set(user_message_ref, user_message_data)
 
         # Link the original parent to this new user message
@@ -87,6 +108,8 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
             "stuffedContextItems": stuffed_context_items, # <-- SAVE THE CONTEXT
         }
     }
+    if effective_parent_ancestor_path is not None:
+        assistant_message_data["ancestorPath"] = effective_parent_ancestor_path
     batch.set(assistant_message_ref, assistant_message_data)
 
     # Link the effective parent to the new assistant message
@@ -102,27 +125,16 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
 
     # 3. Enqueue the Cloud Task for background execution
     try:
-        tasks_client = tasks_v2.CloudTasksClient()
-        queue_path = tasks_client.queue_path(project_id, location, "executeAgentRunTask") # lowercase for queue name
-
         task_payload = {
             "chatId": chat_id,
             "assistantMessageId": assistant_message_id,
             "agentId": agent_id,
             "modelId": model_id,
             "adkUserId": adk_user_id,
+            "parentMessageId": effective_parent_id, # Lets the worker load the history without waiting for the message read
         }
 
-        task = {
-            "http_request": {
-                "http_method": tasks_v2.HttpMethod.POST,
-                "url": f"https://{location}-{project_id}.cloudfunctions.net/executeAgentRunTask",
-                "headers": {"Content-type": "application/json"},
-                "body": json.dumps({"data": task_payload}).encode(),
-            }
-        }
-
-        tasks_client.create_task(parent=queue_path, task=task)
+        enqueue_function_task("executeAgentRunTask", task_payload)
         logger.info(f"[Orchestrator] Enqueued task for assistantMessageId: {assistant_message_id}")
 
     except Exception as e:
@@ -0,0 +1,109 @@
+# functions/handlers/vertex/query_response_cache.py
+import hashlib
+import json
+import traceback
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+from common.core import get_async_db, logger
+from common.cache import TTLCache
+from common.agent_plan import NON_BUILD_CONFIG_KEYS, canonical_json
+from common.config import RESPONSE_CACHE_TTL_SEC, RESPONSE_CACHE_MEMORY_MAX_ENTRIES, RESPONSE_CACHE_MAX_DOC_BYTES
+from .query_event_sink import FirestoreEventSink
+
+RESPONSE_CACHE_COLLECTION = "responseCache"
+RESPONSE_CACHE_ENABLED_FIELD = "responseCacheEnabled"
+RESPONSE_CACHE_KEY_VERSION = 1
+
+# Generation parameters of a model doc that change the response.
+GENERATION_PARAM_FIELDS = ("temperature", "maxOutputTokens", "topP", "topK", "stopSequences")
+# Model doc fields that never change the response: lifecycle fields, credentials (rotating a key
+# keeps the cache) and the cache switch itself.
+_NON_RESPONSE_MODEL_FIELDS = NON_BUILD_CONFIG_KEYS | {"litellm_api_key", RESPONSE_CACHE_ENABLED_FIELD, "streamResponses"}
+
+_memory_tier = TTLCache("ResponseCache", max_entries=RESPONSE_CACHE_MEMORY_MAX_ENTRIES, ttl_sec=RESPONSE_CACHE_TTL_SEC)
+
+
+def is_response_cache_eligible(model_config: dict) -> bool:
+    """Only models that opted in and sample deterministically (temperature 0) are cached."""
+    if model_config.get(RESPONSE_CACHE_ENABLED_FIELD) is not True:
+        return False
+    temperature = model_config.get("temperature")
+    return isinstance(temperature, (int, float)) and not isinstance(temperature, bool) and float(temperature) == 0.0
+
+
+def response_cache_key(model_id: str, model_config: dict, prompt_text: str) -> str:
+    """sha256 over (model config, generation params, assembled prompt)."""
+    key_material = {
+        "version": RESPONSE_CACHE_KEY_VERSION,
+        "modelId": model_id,
+        "model": {k: v for k, v in model_config.items() if k not in _NON_RESPONSE_MODEL_FIELDS and k not in GENERATION_PARAM_FIELDS},
+        "generation": {field: model_config.get(field) for field in GENERATION_PARAM_FIELDS},
+        "prompt": prompt_text
+    }
+    return hashlib.sha256(canonical_json(key_material).encode("utf-8")).hexdigest()
+
+
+async def get_cached_response(cache_key: str) -> dict | None:
+    """Returns {'events': [...], 'finalResponseText': str} from memory, then Firestore, or None."""
+    cached_response = _memory_tier.get(cache_key)
+    if cached_response is not None:
+        logger.info(f"[ResponseCache] Memory hit for key {cache_key[:16]}.")
+        return cached_response
+    try:
+        cache_snap = await get_async_db().collection(RESPONSE_CACHE_COLLECTION).document(cache_key).get()
+    except Exception as e_read:
+        logger.warn(f"[ResponseCache] Could not read cache entry {cache_key[:16]}: {e_read}")
+        return None
+    if not cache_snap.exists:
+        return None
+    cache_data = cache_snap.to_dict() or {}
+    expires_at = cache_data.get("expiresAt")
+    # The TTL policy deletes expired documents eventually (typically within a day), so check here too.
+    if not isinstance(expires_at, datetime) or expires_at <= datetime.now(timezone.utc):
+        return None
+    cached_response = {"events": cache_data.get("events") or [], "finalResponseText": cache_data.get("finalResponseText", "")}
+    remaining_ttl_sec = (expires_at - datetime.now(timezone.utc)).total_seconds()
+    _memory_tier.set(cache_key, cached_response, ttl_sec=min(RESPONSE_CACHE_TTL_SEC, remaining_ttl_sec))
+    logger.info(f"[ResponseCache] Firestore hit for key {cache_key[:16]}.")
+    return cached_response
+
+
+async def store_cached_response(cache_key: str, model_id: str, events: list, final_text: str) -> None:
+    """Stores a completed response in both tiers. Failures are logged, never raised."""
+    cached_response = {"events": events, "finalResponseText": final_text}
+    _memory_tier.set(cache_key, cached_response)
+    try:
+        serialized_size = len(json.dumps(cached_response, default=str).encode("utf-8"))
+        if serialized_size > RESPONSE_CACHE_MAX_DOC_BYTES:
+            logger.info(f"[ResponseCache] Response for key {cache_key[:16]} is {serialized_size} bytes; caching in memory only.")
+            return
+        await get_async_db().collection(RESPONSE_CACHE_COLLECTION).document(cache_key).set({
+            **cached_response,
+            "modelId": model_id,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "expiresAt": datetime.now(timezone.utc) + timedelta(seconds=RESPONSE_CACHE_TTL_SEC)
+        })
+        logger.info(f"[ResponseCache] Stored response for key {cache_key[:16]} ({len(events)} event(s)).")
+    except Exception as e_write:
+        logger.warn(f"[ResponseCache] Could not store cache entry {cache_key[:16]}: {e_write}\n{traceback.format_exc()}")
+
+
+def replay_cached_response(cached_response: dict, event_sink: FirestoreEventSink) -> str:
+    """Feeds the stored events through the sink as a live run would and returns the final text."""
+    final_text = ""
+    for event_dict in cached_response.get("events") or []:
+        event_sink.add(event_dict)
+        content = event_dict.get("content") or {}
+        final_text += "".join(part["text"] for part in (content.get("parts") or []) if part.get("text"))
+        event_sink.set_partial_content(final_text)
+    return final_text or cached_response.get("finalResponseText", "")
+
+
+__all__ = [
+    'RESPONSE_CACHE_COLLECTION',
+    'is_response_cache_eligible',
+    'response_cache_key',
+    'get_cached_response',
+    'store_cached_response',
+    'replay_cached_response'
+]
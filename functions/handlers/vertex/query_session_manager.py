@@ -1,6 +1,7 @@
 # functions/handlers/vertex/query_session_manager.py
 import traceback
-from common.core import logger
+from firebase_admin import firestore
+from common.core import get_async_db, logger
 from google.adk.sessions import VertexAiSessionService # Assuming this will be used directly
 
 async def ensure_adk_session(
@@ -77,4 +78,92 @@ async def ensure_adk_session(
 
     return current_adk_session_id, errors
 
-__all__ = ['ensure_adk_session']  
\ No newline at end of file
+
+CHAT_ADK_SESSIONS_FIELD = "adkSessions"
+
+
+def _chat_agent_sessions_path(agent_id: str) -> str:
+    return firestore.FieldPath(CHAT_ADK_SESSIONS_FIELD, agent_id).to_api_repr()
+
+
+def _chat_session_binding_path(agent_id: str, head_message_id: str) -> str:
+    return firestore.FieldPath(CHAT_ADK_SESSIONS_FIELD, agent_id, head_message_id).to_api_repr()
+
+
+async def claim_chat_adk_session(
+        chat_id: str,
+        agent_id: str,
+        adk_user_id: str,
+        conversation_history: list
+) -> tuple[str | None, int]:
+    """
+    Finds an ADK session that already holds the conversation up to a message of the current branch.
+
+    Sessions are stored on the chat document as adkSessions.{agentId}.{headMessageId}, where the
+    head is the last assistant message the session has seen. The deepest head found in
+    conversation_history wins. The binding is removed in the same transaction so that two
+    branches continuing from the same message never share (and corrupt) one session; the
+    losing branch simply starts a new session.
+
+    Returns:
+        A tuple (adk_session_id, head_index). head_index is the position of the head message in
+        conversation_history; only the messages after it need to be sent. (None, -1) if no
+        session can be reused.
+    """
+    async_db = get_async_db()
+    chat_ref = async_db.collection("chats").document(chat_id)
+    history_index_by_id = {msg.get("id"): idx for idx, msg in enumerate(conversation_history) if msg.get("id")}
+    if not history_index_by_id:
+        return None, -1
+
+    @firestore.async_transactional
+    async def _claim_in_transaction(transaction):
+        chat_snap = await chat_ref.get(field_paths=[_chat_agent_sessions_path(agent_id)], transaction=transaction)
+        if not chat_snap.exists:
+            return None, -1
+        agent_bindings = ((chat_snap.to_dict() or {}).get(CHAT_ADK_SESSIONS_FIELD) or {}).get(agent_id) or {}
+
+        best_head_id, best_index = None, -1
+        for head_message_id, binding in agent_bindings.items():
+            head_index = history_index_by_id.get(head_message_id, -1)
+            if head_index > best_index and binding.get("sessionId") and binding.get("adkUserId") == adk_user_id:
+                best_head_id, best_index = head_message_id, head_index
+        if best_head_id is None:
+            return None, -1
+
+        transaction.update(chat_ref, {_chat_session_binding_path(agent_id, best_head_id): firestore.DELETE_FIELD})
+        return agent_bindings[best_head_id]["sessionId"], best_index
+
+    try:
+        adk_session_id, head_index = await _claim_in_transaction(async_db.transaction())
+    except Exception as e_claim:
+        logger.warn(f"[SessionManager] Could not claim ADK session for chat '{chat_id}', agent '{agent_id}': {e_claim}. A new session will be created.")
+        return None, -1
+
+    if adk_session_id:
+        logger.info(f"[SessionManager] Reusing ADK session '{adk_session_id}' for chat '{chat_id}', agent '{agent_id}' (head at history index {head_index} of {len(conversation_history)}).")
+    return adk_session_id, head_index
+
+
+async def bind_chat_adk_session(
+        chat_id: str,
+        agent_id: str,
+        head_message_id: str,
+        adk_session_id: str,
+        adk_user_id: str
+) -> None:
+    """Records that adk_session_id now holds the conversation up to head_message_id."""
+    try:
+        await get_async_db().collection("chats").document(chat_id).update({
+            _chat_session_binding_path(agent_id, head_message_id): {
+                "sessionId": adk_session_id,
+                "adkUserId": adk_user_id,
+                "updatedAt": firestore.SERVER_TIMESTAMP
+            }
+        })
+        logger.info(f"[SessionManager] Bound ADK session '{adk_session_id}' to head message '{head_message_id}' in chat '{chat_id}'.")
+    except Exception as e_bind:
+        logger.warn(f"[SessionManager] Could not bind ADK session '{adk_session_id}' for chat '{chat_id}': {e_bind}. The next turn will start a new session.")
+
+
+__all__ = ['ensure_adk_session', 'claim_chat_adk_session', 'bind_chat_adk_session']  
\ No newline at end of file
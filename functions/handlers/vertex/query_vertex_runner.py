@@ -2,20 +2,20 @@
 import asyncio
 import traceback
 import time # Ensure time is imported
-from firebase_admin import firestore
 from common.core import logger
 from vertexai.preview.reasoning_engines import ReasoningEngine
+from .query_event_sink import FirestoreEventSink
 
 def _run_vertex_stream_query_sync(
         remote_app: ReasoningEngine,
         message_text: str,
         adk_user_id: str,
         current_adk_session_id: str,
-        run_doc_ref # Firestore document reference
+        event_sink: FirestoreEventSink
 ) -> tuple[str, list, bool, int]:
     """
     Synchronously runs the stream_query method on the remote Vertex AI agent
-    and writes events directly to a Firestore document.
+    and hands each event to the event sink, which batches the Firestore writes.
     """
     accumulated_text_response = ""
     query_errors_from_stream = []
@@ -23,7 +23,7 @@ def _run_vertex_stream_query_sync(
     event_count = 0
     stream_start_time = time.monotonic()
 
-    logger.info(f"[VertexRunner/Sync] Starting stream_query for Session: {current_adk_session_id}, writing to run doc: {run_doc_ref.id}")
+    logger.info(f"[VertexRunner/Sync] Starting stream_query for Session: {current_adk_session_id}, writing to run doc: {event_sink.doc_ref.id}")
 
     try:
         for event_idx, event_obj in enumerate(remote_app.stream_query(
@@ -40,7 +40,7 @@ def _run_vertex_stream_query_sync(
                 event_data_dict = event_obj
             else:
                 logger.error(f"[VertexRunner/Sync] Unexpected event type for event {event_count}: {type(event_obj)}. Skipping.")
-                run_doc_ref.update({"outputEvents": firestore.ArrayUnion([{"type": "unknown_event_format", "raw": str(event_obj)}])})
+                event_sink.add({"type": "unknown_event_format", "raw": str(event_obj)})
                 continue
 
             event_type = event_data_dict.get("type")
@@ -60,14 +60,8 @@ def _run_vertex_stream_query_sync(
                     logger.warn(f"[VertexRunner/Sync] Could not infer event type for event {event_count}: {e_infer}")
                 event_data_dict["type"] = inferred_type
 
-                # Write event to Firestore document
-            try:
-                # CORRECTED
-                run_doc_ref.update({"outputEvents": firestore.ArrayUnion([event_data_dict])})
-            except Exception as e_firestore_update:
-                logger.error(f"[VertexRunner/Sync] Failed to write event {event_count} to Firestore for run {run_doc_ref.id}: {e_firestore_update}")
-                query_errors_from_stream.append(f"Firestore write error for event {event_count}: {str(e_firestore_update)[:150]}")
-                stream_had_exceptions = True
+                # Queue event for the next batched Firestore write
+            event_sink.add(event_data_dict)
 
             content = event_data_dict.get("content")
             if content and isinstance(content, dict):
@@ -76,6 +70,7 @@ def _run_vertex_stream_query_sync(
                     for part in parts:
                         if 'text' in part and isinstance(part['text'], str):
                             accumulated_text_response += part['text']
+                    event_sink.set_partial_content(accumulated_text_response)
 
             if event_data_dict.get('error_message'):
                 error_msg = f"Error in event stream from Vertex (event {event_count}): {event_data_dict['error_message']}"
@@ -89,6 +84,11 @@ def _run_vertex_stream_query_sync(
         query_errors_from_stream.append(f"Agent stream query error (sync wrapper): {str(e_stream_query)[:200]}")
         stream_had_exceptions = True
     finally:
+        # Flush whatever is still buffered, on completion as well as on error
+        event_sink.close()
+        if event_sink.errors:
+            query_errors_from_stream.extend(event_sink.errors)
+            stream_had_exceptions = True
         stream_duration = time.monotonic() - stream_start_time
         logger.info(f"[VertexRunner/Sync] stream_query finished for Session: {current_adk_session_id}. Events: {event_count}, Duration: {stream_duration:.2f}s, Exceptions: {stream_had_exceptions}")
 
@@ -99,7 +99,7 @@ async def run_vertex_stream_query(
         message_text: str,
         adk_user_id: str,
         current_adk_session_id: str,
-        run_doc_ref
+        event_sink: FirestoreEventSink
 ) -> tuple[str, list, bool, int]:
     """
     Asynchronously runs the stream_query by dispatching the synchronous call to a thread.
@@ -112,7 +112,7 @@ async def run_vertex_stream_query(
             message_text,
             adk_user_id,
             current_adk_session_id,
-            run_doc_ref
+            event_sink
         )
         logger.debug(f"[VertexRunner/Async] Threaded stream_query for session '{current_adk_session_id}' completed. Events: {num_events}, Exceptions: {had_exceptions}")
         return final_text_response, query_errors, had_exceptions, num_events
@@ -1,5 +1,6 @@
 # functions/handlers/vertex/task_handler.py
 import asyncio
+import random
 import traceback
 import json
 import uuid  # Import uuid to generate message IDs
@@ -9,10 +10,22 @@ from google.cloud import tasks_v2
 from firebase_admin import firestore
 from firebase_functions import https_fn
 
-from common.core import db, logger
-from common.config import get_gcp_project_config
+from common.core import db, get_async_db, logger
+from common.config import (
+    get_gcp_project_config,
+    EVENT_STORAGE_MODE,
+    MODEL_RUN_SSE_STREAMING,
+    MODEL_RUNNER_CACHE_MAX_ENTRIES,
+    MODEL_RUNNER_CACHE_TTL_SEC,
+    RATE_LIMIT_MAX_DEFERRALS
+)
+from common.cache import TTLCache
 from common.utils import initialize_vertex_ai
-from common.adk_helpers import instantiate_adk_agent_from_config
+from common.adk_helpers import instantiate_adk_agent_from_config, get_model_config_from_firestore
+from common.rate_limiter import RateLimitDeferred, resolve_rate_limit_spec, estimate_request_tokens, rate_limited_call
+from common.task_queue import enqueue_function_task
+from common.worker_runtime import run_in_worker_loop, get_vertex_session_service, get_agent_engine
+from common.a2a_transport import get_a2a_client
 
 # NEW import for A2A client logic
 import httpx
@@ -21,34 +34,95 @@ from a2a.types import Message as A2AMessage, TextPart
 
 from .query_utils import get_reasoning_engine_id_from_name
 from .query_log_fetcher import fetch_vertex_logs_for_query
-from .query_session_manager import ensure_adk_session
+from .query_session_manager import ensure_adk_session, claim_chat_adk_session, bind_chat_adk_session
 from .query_vertex_runner import run_vertex_stream_query
-from .query_local_diagnostics import try_local_diagnostic_run
-from vertexai.agent_engines import get as get_engine
-from google.adk.sessions import VertexAiSessionService
+from .query_event_sink import FirestoreEventSink
+from .query_history_window import build_windowed_history_text, resolve_history_model_config
+from .query_response_cache import (
+    is_response_cache_eligible,
+    response_cache_key,
+    get_cached_response,
+    store_cached_response,
+    replay_cached_response
+)
 from google.genai.types import Content, Part
 
 
+# Warm-instance cache of (agent, runner) for model chats, keyed by modelId and versioned by the
+# model document's update_time.
+_model_runner_cache = TTLCache("ModelRunners", max_entries=MODEL_RUNNER_CACHE_MAX_ENTRIES, ttl_sec=MODEL_RUNNER_CACHE_TTL_SEC)
+
+# Only the fields needed to rebuild a prompt are read; run payloads (outputEvents etc.) are skipped.
+HISTORY_MESSAGE_FIELDS = ["content", "participant", "parentMessageId", "ancestorPath"]
+HISTORY_GET_ALL_CHUNK_SIZE = 100
+
+async def _prefetch_history_messages(messages_collection, message_ids: list, messages_by_id: dict):
+    """Loads the given messages with the history field mask using concurrent, batched get_all calls."""
+    async_db = get_async_db()
+    missing_ids = [msg_id for msg_id in dict.fromkeys(message_ids) if msg_id and msg_id not in messages_by_id]
+
+    async def _fetch_chunk(chunk_ids: list):
+        chunk_refs = [messages_collection.document(msg_id) for msg_id in chunk_ids]
+        async for snap in async_db.get_all(chunk_refs, field_paths=HISTORY_MESSAGE_FIELDS):
+            if snap.exists:
+                messages_by_id[snap.id] = {**snap.to_dict(), "id": snap.id}
+
+    await asyncio.gather(*[
+        _fetch_chunk(missing_ids[chunk_start:chunk_start + HISTORY_GET_ALL_CHUNK_SIZE])
+        for chunk_start in range(0, len(missing_ids), HISTORY_GET_ALL_CHUNK_SIZE)
+    ])
+
 async def get_full_message_history(chat_id, leaf_message_id):
-    """Reconstructs the conversation history leading up to a specific message."""
-    messages = {}
-    messages_collection = db.collection("chats").document(chat_id).collection("messages")
-    docs = messages_collection.stream()
-    for doc in docs:
-        messages[doc.id] = doc.to_dict()
+    """
+    Reconstructs the conversation history leading up to a specific message.
 
+    Only the leaf's ancestor chain is read. Parent links are followed one document at a
+    time until a message carrying a materialized 'ancestorPath' (written by the orchestrator)
+    is found; the remaining ancestors are then fetched with batched get_all calls.
+    Cost grows with the depth of the branch rather than the size of the chat.
+    """
+    messages_collection = get_async_db().collection("chats").document(chat_id).collection("messages")
+    messages_by_id = {}
     history = []
+    visited_ids = set()
     current_id = leaf_message_id
-    while current_id and current_id in messages:
-        message = messages[current_id]
-        history.insert(0, message)
+    while current_id and current_id not in visited_ids:
+        visited_ids.add(current_id)
+        if current_id not in messages_by_id:
+            snap = await messages_collection.document(current_id).get(field_paths=HISTORY_MESSAGE_FIELDS)
+            if not snap.exists:
+                break
+            messages_by_id[current_id] = {**snap.to_dict(), "id": snap.id}
+            ancestor_path = messages_by_id[current_id].get("ancestorPath")
+            if isinstance(ancestor_path, list) and ancestor_path:
+                await _prefetch_history_messages(messages_collection, ancestor_path, messages_by_id)
+
+        message = messages_by_id[current_id]
+        history.append(message)
         current_id = message.get("parentMessageId")
+
+    history.reverse()
+    logger.info(f"[TaskExecutor] Loaded {len(history)} ancestor message(s) for leaf {leaf_message_id} in chat {chat_id}.")
     return history
 
+def _create_run_event_sink(assistant_message_ref, assistant_message_data: dict, array_field_path: str, log_prefix: str) -> FirestoreEventSink:
+    """Creates the event sink for a run using the configured EVENT_STORAGE_MODE."""
+    events_summary = (assistant_message_data.get("run") or {}).get("eventsSummary") or {}
+    last_seq = events_summary.get("lastSeq")
+    # Continue numbering after events written by a previous (retried) attempt of this task.
+    start_seq = last_seq + 1 if isinstance(last_seq, int) else 0
+    return FirestoreEventSink(
+        assistant_message_ref,
+        field_path=array_field_path,
+        log_prefix=log_prefix,
+        storage_mode=EVENT_STORAGE_MODE,
+        start_seq=start_seq
+    )
+
 async def _run_a2a_agent_unary(
         participant_config: dict,
         message_content_for_agent: str,
-        assistant_message_ref
+        event_sink: FirestoreEventSink
 ):
     """
     Handles the logic for a non-streaming A2A agent using a single
@@ -79,49 +153,49 @@ async def _run_a2a_agent_unary(
     final_text = ""
     rpc_endpoint_url = endpoint_url.rstrip('/')
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        try:
-            response = await client.post(rpc_endpoint_url, json=send_request_payload)
-            logger.info(f"[A2AExecutor/Unary] Received response from 'message/send' with status {response.status_code}.")
-            response.raise_for_status()
-
-            rpc_response = response.json()
-            task_result = rpc_response.get("result")
-            logger.debug(f"[A2AExecutor/Unary] Full task object from unary response: {json.dumps(task_result, indent=2)}")
-
-            if not task_result:
-                if rpc_response.get("error"):
-                    err_msg = f"A2A 'message/send' returned an error: {rpc_response['error']}"
-                    logger.error(f"[A2AExecutor/Unary] {err_msg}")
-                    errors.append(err_msg)
-            else:
-                # Log the final task object to Firestore
-                final_task_event = {"type": "a2a_unary_task_result", "source_event": task_result}
-                assistant_message_ref.update({"run.outputEvents": firestore.ArrayUnion([final_task_event])})
-
-                # Extract final text from the artifacts in the task object
-                for artifact in task_result.get("artifacts", []):
-                    for part in artifact.get("parts", []):
-                        text_part = part.get("text") or part.get("text-delta")
-                        if text_part:
-                            final_text += text_part
-                logger.info(f"[A2AExecutor/Unary] Extracted final text: '{final_text[:150]}...'")
-
-        except httpx.HTTPStatusError as e:
-            error_msg = f"A2A 'message/send' returned an error: {e.response.status_code} - {e.response.text[:200]}"
-            logger.error(f"[A2AExecutor/Unary] {error_msg}")
-            errors.append(error_msg)
-        except Exception as e:
-            error_msg = f"Failed to communicate with non-streaming A2A agent: {str(e)}"
-            logger.error(f"[A2AExecutor/Unary] {error_msg}\n{traceback.format_exc()}")
-            errors.append(error_msg)
+    client = get_a2a_client(rpc_endpoint_url)
+    try:
+        response = await client.post(rpc_endpoint_url, json=send_request_payload)
+        logger.info(f"[A2AExecutor/Unary] Received response from 'message/send' with status {response.status_code}.")
+        response.raise_for_status()
+
+        rpc_response = response.json()
+        task_result = rpc_response.get("result")
+        logger.debug(f"[A2AExecutor/Unary] Full task object from unary response: {json.dumps(task_result, indent=2)}")
+
+        if not task_result:
+            if rpc_response.get("error"):
+                err_msg = f"A2A 'message/send' returned an error: {rpc_response['error']}"
+                logger.error(f"[A2AExecutor/Unary] {err_msg}")
+                errors.append(err_msg)
+        else:
+            # Log the final task object to Firestore
+            final_task_event = {"type": "a2a_unary_task_result", "source_event": task_result}
+            event_sink.add(final_task_event)
+
+            # Extract final text from the artifacts in the task object
+            for artifact in task_result.get("artifacts", []):
+                for part in artifact.get("parts", []):
+                    text_part = part.get("text") or part.get("text-delta")
+                    if text_part:
+                        final_text += text_part
+            logger.info(f"[A2AExecutor/Unary] Extracted final text: '{final_text[:150]}...'")
+
+    except httpx.HTTPStatusError as e:
+        error_msg = f"A2A 'message/send' returned an error: {e.response.status_code} - {e.response.text[:200]}"
+        logger.error(f"[A2AExecutor/Unary] {error_msg}")
+        errors.append(error_msg)
+    except Exception as e:
+        error_msg = f"Failed to communicate with non-streaming A2A agent: {str(e)}"
+        logger.error(f"[A2AExecutor/Unary] {error_msg}\n{traceback.format_exc()}")
+        errors.append(error_msg)
 
     return {"finalResponseText": final_text, "queryErrorDetails": errors}
 
 async def _run_a2a_agent_stream(
         participant_config: dict,
         message_content_for_agent: str,
-        assistant_message_ref
+        event_sink: FirestoreEventSink
 ):
     """
     Handles the logic for a streaming A2A agent, implementing the two-step
@@ -148,113 +222,114 @@ async def _run_a2a_agent_stream(
     task_completed_in_stream = False
     rpc_endpoint_url = endpoint_url.rstrip('/')
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        # STEP 1: Initiate `message/stream`
-        stream_request_payload = {
-            "jsonrpc": "2.0",
-            "method": "message/stream",
-            "id": f"agentlab-stream-{uuid.uuid4().hex}",
-            "params": {
-                "message": a2a_message.model_dump(exclude_none=True)
-            }
+    client = get_a2a_client(rpc_endpoint_url)
+    # STEP 1: Initiate `message/stream`
+    stream_request_payload = {
+        "jsonrpc": "2.0",
+        "method": "message/stream",
+        "id": f"agentlab-stream-{uuid.uuid4().hex}",
+        "params": {
+            "message": a2a_message.model_dump(exclude_none=True)
         }
+    }
 
+    try:
+        logger.info(f"[A2AExecutor/Stream] Sending 'message/stream' RPC to {rpc_endpoint_url}")
+        async with client.stream("POST", rpc_endpoint_url, json=stream_request_payload, headers={"Accept": "text/event-stream"}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    try:
+                        event_json_str = line[len("data:"):].strip()
+                        rpc_response = json.loads(event_json_str)
+
+                        event_data = rpc_response.get("result", rpc_response)
+                        logger.debug(f"[A2AExecutor/Stream] Processing stream event: {event_data}")
+
+                        if not isinstance(event_data, dict):
+                            if rpc_response.get("error"):
+                                err_msg = f"A2A stream returned an error: {rpc_response['error']}"
+                                logger.error(f"[A2AExecutor/Stream] {err_msg}")
+                                errors.append(err_msg)
+                            continue
+
+                        adk_like_event = {"type": "a2a_stream_event", "source_event": event_data}
+                        event_sink.add(adk_like_event)
+
+                        # Extract `task_id` and update state
+                        new_task_id = None
+                        if "task_id" in event_data: new_task_id = event_data["task_id"]
+                        elif event_data.get("kind") == "task" and "id" in event_data: new_task_id = event_data["id"]
+                        if new_task_id and task_id != new_task_id:
+                            task_id = new_task_id
+                            logger.info(f"[A2AExecutor/Stream] Captured task_id: {task_id}")
+
+                        event_kind = event_data.get("kind")
+                        if event_kind == "artifact-update" and event_data.get("artifact"):
+                            for part in event_data["artifact"].get("parts", []):
+                                text_part = part.get("text") or part.get("text-delta")
+                                if text_part: final_text += text_part
+                            event_sink.set_partial_content(final_text)
+
+                        if event_kind == "status-update" and event_data.get("status", {}).get("state") == "completed":
+                            logger.info(f"[A2AExecutor/Stream] Task '{task_id}' completed within the stream.")
+                            task_completed_in_stream = True
+
+                    except json.JSONDecodeError:
+                        logger.warn(f"[A2AExecutor/Stream] Could not decode JSON from event line: {line}")
+                    except Exception as e_event_proc:
+                        logger.error(f"[A2AExecutor/Stream] Error processing event: {e_event_proc}")
+                        errors.append(f"Error processing A2A event: {str(e_event_proc)}")
+
+        logger.info(f"[A2AExecutor/Stream] Stream finished. Task ID: {task_id}, Completed in stream: {task_completed_in_stream}")
+
+    except httpx.HTTPStatusError as e:
+        error_msg = f"A2A 'message/stream' returned an error: {e.response.status_code} - {e.response.text[:200]}"
+        logger.error(f"[A2AExecutor/Stream] {error_msg}")
+        errors.append(error_msg)
+    except Exception as e:
+        error_msg = f"Failed to communicate with A2A agent during stream: {str(e)}"
+        logger.error(f"[A2AExecutor/Stream] {error_msg}\n{traceback.format_exc()}")
+        errors.append(error_msg)
+
+        # STEP 2: Conditionally fetch the final result with `task/get`
+    if task_id and not task_completed_in_stream:
+        logger.info(f"[A2AExecutor/Stream] Task incomplete. Making 'task/get' call for ID: {task_id}")
+        get_task_payload = { "jsonrpc": "2.0", "method": "task/get", "id": f"agentlab-get-task-{uuid.uuid4().hex}", "params": {"id": task_id} }
         try:
-            logger.info(f"[A2AExecutor/Stream] Sending 'message/stream' RPC to {rpc_endpoint_url}")
-            async with client.stream("POST", rpc_endpoint_url, json=stream_request_payload, headers={"Accept": "text/event-stream"}) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line.startswith("data:"):
-                        try:
-                            event_json_str = line[len("data:"):].strip()
-                            rpc_response = json.loads(event_json_str)
-
-                            event_data = rpc_response.get("result", rpc_response)
-                            logger.debug(f"[A2AExecutor/Stream] Processing stream event: {event_data}")
-
-                            if not isinstance(event_data, dict):
-                                if rpc_response.get("error"):
-                                    err_msg = f"A2A stream returned an error: {rpc_response['error']}"
-                                    logger.error(f"[A2AExecutor/Stream] {err_msg}")
-                                    errors.append(err_msg)
-                                continue
-
-                            adk_like_event = {"type": "a2a_stream_event", "source_event": event_data}
-                            assistant_message_ref.update({"run.outputEvents": firestore.ArrayUnion([adk_like_event])})
-
-                            # Extract `task_id` and update state
-                            new_task_id = None
-                            if "task_id" in event_data: new_task_id = event_data["task_id"]
-                            elif event_data.get("kind") == "task" and "id" in event_data: new_task_id = event_data["id"]
-                            if new_task_id and task_id != new_task_id:
-                                task_id = new_task_id
-                                logger.info(f"[A2AExecutor/Stream] Captured task_id: {task_id}")
-
-                            event_kind = event_data.get("kind")
-                            if event_kind == "artifact-update" and event_data.get("artifact"):
-                                for part in event_data["artifact"].get("parts", []):
-                                    text_part = part.get("text") or part.get("text-delta")
-                                    if text_part: final_text += text_part
-
-                            if event_kind == "status-update" and event_data.get("status", {}).get("state") == "completed":
-                                logger.info(f"[A2AExecutor/Stream] Task '{task_id}' completed within the stream.")
-                                task_completed_in_stream = True
-
-                        except json.JSONDecodeError:
-                            logger.warn(f"[A2AExecutor/Stream] Could not decode JSON from event line: {line}")
-                        except Exception as e_event_proc:
-                            logger.error(f"[A2AExecutor/Stream] Error processing event: {e_event_proc}")
-                            errors.append(f"Error processing A2A event: {str(e_event_proc)}")
-
-            logger.info(f"[A2AExecutor/Stream] Stream finished. Task ID: {task_id}, Completed in stream: {task_completed_in_stream}")
+            get_response = await client.post(rpc_endpoint_url, json=get_task_payload)
+            get_response.raise_for_status()
+
+            rpc_response = get_response.json()
+            task_result = rpc_response.get("result")
+            logger.debug(f"[A2AExecutor/Stream] Full task object from 'task/get' response: {json.dumps(task_result, indent=2)}")
+
+            if not task_result:
+                if rpc_response.get("error"):
+                    err_msg = f"A2A 'task/get' returned an error: {rpc_response['error']}"
+                    logger.error(f"[A2AExecutor/Stream] {err_msg}")
+                    errors.append(err_msg)
+            else:
+                final_task_event = {"type": "a2a_final_task_get", "source_event": task_result}
+                event_sink.add(final_task_event)
+
+                for artifact in task_result.get("artifacts", []):
+                    for part in artifact.get("parts", []):
+                        text_part = part.get("text") or part.get("text-delta")
+                        if text_part and text_part not in final_text:
+                            final_text += text_part
+                logger.info(f"[A2AExecutor/Stream] Extracted final text from 'task/get' response: '{final_text[:150]}...'")
 
         except httpx.HTTPStatusError as e:
-            error_msg = f"A2A 'message/stream' returned an error: {e.response.status_code} - {e.response.text[:200]}"
+            error_msg = f"A2A 'task/get' returned an error: {e.response.status_code} - {e.response.text[:200]}"
             logger.error(f"[A2AExecutor/Stream] {error_msg}")
             errors.append(error_msg)
         except Exception as e:
-            error_msg = f"Failed to communicate with A2A agent during stream: {str(e)}"
+            error_msg = f"Failed to get final task result from A2A agent: {str(e)}"
             logger.error(f"[A2AExecutor/Stream] {error_msg}\n{traceback.format_exc()}")
             errors.append(error_msg)
-
-            # STEP 2: Conditionally fetch the final result with `task/get`
-        if task_id and not task_completed_in_stream:
-            logger.info(f"[A2AExecutor/Stream] Task incomplete. Making 'task/get' call for ID: {task_id}")
-            get_task_payload = { "jsonrpc": "2.0", "method": "task/get", "id": f"agentlab-get-task-{uuid.uuid4().hex}", "params": {"id": task_id} }
-            try:
-                get_response = await client.post(rpc_endpoint_url, json=get_task_payload)
-                get_response.raise_for_status()
-
-                rpc_response = get_response.json()
-                task_result = rpc_response.get("result")
-                logger.debug(f"[A2AExecutor/Stream] Full task object from 'task/get' response: {json.dumps(task_result, indent=2)}")
-
-                if not task_result:
-                    if rpc_response.get("error"):
-                        err_msg = f"A2A 'task/get' returned an error: {rpc_response['error']}"
-                        logger.error(f"[A2AExecutor/Stream] {err_msg}")
-                        errors.append(err_msg)
-                else:
-                    final_task_event = {"type": "a2a_final_task_get", "source_event": task_result}
-                    assistant_message_ref.update({"run.outputEvents": firestore.ArrayUnion([final_task_event])})
-
-                    for artifact in task_result.get("artifacts", []):
-                        for part in artifact.get("parts", []):
-                            text_part = part.get("text") or part.get("text-delta")
-                            if text_part and text_part not in final_text:
-                                final_text += text_part
-                    logger.info(f"[A2AExecutor/Stream] Extracted final text from 'task/get' response: '{final_text[:150]}...'")
-
-            except httpx.HTTPStatusError as e:
-                error_msg = f"A2A 'task/get' returned an error: {e.response.status_code} - {e.response.text[:200]}"
-                logger.error(f"[A2AExecutor/Stream] {error_msg}")
-                errors.append(error_msg)
-            except Exception as e:
-                error_msg = f"Failed to get final task result from A2A agent: {str(e)}"
-                logger.error(f"[A2AExecutor/Stream] {error_msg}\n{traceback.format_exc()}")
-                errors.append(error_msg)
-        elif not task_id:
-            logger.warn(f"[A2AExecutor/Stream] No task_id was captured from the A2A stream. Cannot fetch final result.")
+    elif not task_id:
+        logger.warn(f"[A2AExecutor/Stream] No task_id was captured from the A2A stream. Cannot fetch final result.")
 
     return {"finalResponseText": final_text, "queryErrorDetails": errors}
 
@@ -264,21 +339,54 @@ async def _execute_and_stream_to_firestore(
         assistant_message_id: str,
         agent_id: str | None,
         model_id: str | None,
-        adk_user_id: str
+        adk_user_id: str,
+        parent_message_id: str | None = None,
+        enforce_rate_limits: bool = True
 ):
     """
     Orchestrates querying a deployed Vertex AI agent OR a model OR an A2A agent, streaming events to Firestore.
+
+    Firestore reads go through the async client. When the task payload carries the parent message ID,
+    the assistant message, the participant config and the history are loaded concurrently.
+
+    Model and Vertex agent calls are admitted by the provider rate limiter first; when capacity is
+    further away than RATE_LIMIT_MAX_INLINE_WAIT_SEC, RateLimitDeferred is raised before anything
+    is written to the message.
     """
+    async_db = get_async_db()
+    # The event sink flushes from its own thread and keeps using the sync client.
     assistant_message_ref = db.collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
-    assistant_message_snap = assistant_message_ref.get()
+    async_assistant_message_ref = async_db.collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
+
+    # Determine participant config (agent or model)
+    if agent_id:
+        participant_config_ref = async_db.collection("agents").document(agent_id)
+    elif model_id:
+        participant_config_ref = async_db.collection("models").document(model_id)
+    else: # Should not happen due to orchestrator validation
+        raise ValueError("Task requires either agentId or modelId")
+
+    if parent_message_id:
+        assistant_message_snap, participant_snap, conversation_history = await asyncio.gather(
+            async_assistant_message_ref.get(),
+            participant_config_ref.get(),
+            get_full_message_history(chat_id, parent_message_id)
+        )
+    else:
+        # Tasks enqueued before the payload carried parentMessageId: the history depends on the message.
+        assistant_message_snap, participant_snap = await asyncio.gather(
+            async_assistant_message_ref.get(),
+            participant_config_ref.get()
+        )
+        conversation_history = None
+
     if not assistant_message_snap.exists:
         logger.error(f"[TaskExecutor] Assistant message {assistant_message_id} not found. Aborting task.")
         return
 
     assistant_message_data = assistant_message_snap.to_dict()
-    parent_message_id = assistant_message_data.get("parentMessageId")
-
-    conversation_history = await get_full_message_history(chat_id, parent_message_id)
+    if conversation_history is None:
+        conversation_history = await get_full_message_history(chat_id, assistant_message_data.get("parentMessageId"))
 
     # --- START OF FIX ---
     stuffed_context_items = assistant_message_data.get("run", {}).get("stuffedContextItems")
@@ -298,15 +406,6 @@ async def _execute_and_stream_to_firestore(
 
     project_id, location, _ = get_gcp_project_config()
 
-    # Determine participant config (agent or model)
-    if agent_id:
-        participant_config_ref = db.collection("agents").document(agent_id)
-    elif model_id:
-        participant_config_ref = db.collection("models").document(model_id)
-    else: # Should not happen due to orchestrator validation
-        raise ValueError("Task requires either agentId or modelId")
-
-    participant_snap = participant_config_ref.get()
     if not participant_snap.exists:
         raise ValueError(f"Participant config not found for ID: {agent_id or model_id}")
     participant_config = participant_snap.to_dict()
@@ -325,77 +424,191 @@ async def _execute_and_stream_to_firestore(
         agent_capabilities = participant_config.get("agentCard", {}).get("capabilities", {})
         is_streaming = agent_capabilities.get("streaming", False)
 
-        if is_streaming:
-            logger.info("[A2AExecutor/Dispatch] Determined agent protocol: Streaming. Calling stream handler.")
-            return await _run_a2a_agent_stream(participant_config, final_a2a_message_content, assistant_message_ref)
-        else:
-            logger.info("[A2AExecutor/Dispatch] Determined agent protocol: Non-Streaming (Unary). Calling unary handler.")
-            return await _run_a2a_agent_unary(participant_config, final_a2a_message_content, assistant_message_ref)
+        event_sink = _create_run_event_sink(assistant_message_ref, assistant_message_data, "run.outputEvents", "[A2AExecutor/EventSink]")
+        try:
+            if is_streaming:
+                logger.info("[A2AExecutor/Dispatch] Determined agent protocol: Streaming. Calling stream handler.")
+                a2a_result = await _run_a2a_agent_stream(participant_config, final_a2a_message_content, event_sink)
+            else:
+                logger.info("[A2AExecutor/Dispatch] Determined agent protocol: Non-Streaming (Unary). Calling unary handler.")
+                a2a_result = await _run_a2a_agent_unary(participant_config, final_a2a_message_content, event_sink)
+        finally:
+            await asyncio.to_thread(event_sink.close)
+        a2a_result["queryErrorDetails"].extend(event_sink.errors)
+        return a2a_result
 
-            # For Vertex and Model runs, combine the full history with the context
-    full_message_text = "\n\n".join([msg.get("content", "") for msg in conversation_history if msg.get("content")])
-    final_message_for_agent = (context_string_prefix + full_message_text).strip()
+    # For Vertex and Model runs, send the recent history verbatim within the token budget and
+    # replace older turns with the chat's rolling summary.
+    history_model_config = await resolve_history_model_config(agent_id, model_id, participant_config)
 
     if agent_id: # Defaults to google_vertex
         resource_name = participant_config.get("vertexAiResourceName")
         if not resource_name or participant_config.get("deploymentStatus") != "deployed":
             raise ValueError(f"Agent {agent_id} is not successfully deployed.")
 
-        session_service = VertexAiSessionService(project=project_id, location=location)
-        current_adk_session_id, session_errors = await ensure_adk_session(
-            session_service, resource_name, adk_user_id, session_id_from_client=None # Sessions are managed by chat now
-        )
-
-        if not current_adk_session_id:
-            raise ValueError(f"Failed to establish ADK session: {session_errors}")
-
-        remote_app = get_engine(resource_name)
+        # Sessions are kept per chat branch: if this branch already has a session that holds the
+        # conversation up to an earlier assistant message, only the newer turns are sent.
+        claimed_session_id, session_head_index = await claim_chat_adk_session(chat_id, agent_id, adk_user_id, conversation_history)
 
-        final_text, errors, had_exceptions, num_events = await run_vertex_stream_query(
-            remote_app, final_message_for_agent, adk_user_id, current_adk_session_id, assistant_message_ref
-        )
-        return {"finalResponseText": final_text, "queryErrorDetails": errors}
+        current_adk_session_id = None
+        new_head_bound = False
+        try:
+            session_service = get_vertex_session_service(project_id, location)
+            current_adk_session_id, session_errors = await ensure_adk_session(
+                session_service, resource_name, adk_user_id, session_id_from_client=claimed_session_id
+            )
+
+            if not current_adk_session_id:
+                raise ValueError(f"Failed to establish ADK session: {session_errors}")
+
+            reusing_claimed_session = bool(claimed_session_id) and current_adk_session_id == claimed_session_id
+            if reusing_claimed_session:
+                new_turns = [msg.get("content", "") for msg in conversation_history[session_head_index + 1:] if msg.get("content")]
+                final_message_for_agent = (context_string_prefix + "\n\n".join(new_turns)).strip()
+            else:
+                # New branch, first turn, or the stored session has expired: seed it with the history.
+                full_message_text = await build_windowed_history_text(chat_id, conversation_history, history_model_config, enforce_rate_limits)
+                final_message_for_agent = (context_string_prefix + full_message_text).strip()
+
+            remote_app = await asyncio.to_thread(get_agent_engine, resource_name) # Cached per instance; first lookup is a blocking API call
+
+            # Deployed agents are limited by their root model's provider (composite agents have none).
+            rate_limit_spec = None
+            root_model_config = None
+            if enforce_rate_limits and participant_config.get("modelId"):
+                try:
+                    root_model_config = await get_model_config_from_firestore(participant_config["modelId"])
+                except ValueError as e_root_model:
+                    logger.warn(f"[RateLimiter] Could not load root model of agent {agent_id}: {e_root_model}. Running without a rate limit.")
+                rate_limit_spec = resolve_rate_limit_spec(root_model_config)
+
+            async with rate_limited_call(rate_limit_spec, estimate_request_tokens(final_message_for_agent, root_model_config)):
+                # The Vertex runner writes to the top-level 'outputEvents' field read by the chat UI.
+                event_sink = _create_run_event_sink(assistant_message_ref, assistant_message_data, "outputEvents", "[VertexRunner/EventSink]")
+                try:
+                    final_text, errors, had_exceptions, num_events = await run_vertex_stream_query(
+                        remote_app, final_message_for_agent, adk_user_id, current_adk_session_id, event_sink
+                    )
+                finally:
+                    await asyncio.to_thread(event_sink.close) # No-op if the runner already closed it
+            if not errors:
+                await bind_chat_adk_session(chat_id, agent_id, assistant_message_id, current_adk_session_id, adk_user_id)
+                new_head_bound = True
+            return {"finalResponseText": final_text, "queryErrorDetails": errors}
+        finally:
+            if claimed_session_id and not new_head_bound and current_adk_session_id in (None, claimed_session_id):
+                # The claim removed the branch's binding. Unless this run bound the new head, hand the
+                # session back at its original head (errors, deferrals and crashes alike) so the next
+                # attempt continues it instead of re-seeding a new session with the whole history.
+                await bind_chat_adk_session(chat_id, agent_id, conversation_history[session_head_index]["id"], claimed_session_id, adk_user_id)
 
     elif model_id:
-        # This is for ephemeral model execution.
-        model_only_agent_config = {
-            "name": f"ephemeral_model_run_{model_id[:6]}",
-            "agentType": "Agent",
-            "tools": [],
-            "modelId": model_id,
-        }
-
-        local_adk_agent = await instantiate_adk_agent_from_config(
-            model_only_agent_config,
-            parent_adk_name_for_context=f"model_run_{chat_id[:4]}"
-        )
-
-        from google.adk.runners import Runner
-        from google.adk.sessions import InMemorySessionService
-        from google.adk.artifacts import InMemoryArtifactService
-        from google.adk.memory import InMemoryMemoryService
+        full_message_text = await build_windowed_history_text(chat_id, conversation_history, history_model_config, enforce_rate_limits)
+        final_message_for_agent = (context_string_prefix + full_message_text).strip()
+
+        # Deterministic (temperature 0) runs of models that opted in are served from the response
+        # cache when the same model config already answered the same prompt.
+        cache_key = None
+        if is_response_cache_eligible(participant_config):
+            cache_key = response_cache_key(model_id, participant_config, final_message_for_agent)
+            cached_response = await get_cached_response(cache_key)
+            if cached_response is not None:
+                event_sink = _create_run_event_sink(assistant_message_ref, assistant_message_data, "run.outputEvents", "[ModelRunner/EventSink]")
+                try:
+                    final_text = replay_cached_response(cached_response, event_sink)
+                finally:
+                    await asyncio.to_thread(event_sink.close)
+                logger.info(f"[ModelRunner] Served model {model_id} response from cache (key {cache_key[:16]}).")
+                return {
+                    "finalResponseText": final_text,
+                    "queryErrorDetails": list(event_sink.errors),
+                    "responseCache": {"status": "hit", "key": cache_key[:16]}
+                }
+
+        from google.adk.agents.run_config import RunConfig, StreamingMode
+
+        # This is for ephemeral model execution. The agent and runner are stateless between turns
+        # (each turn gets its own in-memory session), so they are reused while the model doc is unchanged.
+        runner = _model_runner_cache.get(model_id, version=participant_snap.update_time)
+        if runner is None:
+            model_only_agent_config = {
+                "name": f"ephemeral_model_run_{model_id[:6]}",
+                "agentType": "Agent",
+                "tools": [],
+                "modelId": model_id,
+            }
 
-        runner = Runner(agent=local_adk_agent, app_name=local_adk_agent.name, session_service=InMemorySessionService(), artifact_service=InMemoryArtifactService(), memory_service=InMemoryMemoryService())
-        session = await runner.session_service.create_session(app_name=runner.app_name, user_id=adk_user_id)
+            local_adk_agent = await instantiate_adk_agent_from_config(
+                model_only_agent_config,
+                parent_adk_name_for_context=f"model_run_{model_id[:4]}",
+                model_configs={model_id: participant_config}, # Already read for this turn
+                use_llm_router=True # Pooled clients, retries and failover across the model's deployments
+            )
+
+            from google.adk.runners import Runner
+            from google.adk.sessions import InMemorySessionService
+            from google.adk.artifacts import InMemoryArtifactService
+            from google.adk.memory import InMemoryMemoryService
+
+            runner = Runner(agent=local_adk_agent, app_name=local_adk_agent.name, session_service=InMemorySessionService(), artifact_service=InMemoryArtifactService(), memory_service=InMemoryMemoryService())
+            _model_runner_cache.set(model_id, runner, version=participant_snap.update_time)
+            logger.info(f"[ModelRunner] Built and cached runner for model {model_id} (cache size: {len(_model_runner_cache)}).")
+        else:
+            logger.info(f"[ModelRunner] Reusing cached runner for model {model_id} (hits: {_model_runner_cache.hits}, misses: {_model_runner_cache.misses}).")
 
         message_content = Content(role="user", parts=[Part(text=final_message_for_agent)])
 
+        stream_responses = participant_config.get("streamResponses")
+        if not isinstance(stream_responses, bool):
+            stream_responses = MODEL_RUN_SSE_STREAMING
+        run_config = RunConfig(streaming_mode=StreamingMode.SSE if stream_responses else StreamingMode.NONE)
+        logger.info(f"[ModelRunner] Running model {model_id} with streaming mode: {run_config.streaming_mode}.")
+
         final_text = ""
+        streamed_delta_text = "" # Partial deltas since the last complete event
         errors = []
-        try:
-            async for event_obj in runner.run_async(user_id=adk_user_id, session_id=session.id, new_message=message_content):
-                event_dict = event_obj.model_dump()
-                assistant_message_ref.update({"run.outputEvents": firestore.ArrayUnion([event_dict])})
-                content = event_dict.get("content", {})
-                if content and content.get("parts"):
-                    for part in content["parts"]:
-                        if "text" in part:
-                            final_text += part["text"]
-        except Exception as e_model_run:
-            logger.error(f"Error during ephemeral model run for model {model_id}: {e_model_run}")
-            errors.append(f"Model run failed: {str(e_model_run)}")
-
-        return {"finalResponseText": final_text, "queryErrorDetails": errors}
+        completed_events = [] # Kept for the response cache
+        rate_limit_spec = resolve_rate_limit_spec(participant_config) if enforce_rate_limits else None
+        async with rate_limited_call(rate_limit_spec, estimate_request_tokens(final_message_for_agent, participant_config)):
+            session = await runner.session_service.create_session(app_name=runner.app_name, user_id=adk_user_id)
+            event_sink = _create_run_event_sink(assistant_message_ref, assistant_message_data, "run.outputEvents", "[ModelRunner/EventSink]")
+            try:
+                async for event_obj in runner.run_async(user_id=adk_user_id, session_id=session.id, new_message=message_content, run_config=run_config):
+                    event_dict = event_obj.model_dump()
+                    content = event_dict.get("content") or {}
+                    event_text = "".join(part["text"] for part in (content.get("parts") or []) if part.get("text"))
+
+                    if event_dict.get("partial"):
+                        # SSE deltas only feed the progressive write path; the complete event that
+                        # follows carries the aggregated text and is the one stored and counted.
+                        streamed_delta_text += event_text
+                        event_sink.set_partial_content(final_text + streamed_delta_text)
+                        continue
+
+                    event_sink.add(event_dict)
+                    if cache_key:
+                        completed_events.append(event_dict)
+                    streamed_delta_text = ""
+                    final_text += event_text
+                    event_sink.set_partial_content(final_text)
+            except Exception as e_model_run:
+                logger.error(f"Error during ephemeral model run for model {model_id}: {e_model_run}")
+                errors.append(f"Model run failed: {str(e_model_run)}")
+            finally:
+                await asyncio.to_thread(event_sink.close)
+                try:
+                    # The runner outlives this turn, so its in-memory session must not accumulate.
+                    await runner.session_service.delete_session(app_name=runner.app_name, user_id=adk_user_id, session_id=session.id)
+                except Exception as e_session_cleanup:
+                    logger.warn(f"[ModelRunner] Could not delete in-memory session {session.id}: {e_session_cleanup}")
+        errors.extend(event_sink.errors)
+
+        model_run_result = {"finalResponseText": final_text, "queryErrorDetails": errors}
+        if cache_key:
+            if not errors and final_text:
+                await store_cached_response(cache_key, model_id, completed_events, final_text)
+            model_run_result["responseCache"] = {"status": "miss", "key": cache_key[:16]}
+        return model_run_result
 
 
 async def _run_agent_task_logic(data: dict):
@@ -407,43 +620,71 @@ async def _run_agent_task_logic(data: dict):
     agent_id = data.get("agentId")
     model_id = data.get("modelId")
     adk_user_id = data.get("adkUserId")
+    parent_message_id = data.get("parentMessageId")
+    rate_limit_deferrals = int(data.get("rateLimitDeferrals") or 0)
 
     logger.info(f"[TaskHandler] Starting execution for message: {assistant_message_id}")
-    assistant_message_ref = db.collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
+    assistant_message_ref = get_async_db().collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
 
     try:
-        assistant_message_ref.update({"run.status": "running"})
+        await assistant_message_ref.update({"run.status": "running", "run.eventStorage": EVENT_STORAGE_MODE})
 
         final_state_data = await _execute_and_stream_to_firestore(
             chat_id=chat_id,
             assistant_message_id=assistant_message_id,
             agent_id=agent_id,
             model_id=model_id,
-            adk_user_id=adk_user_id
+            adk_user_id=adk_user_id,
+            parent_message_id=parent_message_id,
+            # A run that was requeued too often proceeds and relies on the provider-side retries.
+            enforce_rate_limits=rate_limit_deferrals < RATE_LIMIT_MAX_DEFERRALS
         )
 
         final_update_payload = {
             "content": final_state_data.get("finalResponseText", ""),
             "run.status": "error" if final_state_data.get("queryErrorDetails") else "completed",
             "run.finalResponseText": final_state_data.get("finalResponseText", ""),
+            "run.partialContent": firestore.DELETE_FIELD, # Superseded by 'content'
             "run.queryErrorDetails": final_state_data.get("queryErrorDetails"),
             "run.completedTimestamp": firestore.SERVER_TIMESTAMP
         }
+        if final_state_data.get("responseCache"):
+            final_update_payload["run.responseCache"] = final_state_data["responseCache"]
 
-        assistant_message_ref.update(final_update_payload)
+        await assistant_message_ref.update(final_update_payload)
         logger.info(f"[TaskHandler] Message {assistant_message_id} completed with status: {final_update_payload['run.status']}")
 
+    except RateLimitDeferred as e_deferred:
+        # Requeue instead of failing: the provider is at its limit, and a failed task would be
+        # retried by Cloud Tasks anyway, as a full run that counts against max_attempts.
+        retry_delay_sec = e_deferred.retry_after_sec + random.uniform(0, 2) # Jitter spreads out requeued bursts
+        await asyncio.to_thread(
+            enqueue_function_task,
+            "executeAgentRunTask",
+            {**data, "rateLimitDeferrals": rate_limit_deferrals + 1},
+            retry_delay_sec
+        )
+        await assistant_message_ref.update({
+            "run.status": "pending",
+            "run.rateLimit": {
+                "key": e_deferred.limit_key,
+                "deferrals": rate_limit_deferrals + 1,
+                "retryAfterSec": round(retry_delay_sec, 1)
+            }
+        })
+        logger.info(f"[TaskHandler] Message {assistant_message_id} deferred by rate limit '{e_deferred.limit_key}'; requeued in {retry_delay_sec:.1f}s.")
+
     except Exception as e:
         error_msg = f"Unhandled exception in task handler for message {assistant_message_id}: {type(e).__name__} - {e}"
         logger.error(f"{error_msg}\n{traceback.format_exc()}")
-        assistant_message_ref.update({
+        await assistant_message_ref.update({
             "run.status": "error",
             "run.queryErrorDetails": firestore.ArrayUnion([f"Task handler exception: {error_msg}"]),
             "run.completedTimestamp": firestore.SERVER_TIMESTAMP
         })
 
 def run_agent_task_wrapper(data: dict):
-    """Synchronous wrapper to run the async task logic."""
-    asyncio.run(_run_agent_task_logic(data))
+    """Synchronous wrapper that runs the async task logic on the instance's persistent worker loop."""
+    run_in_worker_loop(_run_agent_task_logic(data))
 
 __all__ = ['run_agent_task_wrapper']
\ No newline at end of file
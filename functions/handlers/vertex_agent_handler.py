@@ -4,13 +4,17 @@
 from .vertex.query_orchestrator import query_deployed_agent_orchestrator_logic
 
 # Import existing logic functions for deployment and management
-from .vertex.deployment_logic import _deploy_agent_to_vertex_logic
+from .vertex.deployment_logic import _deploy_agent_to_vertex_logic, run_agent_deploy_task_wrapper
 from .vertex.management_logic import _delete_vertex_agent_logic, _check_vertex_agent_deployment_status_logic
+from .vertex.fleet_logic import _fleet_agent_operation_logic, run_fleet_operation_task_wrapper
 
 # Re-export them to maintain the public interface for main.py
 __all__ = [
     '_deploy_agent_to_vertex_logic',
+    'run_agent_deploy_task_wrapper',
     '_delete_vertex_agent_logic',
     'query_deployed_agent_orchestrator_logic',
-    '_check_vertex_agent_deployment_status_logic'
+    '_check_vertex_agent_deployment_status_logic',
+    '_fleet_agent_operation_logic',
+    'run_fleet_operation_task_wrapper'
 ]  
\ No newline at end of file
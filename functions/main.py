@@ -5,17 +5,22 @@ from firebase_functions import https_fn, options, tasks_fn
 from firebase_functions.options import RateLimits, RetryConfig, TaskQueueOptions
 
 from common.utils import handle_exceptions_and_log
+from common.worker_runtime import run_in_worker_loop
 import asyncio # For running async logic from mcp_handler
 
 # Import the logic functions from their respective handlers
 from handlers.vertex_agent_handler import (
     _deploy_agent_to_vertex_logic,
+    run_agent_deploy_task_wrapper,
     _delete_vertex_agent_logic,
     query_deployed_agent_orchestrator_logic as _execute_query_logic, # Renamed import
-    _check_vertex_agent_deployment_status_logic
+    _check_vertex_agent_deployment_status_logic,
+    _fleet_agent_operation_logic,
+    run_fleet_operation_task_wrapper
 )
 from handlers.vertex.task_handler import run_agent_task_wrapper
-from handlers.gofannon_handler import _get_gofannon_tool_manifest_logic
+from handlers.gofannon_handler import _get_gofannon_tool_manifest_logic, MANIFEST_FILE_PATH
+from common.tool_registry import start_manifest_prewarm
 from handlers.context_handler import (
     _fetch_web_page_content_logic,
     _fetch_git_repo_contents_logic,
@@ -24,6 +29,10 @@ from handlers.context_handler import (
 from handlers.mcp_handler import _list_mcp_server_tools_logic_async
 from handlers.a2a_handler import _fetch_a2a_agent_card_logic_async
 
+# Pre-import Gofannon tool modules in the background so the first agent build on a cold
+# instance does not pay for them (only for the targets in TOOL_PREWARM_FUNCTION_TARGETS).
+start_manifest_prewarm(MANIFEST_FILE_PATH)
+
 # --- Cloud Function Definitions ---
 
 @https_fn.on_call(memory=options.MemoryOption.GB_1)
@@ -32,7 +41,7 @@ def get_gofannon_tool_manifest(req: https_fn.CallableRequest):
     return _get_gofannon_tool_manifest_logic(req)
 
 
-@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=540)
+@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60) # Fast dispatcher; the build runs in executeAgentDeployTask
 @handle_exceptions_and_log
 def deploy_agent_to_vertex(req: https_fn.CallableRequest):
     if not req.auth:
@@ -63,6 +72,14 @@ def check_vertex_agent_deployment_status(req: https_fn.CallableRequest):
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required to check agent status.")
     return _check_vertex_agent_deployment_status_logic(req)
 
+
+@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60) # Fast dispatcher; the work runs in executeFleetOperationTask
+@handle_exceptions_and_log
+def fleet_agent_operation(req: https_fn.CallableRequest):
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required for fleet operations.")
+    return _fleet_agent_operation_logic(req)
+
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60)
 @handle_exceptions_and_log
 def fetch_web_page_content(req: https_fn.CallableRequest):
@@ -82,14 +99,15 @@ def process_pdf_content(req: https_fn.CallableRequest):
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=120) # Increased timeout for potential network calls
 @handle_exceptions_and_log
 def list_mcp_server_tools(req: https_fn.CallableRequest):
-    # _list_mcp_server_tools_logic_async is async, so we need to run it in an event loop
-    return asyncio.run(_list_mcp_server_tools_logic_async(req))
+    # Runs on the worker loop so pooled MCP sessions survive between calls
+    return run_in_worker_loop(_list_mcp_server_tools_logic_async(req))
 
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60)
 @handle_exceptions_and_log
 def fetchA2AAgentCard(req: https_fn.CallableRequest):
     """Fetches the AgentCard from a remote A2A compliant agent endpoint."""
-    return asyncio.run(_fetch_a2a_agent_card_logic_async(req))
+    # Runs on the worker loop so the pooled A2A connections are reused by later calls and tasks.
+    return run_in_worker_loop(_fetch_a2a_agent_card_logic_async(req))
 
 # Task handler for executing queries in the background
 @tasks_fn.on_task_dispatched(
@@ -102,4 +120,27 @@ def fetchA2AAgentCard(req: https_fn.CallableRequest):
 def executeAgentRunTask(req: tasks_fn.CallableRequest):
     """Background worker function triggered by Cloud Tasks."""
     # The data from the enqueued task is in req.data
-    run_agent_task_wrapper(req.data)
\ No newline at end of file
+    run_agent_task_wrapper(req.data)
+
+# Task handler for building and deploying agents to Vertex AI in the background
+@tasks_fn.on_task_dispatched(
+    rate_limits=RateLimits(max_concurrent_dispatches=5),
+    retry_config=RetryConfig(max_attempts=1), # A failed deploy is recorded on the agent doc; the user retries
+    timeout_sec=1800,
+    memory=options.MemoryOption.GB_2,
+    cpu=1
+)
+def executeAgentDeployTask(req: tasks_fn.CallableRequest):
+    """Background worker function that runs the deployment phases for one agent."""
+    run_agent_deploy_task_wrapper(req.data)
+
+# Task handler that advances bulk deploy/redeploy/delete operations, one tick per task
+@tasks_fn.on_task_dispatched(
+    rate_limits=RateLimits(max_concurrent_dispatches=10),
+    retry_config=RetryConfig(max_attempts=3, min_backoff_seconds=10), # Only a failed tick claim is retried
+    timeout_sec=540,
+    memory=options.MemoryOption.GB_1
+)
+def executeFleetOperationTask(req: tasks_fn.CallableRequest):
+    """Background worker function that polls and starts the agents of one fleet operation."""
+    run_fleet_operation_task_wrapper(req.data)
@@ -0,0 +1,12 @@
+# functions/tests/conftest.py
+import os
+import sys
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if FUNCTIONS_DIR not in sys.path:
+    sys.path.insert(0, FUNCTIONS_DIR)
+
+# common.core initializes Firebase at import time; the benchmarks' fake lets common.* import offline.
+from benchmarks.fake_firestore import FakeFirestore, install_fake_core
+
+install_fake_core(FakeFirestore())
@@ -0,0 +1,128 @@
+# functions/tests/test_rate_limiter.py
+import asyncio
+import random
+import types
+
+import pytest
+
+from common import rate_limiter
+from common.rate_limiter import RateLimitSpec, _take_from_buckets
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+class _Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _DocumentRef:
+    def __init__(self, store, doc_id):
+        self.store = store
+        self.id = doc_id
+
+
+class _Transaction:
+    def __init__(self, store):
+        self.store = store
+        self.writes = {}
+
+    def set(self, ref, data):
+        self.writes[ref.id] = dict(data)
+
+
+class _AsyncDb:
+    """Just enough of the async Firestore client for the sharded limiter."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def collection(self, name):
+        return types.SimpleNamespace(document=lambda doc_id: _DocumentRef(self, doc_id))
+
+    async def get_all(self, refs, transaction=None):
+        for ref in refs:
+            yield _Snapshot(ref.id, self.docs.get(ref.id))
+
+    def transaction(self):
+        return _Transaction(self)
+
+
+def _async_transactional(func):
+    async def run(transaction):
+        result = await func(transaction)
+        transaction.store.docs.update(transaction.writes)
+        return result
+    return run
+
+
+@pytest.fixture
+def sharded_limiter(monkeypatch):
+    clock = _Clock()
+    async_db = _AsyncDb()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    monkeypatch.setattr(rate_limiter, "get_async_db", lambda: async_db)
+    monkeypatch.setattr(rate_limiter, "firestore", types.SimpleNamespace(async_transactional=_async_transactional))
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_FIRESTORE_SHARDS", 4)
+    random.seed(7)
+
+    def take(spec, request_tokens):
+        return asyncio.run(rate_limiter._take_from_firestore(spec, request_tokens))
+
+    return types.SimpleNamespace(clock=clock, take=take)
+
+
+def test_shards_do_not_admit_large_requests_past_tpm(sharded_limiter):
+    spec = RateLimitSpec(key="openai/gpt", rpm=None, tpm=40000, max_concurrent=None)
+    admitted = [sharded_limiter.take(spec, 30000) == 0.0 for _ in range(4)]
+    assert admitted == [True, False, False, False]
+
+
+def test_shards_do_not_admit_past_rpm_below_shard_count(sharded_limiter):
+    spec = RateLimitSpec(key="openai/gpt", rpm=2, tpm=None, max_concurrent=None)
+    admitted_count = sum(sharded_limiter.take(spec, 10) == 0.0 for _ in range(10))
+    assert admitted_count == 2
+
+
+def test_shards_never_admit_more_than_the_limit_per_minute(sharded_limiter):
+    spec = RateLimitSpec(key="openai/gpt", rpm=30, tpm=40000, max_concurrent=None)
+    start = sharded_limiter.clock.now
+    admitted_requests, admitted_tokens = 0, 0
+    request_sizes = random.Random(3)
+    while sharded_limiter.clock.now - start < 60.0:
+        request_tokens = request_sizes.choice((500, 4000, 12000, 25000)) # Some exceed tpm / 4 shards
+        if sharded_limiter.take(spec, request_tokens) == 0.0:
+            admitted_requests += 1
+            admitted_tokens += request_tokens
+        elapsed = sharded_limiter.clock.now - start
+        # A bucket starts full (one minute of capacity) and refills at the limit per minute.
+        assert admitted_requests <= spec.rpm * (1 + elapsed / 60.0) + 1e-6
+        assert admitted_tokens <= spec.tpm * (1 + elapsed / 60.0) + 1e-6
+        sharded_limiter.clock.now += 0.5
+
+
+def test_request_larger_than_tpm_waits_for_full_buckets():
+    states, wait_sec = _take_from_buckets([{}], None, 1000, 5000, now=0.0)
+    assert wait_sec == 0.0 and states[0]["tokens"] == 0.0 # Admitted once, charged the whole bucket
+    _, wait_sec = _take_from_buckets(states, None, 1000, 5000, now=0.0)
+    assert wait_sec == pytest.approx(60.0)
+
+
+def test_wait_is_computed_from_the_combined_refill_of_all_shards():
+    empty_shards = [{"tokens": 0.0, "updatedAt": 0.0} for _ in range(4)]
+    _, wait_sec = _take_from_buckets(empty_shards, None, 40000, 20000, now=0.0)
+    assert wait_sec == pytest.approx(30.0)
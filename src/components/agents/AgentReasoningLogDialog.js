@@ -102,13 +102,14 @@ const EventActionsDisplay = ({ actions }) => {
 };
 
 
-const AgentReasoningLogDialog = ({ open, onClose, events }) => {
+// hasMoreEvents / onLoadMoreEvents / isLoadingEvents are used for runs whose events are read in pages.
+const AgentReasoningLogDialog = ({ open, onClose, events, hasMoreEvents = false, onLoadMoreEvents, isLoadingEvents = false }) => {
     if (!events || events.length === 0) {
         return (
             <Dialog open={open} onClose={onClose} maxWidth="sm">
                 <DialogTitle>Agent Reasoning Log</DialogTitle>
                 <DialogContent>
-                    <Typography>No events to display for this turn.</Typography>
+                    <Typography>{isLoadingEvents ? 'Loading events...' : 'No events to display for this turn.'}</Typography>
                 </DialogContent>
                 <DialogActions>
                     <Button onClick={onClose}>Close</Button>
@@ -119,7 +120,7 @@ const AgentReasoningLogDialog = ({ open, onClose, events }) => {
 
     return (
         <Dialog open={open} onClose={onClose} maxWidth="md" fullWidth scroll="paper">
-            <DialogTitle>Agent Reasoning Log ({events.length} {events.length === 1 ? 'event' : 'events'})</DialogTitle>
+            <DialogTitle>Agent Reasoning Log ({events.length}{hasMoreEvents ? '+' : ''} {events.length === 1 && !hasMoreEvents ? 'event' : 'events'})</DialogTitle>
             <DialogContent dividers>
                 {events.map((event, index) => (
                     <Accordion key={event.id || index} sx={{ mb: 1 }} TransitionProps={{ unmountOnExit: true }}>
@@ -142,6 +143,11 @@ const AgentReasoningLogDialog = ({ open, onClose, events }) => {
                 ))}
             </DialogContent>
             <DialogActions>
+                {hasMoreEvents && (
+                    <Button onClick={onLoadMoreEvents} disabled={isLoadingEvents}>
+                        {isLoadingEvents ? 'Loading...' : 'Load more events'}
+                    </Button>
+                )}
                 <Button onClick={onClose}>Close</Button>
             </DialogActions>
         </Dialog>
@@ -16,6 +16,17 @@ import HelpOutlineIcon from '@mui/icons-material/HelpOutline';
 import AutorenewIcon from '@mui/icons-material/Autorenew';
 
 
+const DEPLOYMENT_PHASES = ['instantiate', 'package', 'upload', 'build', 'activate'];
+
+const formatDeploymentPhases = (phases) => DEPLOYMENT_PHASES
+    .filter(phase => phases[phase])
+    .map(phase => {
+        const { status, durationSec } = phases[phase];
+        if (status === 'running') return `${phase}: running`;
+        return `${phase}: ${durationSec}s${status === 'failed' ? ' (failed)' : ''}`;
+    })
+    .join(' · ');
+
 const getStatusIconAndColor = (deploymentStatus, isPollingActive) => {
     if (!deploymentStatus) return { icon: <CloudOffIcon color="disabled" />, color: 'text.disabled', text: 'Unknown' };
 
@@ -54,7 +65,8 @@ const DeploymentControls = ({
     if (!agent) return null;
 
     const statusInfo = getStatusIconAndColor(agent.deploymentStatus, !!pollingIntervalId);
-    const canAttemptDeploy = !['deploying_initiated', 'deploying_in_progress', 'deployed'].includes(agent.deploymentStatus);
+    // Redeploying an unchanged agent is a no-op on the backend, and config-only changes update the existing engine.
+    const canAttemptDeploy = !['deploying_initiated', 'deploying_in_progress'].includes(agent.deploymentStatus);
     const canDeleteDeployment = agent.vertexAiResourceName && !['deploying_initiated', 'deploying_in_progress'].includes(agent.deploymentStatus);
     const isDeploymentProcessActive = ['deploying_initiated', 'deploying_in_progress'].includes(agent.deploymentStatus);
 
@@ -78,6 +90,17 @@ const DeploymentControls = ({
                 </Typography>
             </Box>
 
+            {agent.deploymentProgress?.phases && Object.keys(agent.deploymentProgress.phases).length > 0 && (
+                <Typography variant="caption" color="text.secondary" display="block" sx={{ mb: 1 }}>
+                    {agent.deploymentProgress.mode === 'update' ? 'Updating engine' : agent.deploymentProgress.mode === 'rebuild' ? 'Rebuilding engine' : 'Phases'}: {formatDeploymentPhases(agent.deploymentProgress.phases)}
+                </Typography>
+            )}
+            {agent.deploymentProgress?.state === 'skipped' && (
+                <Typography variant="caption" color="text.secondary" display="block" sx={{ mb: 1 }}>
+                    Last deployment skipped: the configuration is unchanged.
+                </Typography>
+            )}
+
             {agent.vertexAiResourceName && (<Typography variant="caption" color="text.secondary" display="block" sx={{ mb: 1 }}>Resource: {agent.vertexAiResourceName}</Typography>)}
 
             {agent.lastDeployedAt?.toDate && agent.deploymentStatus === 'deployed' && (
@@ -109,7 +132,7 @@ const DeploymentControls = ({
                         disabled={isLoadingPage || isDeploying || isCheckingStatus || isDeleting}
                         startIcon={isDeploying ? <CircularProgress size={20} color="inherit" /> : <CloudUploadIcon />}
                     >
-                        {isDeploying ? 'Initiating...' : (agent.deploymentStatus?.includes('error') ? 'Retry Deployment' : 'Deploy to Vertex AI')}
+                        {isDeploying ? 'Initiating...' : (agent.deploymentStatus?.includes('error') ? 'Retry Deployment' : (agent.deploymentStatus === 'deployed' ? 'Redeploy' : 'Deploy to Vertex AI'))}
                     </Button>
                 )}
                 {canDeleteDeployment && (
@@ -10,7 +10,8 @@ import DeveloperModeIcon from '@mui/icons-material/DeveloperMode';
 const MessageActions = ({ message, messagesMap, activePath, onNavigate, onFork, onViewLog, getChildrenForMessage, findLeafOfBranch }) => {
     const children = getChildrenForMessage(messagesMap, message.id);
     const hasForks = children.length > 1;
-    const hasEvents = message.outputEvents && message.outputEvents.length > 0;
+    const hasSubcollectionEvents = message.run?.eventStorage === 'subcollection' && (message.run?.eventsSummary?.count || 0) > 0;
+    const hasEvents = (message.outputEvents && message.outputEvents.length > 0) || hasSubcollectionEvents;
     const isContextMessage = message.participant === 'context_stuffed';
 
     // Find which of my children is in the active path
@@ -45,7 +46,7 @@ const MessageActions = ({ message, messagesMap, activePath, onNavigate, onFork,
             <Box sx={{ position: isContextMessage ? 'static' : 'absolute', right: 0, top: '50%', transform: isContextMessage ? 'none' : 'translateY(-50%)', display: 'flex', alignItems: 'center' }}>
                 {hasEvents && (
                     <Tooltip title="View Agent Reasoning Log">
-                        <IconButton size="small" onClick={() => onViewLog(message.outputEvents)}>
+                        <IconButton size="small" onClick={() => onViewLog(message)}>
                             <DeveloperModeIcon fontSize="small" />
                         </IconButton>
                     </Tooltip>
@@ -23,6 +23,7 @@ const ModelForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
     const [modelString, setModelString] = useState(initialData.modelString || DEFAULT_LITELLM_BASE_MODEL_ID);
     const [systemInstruction, setSystemInstruction] = useState(initialData.systemInstruction || '');
     const [temperature, setTemperature] = useState(initialData.temperature ?? 0.7);
+    const [responseCacheEnabled, setResponseCacheEnabled] = useState(initialData.responseCacheEnabled || false);
 
     const [formError, setFormError] = useState('');
 
@@ -57,6 +58,7 @@ const ModelForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
             modelString,
             systemInstruction,
             temperature,
+            responseCacheEnabled,
         };
 
         onSubmit(modelData);
@@ -156,6 +158,13 @@ const ModelForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
                         />
                         <FormHelperText>Controls randomness. Lower values are more deterministic.</FormHelperText>
                     </Grid>
+                    <Grid item xs={12}>
+                        <FormControlLabel
+                            control={<Switch checked={responseCacheEnabled} onChange={(e) => setResponseCacheEnabled(e.target.checked)} />}
+                            label="Cache responses"
+                        />
+                        <FormHelperText>Reuses the previous answer to an identical prompt. Only applies at temperature 0.</FormHelperText>
+                    </Grid>
                     <Grid item xs={12}>
                         <TextField
                             label="System Instruction (System Prompt)"
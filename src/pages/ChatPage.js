@@ -1,8 +1,8 @@
 // src/pages/ChatPage.js
-import React, { useState, useEffect, useMemo } from 'react';
+import React, { useState, useEffect, useMemo, useRef } from 'react';
 import { useParams } from 'react-router-dom';
 import { useAuth } from '../contexts/AuthContext';
-import { getChatDetails, listenToChatMessages, addChatMessage, getModelsForProjects, getAgentsForProjects } from '../services/firebaseService';
+import { getChatDetails, listenToChatMessages, addChatMessage, getModelsForProjects, getAgentsForProjects, getChatMessageRunEventsPage } from '../services/firebaseService';
 import { executeQuery } from '../services/agentService';
 import LoadingSpinner from '../components/common/LoadingSpinner';
 import ErrorMessage from '../components/common/ErrorMessage';
@@ -120,6 +120,9 @@ const ChatPage = () => {
     // Reasoning Log Dialog State
     const [isReasoningLogOpen, setIsReasoningLogOpen] = useState(false);
     const [selectedEventsForLog, setSelectedEventsForLog] = useState([]);
+    const [logEventsNextAfterSeq, setLogEventsNextAfterSeq] = useState(null); // Paging cursor for subcollection runs
+    const [isLoadingLogEvents, setIsLoadingLogEvents] = useState(false);
+    const logEventsMessageIdRef = useRef(null); // Message whose events are being paged
 
     // Context Stuffing State
     const [contextModalType, setContextModalType] = useState(null);
@@ -182,9 +185,40 @@ const ChatPage = () => {
         setActiveLeafMsgId(newLeafId);
     };
 
-    const handleOpenReasoningLog = (events) => {
-        setSelectedEventsForLog(events || []);
+    const loadReasoningLogPage = async (messageId, afterSeq) => {
+        setIsLoadingLogEvents(true);
+        try {
+            const { events, nextAfterSeq } = await getChatMessageRunEventsPage(chatId, messageId, afterSeq);
+            if (logEventsMessageIdRef.current !== messageId) return; // Another message's log was opened meanwhile
+            setSelectedEventsForLog(prevEvents => afterSeq === null ? events : [...prevEvents, ...events]);
+            setLogEventsNextAfterSeq(nextAfterSeq);
+        } catch (err) {
+            console.error(`Error loading run events for message ${messageId}:`, err);
+        } finally {
+            if (logEventsMessageIdRef.current === messageId) setIsLoadingLogEvents(false);
+        }
+    };
+
+    const handleOpenReasoningLog = (message) => {
+        setLogEventsNextAfterSeq(null);
+        setIsLoadingLogEvents(false);
+        if (message.run?.eventStorage !== 'subcollection') {
+            logEventsMessageIdRef.current = null;
+            setSelectedEventsForLog(message.outputEvents || []);
+            setIsReasoningLogOpen(true);
+            return;
+        }
+        // Events were written to the message's events subcollection; read them page by page.
+        logEventsMessageIdRef.current = message.id;
+        setSelectedEventsForLog([]);
         setIsReasoningLogOpen(true);
+        loadReasoningLogPage(message.id, null);
+    };
+
+    const handleLoadMoreReasoningLog = () => {
+        if (logEventsMessageIdRef.current && logEventsNextAfterSeq !== null) {
+            loadReasoningLogPage(logEventsMessageIdRef.current, logEventsNextAfterSeq);
+        }
     };
 
     const handleCloseReasoningLog = () => {
@@ -339,9 +373,9 @@ const ChatPage = () => {
                                 </Box>
                                 <Paper variant="outlined" sx={{ p: 1.5, wordBreak: 'break-word', whiteSpace: 'pre-wrap', mb: 0.5,
                                     bgcolor: msg.participant?.startsWith('user') ? 'primary.light' : msg.participant?.startsWith('agent') ? 'grey.100' : 'secondary.light' }}>
-                                    {msg.content ? (
+                                    {(msg.content || msg.run?.partialContent) ? (
                                         <ReactMarkdown components={muiMarkdownComponentsConfig} remarkPlugins={[remarkGfm]}>
-                                            {msg.content}
+                                            {msg.content || msg.run?.partialContent}
                                         </ReactMarkdown>
                                     ) : (
                                         <Typography variant="body1" sx={{ color: "text.secondary" }}>(no content)</Typography>
@@ -437,6 +471,9 @@ const ChatPage = () => {
                 open={isReasoningLogOpen}
                 onClose={handleCloseReasoningLog}
                 events={selectedEventsForLog}
+                hasMoreEvents={logEventsNextAfterSeq !== null}
+                onLoadMoreEvents={handleLoadMoreReasoningLog}
+                isLoadingEvents={isLoadingLogEvents}
             />
             {isContextModalOpen && contextModalType === 'webpage' && ( <WebPageContextModal open={isContextModalOpen} onClose={handleCloseContextModal} onSubmit={handleContextSubmit} /> )}
             {isContextModalOpen && contextModalType === 'gitrepo' && ( <GitRepoContextModal open={isContextModalOpen} onClose={handleCloseContextModal} onSubmit={handleContextSubmit} /> )}
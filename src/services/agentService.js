@@ -8,6 +8,7 @@ const deleteVertexAgentCallable = createCallable('delete_vertex_agent');
 const checkVertexAgentDeploymentStatusCallable = createCallable('check_vertex_agent_deployment_status');
 const listMcpServerToolsCallable = createCallable('list_mcp_server_tools');
 const fetchA2AAgentCardCallable = createCallable('fetchA2AAgentCard');
+const fleetAgentOperationCallable = createCallable('fleet_agent_operation');
 
 export const fetchGofannonTools = async () => {
     try {
@@ -82,6 +83,18 @@ export const deployAgent = async (agentConfig, agentDocId) => {
     }
 };
 
+// Starts a bulk 'deploy', 'redeploy' or 'delete' over many agents. Progress is kept in the
+// returned fleetOperations/{fleetOperationId} document.
+export const runFleetAgentOperation = async (agentDocIds, action, maxConcurrency = null) => {
+    try {
+        const result = await fleetAgentOperationCallable({ agentDocIds, action, maxConcurrency });
+        return result.data;
+    } catch (error) {
+        console.error(`Error starting fleet '${action}' operation:`, error);
+        throw error;
+    }
+};
+
 // This function now handles querying agents OR models
 export const executeQuery = async ({ agentId, modelId, message, adkUserId, chatId, parentMessageId, stuffedContextItems = null }) => {
     try {
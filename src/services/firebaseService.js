@@ -15,7 +15,9 @@ import {
     serverTimestamp,
     orderBy,
     onSnapshot,
-    writeBatch
+    writeBatch,
+    limit,
+    startAfter
 } from 'firebase/firestore';
 
 // --- Projects ---
@@ -137,6 +139,8 @@ export const createAgentInFirestore = async (currentUserId, agentData, isImportO
         delete sanitizedData.lastDeployedAt;
         delete sanitizedData.lastDeploymentAttemptAt;
         delete sanitizedData.deploymentError;
+        delete sanitizedData.deploymentFingerprint;
+        delete sanitizedData.deploymentProgress;
         // API keys should never be carried over in a copy or import.
         delete sanitizedData.litellm_api_key;
         if (sanitizedData.childAgents && Array.isArray(sanitizedData.childAgents)) {
@@ -251,23 +255,40 @@ export const updateChat = async (chatId, chatData) => {
     });
 };
 
+// Firestore batches hold at most 500 writes.
+const FIRESTORE_BATCH_LIMIT = 500;
+
+const deleteDocsInBatches = async (docRefs) => {
+    for (let start = 0; start < docRefs.length; start += FIRESTORE_BATCH_LIMIT) {
+        const batch = writeBatch(db);
+        docRefs.slice(start, start + FIRESTORE_BATCH_LIMIT).forEach((docRef) => batch.delete(docRef));
+        await batch.commit();
+    }
+};
+
 export const deleteChat = async (chatId) => {
     const chatRef = doc(db, "chats", chatId);
     const messagesRef = collection(db, "chats", chatId, "messages");
-
-    const batch = writeBatch(db);
-
-    // Get all messages and add delete operations to the batch
-    const messagesSnapshot = await getDocs(messagesRef);
-    messagesSnapshot.forEach((messageDoc) => {
-        batch.delete(messageDoc.ref);
-    });
-
-    // Add the chat document delete operation to the batch
-    batch.delete(chatRef);
-
-    // Commit the batch
-    await batch.commit();
+    const historySummariesRef = collection(db, "chats", chatId, "historySummaries");
+
+    // Get all messages and the backend's rolling history summaries
+    const [messagesSnapshot, historySummariesSnapshot] = await Promise.all([
+        getDocs(messagesRef),
+        getDocs(historySummariesRef)
+    ]);
+    // Runs stored with EVENT_STORAGE_MODE "subcollection" keep their events under messages/{id}/events
+    const eventsSnapshots = await Promise.all(messagesSnapshot.docs
+        .filter((messageDoc) => messageDoc.data().run?.eventStorage === 'subcollection')
+        .map((messageDoc) => getDocs(collection(messageDoc.ref, "events"))));
+    const docRefs = [
+        ...eventsSnapshots.flatMap((eventsSnapshot) => eventsSnapshot.docs.map((eventDoc) => eventDoc.ref)),
+        ...messagesSnapshot.docs.map((messageDoc) => messageDoc.ref),
+        ...historySummariesSnapshot.docs.map((summaryDoc) => summaryDoc.ref)
+    ];
+
+    // Children first, the chat document last
+    await deleteDocsInBatches(docRefs);
+    await deleteDoc(chatRef);
 };
 
 export const addChatMessage = async (chatId, messageData) => {
@@ -317,6 +338,23 @@ export const listenToChatMessages = (chatId, onUpdate) => {
     return unsubscribe;
 };
 
+export const RUN_EVENTS_PAGE_SIZE = 100;
+
+// One page of the events of a run stored with EVENT_STORAGE_MODE "subcollection" (message.run.eventStorage),
+// in sequence order. Pass nextAfterSeq back to read the following page; it is null after the last page.
+export const getChatMessageRunEventsPage = async (chatId, messageId, afterSeq = null, pageSize = RUN_EVENTS_PAGE_SIZE) => {
+    const eventsRef = collection(db, "chats", chatId, "messages", messageId, "events");
+    const q = afterSeq === null
+        ? query(eventsRef, orderBy("seq", "asc"), limit(pageSize))
+        : query(eventsRef, orderBy("seq", "asc"), startAfter(afterSeq), limit(pageSize));
+    const querySnapshot = await getDocs(q);
+    const eventDocs = querySnapshot.docs.map(eventDoc => eventDoc.data());
+    return {
+        events: eventDocs.map(eventDoc => eventDoc.event),
+        nextAfterSeq: eventDocs.length === pageSize ? eventDocs[eventDocs.length - 1].seq : null
+    };
+};
+
 export const updateChatMessage = async (chatId, messageId, dataToUpdate) => {
     const messageRef = doc(db, "chats", chatId, "messages", messageId);
     await updateDoc(messageRef, dataToUpdate);